@@ -0,0 +1,691 @@
+"""
+Persistent per-user ANN index
+IVF index over memory-mapped vectors, one shard directory per user, kept current by a Cosmos DB
+change feed consumer so questions no longer scan the user's partition
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import itertools
+import weakref
+import tempfile
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, one process per directory is up to the deployment
+    fcntl = None
+
+from data_access import query_user_items
+from vector_codec import decode_embedding
+
+
+ANN_INDEX_ENABLED = os.getenv("ANN_INDEX", "on").lower() not in ("off", "false", "0")
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR") or os.path.join(tempfile.gettempdir(), "ann-index")
+# Shards kept open (memory-mapped) at once
+ANN_OPEN_SHARDS = int(os.getenv("ANN_OPEN_SHARDS", "64"))
+# Vectors are stored normalized in this precision (float16 keeps recall, see bench_embedding_encoding)
+ANN_VECTOR_DTYPE = np.dtype(os.getenv("ANN_VECTOR_DTYPE", "float16"))
+
+# Below ANN_TRAIN_MIN vectors a shard is searched exhaustively; above it, vectors are grouped
+# into ~sqrt(n) IVF lists and a question only scores the ANN_NPROBE closest lists
+ANN_TRAIN_MIN = int(os.getenv("ANN_TRAIN_MIN", "5000"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "12"))
+# Lists are re-trained locally (no Cosmos reads) once a shard grows by this factor
+ANN_RETRAIN_GROWTH = float(os.getenv("ANN_RETRAIN_GROWTH", "4"))
+ANN_TRAIN_SAMPLE = 50000
+
+# Change feed polling interval, and how often an open shard's ids are compared with Cosmos DB
+# (the latest-version change feed doesn't report deletes made outside this server)
+ANN_CHANGE_FEED_SECONDS = float(os.getenv("ANN_CHANGE_FEED_SECONDS", "5"))
+ANN_RECONCILE_SECONDS = float(os.getenv("ANN_RECONCILE_SECONDS", "900"))
+
+_INITIAL_CAPACITY = 1024
+_FETCH_BATCH = 100
+_EMBEDDED_FIELDS = "c.id, c.title, c.sourceFile, c.fileName, c.embedding, c.embeddingEncoding, c._ts"
+
+
+def _normalized(item):
+    vector = decode_embedding(item["embedding"], item.get("embeddingEncoding")).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _kmeans(sample, lists, iterations=10, seed=0):
+    """Spherical k-means: centroids are unit vectors, assignment by cosine similarity"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        groups, starts = np.unique(assignment[order], return_index=True)
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids[groups] = sums / norms
+    return centroids
+
+
+class AnnShard:
+    """
+    One user's vectors: a memory-mapped (capacity, dimensions) matrix, a SQLite file mapping
+    slots to document ids and IVF lists, and the list centroids
+    """
+
+    def __init__(self, directory, user_id):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.user_id = user_id
+        self.opened_at = time.monotonic()
+        self._lock = threading.RLock()
+        self._vectors_path = os.path.join(directory, "vectors.npy")
+        self._centroids_path = os.path.join(directory, "centroids.npy")
+
+        self._db = sqlite3.connect(os.path.join(directory, "items.sqlite3"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                slot INTEGER PRIMARY KEY,
+                doc_id TEXT NOT NULL UNIQUE,
+                list_no INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                title TEXT,
+                source_file TEXT,
+                file_name TEXT
+            );
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self._db.commit()
+        self._settings = dict(self._db.execute("SELECT key, value FROM settings"))
+        if "shardId" not in self._settings:
+            self._set("shardId", uuid.uuid4().hex)
+            self._set("changes", 0)
+            self._db.commit()
+
+        self._vectors = np.load(self._vectors_path, mmap_mode="r+") if os.path.exists(self._vectors_path) else None
+        self._centroids = np.load(self._centroids_path) if os.path.exists(self._centroids_path) else None
+
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        self._lists = np.full(capacity, -1, dtype=np.int32)  # -1: free slot
+        self._slots = {}  # doc id -> slot
+        self._items = {}  # slot -> (doc id, ts, title, sourceFile, fileName)
+        for slot, doc_id, list_no, ts, title, source_file, file_name in self._db.execute("SELECT * FROM items"):
+            self._slots[doc_id] = slot
+            self._items[slot] = (doc_id, ts, title, source_file, file_name)
+            self._lists[slot] = list_no
+        self._high_water = max(self._items, default=-1) + 1
+        self._free = sorted(set(range(self._high_water)) - set(self._items), reverse=True)
+
+    def _set(self, key, value):
+        self._settings[key] = str(value)
+        self._db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def complete(self):
+        """True once the shard holds every embedded document of the user"""
+        return self._settings.get("complete") == "1"
+
+    @property
+    def scanned_at(self):
+        """Wall-clock time of the last full scan (0 for shards built before it was recorded)"""
+        return float(self._settings.get("scannedAt", 0))
+
+    def mark_complete(self):
+        with self._lock:
+            self._set("complete", 1)
+            self._set("scannedAt", time.time())
+            self._db.commit()
+
+    @property
+    def document_version(self):
+        """Version stamp of the user's document set the shard was last brought up to date with"""
+        return self._settings.get("documentVersion")
+
+    def set_document_version(self, document_version):
+        with self._lock:
+            self._set("documentVersion", document_version)
+            self._db.commit()
+
+    @property
+    def version(self):
+        """Changes whenever a vector is added, replaced or removed"""
+        return f"{self._settings['shardId']}:{self._settings['changes']}"
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._slots
+
+    def doc_ids(self):
+        with self._lock:
+            return list(self._slots)
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._vectors = None
+            self._db.close()
+
+    # --- Updates ---
+
+    def _take_slot(self, dimensions):
+        if self._free:
+            return self._free.pop()
+        if self._vectors is None or self._high_water == self._vectors.shape[0]:
+            self._grow(dimensions)
+        self._high_water += 1
+        return self._high_water - 1
+
+    def _grow(self, dimensions):
+        old = self._vectors
+        capacity = max(_INITIAL_CAPACITY, 2 * (0 if old is None else old.shape[0]))
+        scratch = self._vectors_path + ".tmp"
+        grown = np.lib.format.open_memmap(scratch, mode="w+", dtype=ANN_VECTOR_DTYPE, shape=(capacity, dimensions))
+        if old is not None:
+            grown[:self._high_water] = old[:self._high_water]
+        grown.flush()
+        del grown, old
+        self._vectors = None
+        os.replace(scratch, self._vectors_path)
+        self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+        self._lists = np.concatenate([self._lists, np.full(capacity - len(self._lists), -1, dtype=np.int32)])
+
+    def _nearest_list(self, vector):
+        if self._centroids is None:
+            return 0
+        return int(np.argmax(self._centroids @ vector))
+
+    def apply(self, upserts=(), deletes=()):
+        """
+        Apply changed and deleted documents
+
+        Upserts carry 'embedding' (any vector_codec encoding); a document that lost its embedding is
+        removed. A change older (by _ts) than the stored copy is ignored, so replays are harmless.
+
+        Args:
+            upserts (iterable): Documents as stored in Cosmos DB
+            deletes (iterable): Ids of deleted documents
+
+        Returns:
+            int: Number of vectors added, replaced or removed
+        """
+        deletes = set(deletes)
+        changed = 0
+        with self._lock:
+            rows = []
+            for item in upserts:
+                if not item.get("embedding"):
+                    deletes.add(item["id"])
+                    continue
+                vector = _normalized(item)
+                ts = item.get("_ts") or 0
+                slot = self._slots.get(item["id"])
+                if slot is not None and ts < self._items[slot][1]:
+                    continue
+                if self._vectors is not None and vector.shape[0] != self._vectors.shape[1]:
+                    print(f"[ANN Index] Skipping {item['id']}: {vector.shape[0]} dimensions, index has {self._vectors.shape[1]}")
+                    continue
+                if slot is None:
+                    slot = self._take_slot(vector.shape[0])
+                self._vectors[slot] = vector
+                self._lists[slot] = self._nearest_list(vector)
+                self._slots[item["id"]] = slot
+                self._items[slot] = (item["id"], ts, item.get("title"), item.get("sourceFile"), item.get("fileName"))
+                rows.append((slot, item["id"], int(self._lists[slot]), ts,
+                             item.get("title"), item.get("sourceFile"), item.get("fileName")))
+            if rows:
+                self._db.executemany("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                changed += len(rows)
+
+            removed = [self._slots.pop(doc_id) for doc_id in deletes if doc_id in self._slots]
+            for slot in removed:
+                self._lists[slot] = -1
+                self._items.pop(slot, None)
+                self._free.append(slot)
+            if removed:
+                self._db.executemany("DELETE FROM items WHERE slot = ?", [(slot,) for slot in removed])
+                self._free.sort(reverse=True)
+                changed += len(removed)
+
+            if changed:
+                self._vectors.flush()
+                self._set("changes", int(self._settings["changes"]) + 1)
+                self._db.commit()
+                self._maybe_train()
+        return changed
+
+    def _maybe_train(self):
+        live = len(self._slots)
+        trained = int(self._settings.get("trainedCount", 0))
+        if live < ANN_TRAIN_MIN or (self._centroids is not None and live < trained * ANN_RETRAIN_GROWTH):
+            return
+
+        started = time.perf_counter()
+        slots = np.flatnonzero(self._lists[:self._high_water] >= 0)
+        rng = np.random.default_rng(0)
+        sample_slots = np.sort(rng.choice(slots, min(len(slots), ANN_TRAIN_SAMPLE), replace=False))
+        lists = int(np.clip(np.sqrt(live), 16, 4096))
+        centroids = _kmeans(self._vectors[sample_slots].astype(np.float32), lists)
+
+        for start in range(0, len(slots), 8192):
+            block = slots[start:start + 8192]
+            self._lists[block] = np.argmax(self._vectors[block].astype(np.float32) @ centroids.T, axis=1)
+        self._db.executemany(
+            "UPDATE items SET list_no = ? WHERE slot = ?",
+            [(int(self._lists[slot]), int(slot)) for slot in slots]
+        )
+        np.save(self._centroids_path, centroids)
+        self._centroids = centroids
+        self._set("trainedCount", live)
+        self._db.commit()
+        print(f"[ANN Index] Trained {lists} lists over {live} vectors for user {self.user_id} "
+              f"in {time.perf_counter() - started:.1f}s")
+
+    # --- Queries ---
+
+    def search(self, query_embedding, k, min_score=0.0):
+        """
+        Approximate top-k by cosine similarity
+
+        Returns:
+            list: {"id", "title", "sourceFile", "fileName", "score"} dicts, best match first
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or k <= 0:
+            return []
+        query = query / norm
+
+        with self._lock:
+            if not self._slots:
+                return []
+            lists = self._lists[:self._high_water]
+            if self._centroids is None:
+                candidates = np.flatnonzero(lists >= 0)
+            else:
+                nprobe = min(ANN_NPROBE, len(self._centroids))
+                probe = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+                candidates = np.flatnonzero(np.isin(lists, probe))
+            if not candidates.size:
+                return []
+            scores = self._vectors[candidates].astype(np.float32) @ query
+
+            k = min(k, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results = []
+            for i in top:
+                if scores[i] < min_score:
+                    continue
+                doc_id, _, title, source_file, file_name = self._items[int(candidates[i])]
+                results.append({
+                    "id": doc_id, "title": title, "sourceFile": source_file, "fileName": file_name,
+                    "score": float(scores[i]),
+                })
+            return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "vectors": len(self._slots),
+                "capacity": 0 if self._vectors is None else int(self._vectors.shape[0]),
+                "lists": 0 if self._centroids is None else int(len(self._centroids)),
+                "complete": self.complete,
+                "version": self.version,
+            }
+
+
+class AnnIndex:
+    """Per-user shards under one directory, opened on demand and kept in an LRU"""
+
+    def __init__(self, directory=ANN_INDEX_DIR, max_open=ANN_OPEN_SHARDS):
+        """
+        Raises:
+            RuntimeError: If another process is using the directory
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_open = max_open
+        self._lock_file = open(os.path.join(directory, ".lock"), "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise RuntimeError(f"{directory} is in use by another process")
+        self._shards = OrderedDict()
+        # Every shard object still alive, including ones evicted from the LRU while another thread uses
+        # them; reopening such a user revives that object instead of mapping the files a second time
+        self._live = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._user_locks = defaultdict(threading.Lock)
+        self._reconciled = {}  # user id -> monotonic time of the last id comparison
+        # Shards scanned before this time are scanned again on their next use (set when change feed
+        # entries may have been skipped)
+        self.rescan_before = 0.0
+        self.consumer = None
+
+    def _shard_dir(self, user_id):
+        return os.path.join(self.directory, hashlib.sha1(user_id.encode("utf-8")).hexdigest())
+
+    def _open(self, user_id, create=True):
+        with self._lock:
+            shard = self._shards.get(user_id)
+            if shard is not None:
+                self._shards.move_to_end(user_id)
+                return shard
+            shard = self._live.get(user_id)
+            if shard is None:
+                if not create and not os.path.isdir(self._shard_dir(user_id)):
+                    return None
+                shard = AnnShard(self._shard_dir(user_id), user_id)
+                self._live[user_id] = shard
+            self._shards[user_id] = shard
+            # Evicted shards are not closed: a search or change feed apply may still hold one. Every
+            # apply commits and flushes, so the last reference going away just unmaps and closes the files
+            while len(self._shards) > self.max_open:
+                self._shards.popitem(last=False)
+            return shard
+
+    def get(self, container, user_id, document_version=None):
+        """
+        Get the user's shard, building it from Cosmos DB only the first time
+
+        Args:
+            container: Cosmos DB container client
+            user_id (str): Partition key of the user
+            document_version (str, optional): Version stamp of the user's document set; when it
+                differs from the one the shard last saw, the shard is reconciled right away
+
+        Returns:
+            AnnShard: The user's shard (possibly empty)
+        """
+        shard = self._open(user_id)
+        if shard.complete and shard.scanned_at >= self.rescan_before:
+            if document_version is not None and shard.document_version != document_version:
+                # Documents changed, possibly through another worker process: its deletes never
+                # reach the change feed, so compare ids now instead of at the next reconcile
+                with self._user_locks[user_id]:
+                    if shard.document_version != document_version:
+                        try:
+                            self.sync()
+                        except Exception as e:
+                            print(f"[ANN Index] Sync failed: {e}")
+                        self._reconcile(container, shard)
+                        shard.set_document_version(document_version)
+            elif ANN_RECONCILE_SECONDS and time.monotonic() - self._reconciled.setdefault(
+                    user_id, time.monotonic()) >= ANN_RECONCILE_SECONDS:
+                self._reconcile(container, shard)
+            return shard
+
+        with self._user_locks[user_id]:
+            if not shard.complete or shard.scanned_at < self.rescan_before:
+                started = time.perf_counter()
+                indexed = set(shard.doc_ids())
+                items = query_user_items(
+                    container, user_id, "ann.build", f"SELECT {_EMBEDDED_FIELDS} FROM c WHERE IS_DEFINED(c.embedding)"
+                )
+                shard.apply(items)
+                # A rescan also drops what was deleted meanwhile
+                if indexed:
+                    shard.apply(deletes=indexed - {item["id"] for item in items})
+                shard.mark_complete()
+                if document_version is not None:
+                    shard.set_document_version(document_version)
+                self._reconciled[user_id] = time.monotonic()
+                print(f"[ANN Index] Built shard of {len(shard)} vectors for user {user_id} "
+                      f"in {time.perf_counter() - started:.1f}s")
+        return shard
+
+    def _reconcile(self, container, shard):
+        """Drop vectors whose documents are gone and fetch embedded documents the shard lacks"""
+        user_id = shard.user_id
+        self._reconciled[user_id] = time.monotonic()
+        stored = set(query_user_items(
+            container, user_id, "ann.reconcile", "SELECT VALUE c.id FROM c WHERE IS_DEFINED(c.embedding)"
+        ))
+        indexed = set(shard.doc_ids())
+        missing = list(stored - indexed)
+        for start in range(0, len(missing), _FETCH_BATCH):
+            shard.apply(query_user_items(
+                container, user_id, "ann.fetchMissing",
+                f"SELECT {_EMBEDDED_FIELDS} FROM c WHERE ARRAY_CONTAINS(@ids, c.id)",
+                [{"name": "@ids", "value": missing[start:start + _FETCH_BATCH]}]
+            ))
+        if indexed - stored:
+            shard.apply(deletes=indexed - stored)
+
+    def apply_changes(self, items):
+        """
+        Apply change feed documents to the shards of their users
+
+        Users without a shard are skipped; their first question builds one. Shards still being
+        built get the changes too, so nothing written during the initial scan is missed.
+
+        Returns:
+            int: Number of vectors changed
+        """
+        by_user = defaultdict(list)
+        for item in items:
+            if item.get("userId"):
+                by_user[item["userId"]].append(item)
+        changed = 0
+        for user_id, user_items in by_user.items():
+            shard = self._open(user_id, create=False)
+            if shard is not None:
+                # Chat sessions, manifests and other documents without embeddings only matter if indexed before
+                changed += shard.apply(
+                    [item for item in user_items if item.get("embedding") or item["id"] in shard]
+                )
+        return changed
+
+    def remove(self, user_id, doc_ids):
+        """Remove deleted documents (the change feed doesn't report deletes)"""
+        shard = self._open(user_id, create=False)
+        if shard is not None and doc_ids:
+            shard.apply(deletes=doc_ids)
+
+    def sync(self):
+        """Pull pending change feed entries now (e.g. right after an upload)"""
+        if self.consumer is not None:
+            self.consumer.poll()
+
+    def close(self):
+        """Stop the change feed consumer, flush the open shards and release the directory"""
+        if self.consumer is not None:
+            self.consumer.stop()
+        with self._lock:
+            self._shards.clear()
+            for shard in list(self._live.values()):
+                shard.close()
+        self._lock_file.close()
+
+    def stats(self):
+        """Totals over the open shards (no per-user details) and change feed progress"""
+        with self._lock:
+            shards = [shard.stats() for shard in self._shards.values()]
+        return {
+            "openShards": len(shards),
+            "vectors": sum(shard["vectors"] for shard in shards),
+            "ivfShards": sum(1 for shard in shards if shard["lists"]),
+            "changeFeed": self.consumer.stats() if self.consumer else None,
+        }
+
+
+class ChangeFeedConsumer:
+    """Polls the container's change feed and applies each page to the ANN shards"""
+
+    def __init__(self, index, container, interval=ANN_CHANGE_FEED_SECONDS):
+        """
+        Args:
+            index (AnnIndex): The index to keep current
+            container: Container client on a CosmosClient no other code uses, since the continuation
+                token is read from the client's last response headers
+        """
+        self.index = index
+        self.container = container
+        self.interval = interval
+        self._state_path = os.path.join(index.directory, "change-feed.json")
+        self._poll_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.applied = 0
+        self.last_poll = None
+        self.last_error = None
+        try:
+            with open(self._state_path) as f:
+                state = json.load(f)
+            self._continuation = state.get("continuation")
+            index.rescan_before = float(state.get("rescanBefore", 0))
+        except (OSError, ValueError):
+            self._continuation = None
+
+    def _save(self):
+        scratch = self._state_path + ".tmp"
+        with open(scratch, "w") as f:
+            json.dump({"continuation": self._continuation, "rescanBefore": self.index.rescan_before}, f)
+        os.replace(scratch, self._state_path)
+
+    def poll(self):
+        """
+        Apply everything written since the last poll
+
+        Returns:
+            int: Number of vectors changed
+        """
+        with self._poll_lock:
+            changed = self._drain(self._continuation)
+            if changed is None:
+                # Changes since the saved position can't be read any more: start from now and
+                # rescan every shard on its next use, instead of failing each poll from here on
+                self._continuation = None
+                self.index.rescan_before = time.time()
+                self._save()
+                changed = self._drain(None)
+            self.applied += changed
+            self.last_poll = time.strftime("%Y-%m-%dT%H:%M:%SZ")
+            return changed
+
+    def _drain(self, continuation):
+        """
+        Apply the feed from the continuation token (None: from now) and save the new position
+
+        Returns:
+            int | None: Number of vectors changed, None if the SDK rejected the continuation token
+        """
+        try:
+            if continuation:
+                feed = iter(self.container.query_items_change_feed(continuation=continuation))
+            else:
+                # First start: shards are built from a scan, so only later changes matter
+                feed = iter(self.container.query_items_change_feed(start_time="Now"))
+            # The token is decoded and sent with the first request
+            first = next(feed, None)
+        except Exception as e:
+            if continuation and _rejected_continuation(e):
+                print(f"[ANN Index] Saved change feed position rejected ({e}), restarting from now")
+                return None
+            raise
+
+        changed = 0
+        page = []
+        for item in feed if first is None else itertools.chain([first], feed):
+            page.append(item)
+            if len(page) >= 500:
+                changed += self.index.apply_changes(page)
+                page = []
+        changed += self.index.apply_changes(page)
+
+        # Once the feed is drained, the last response's ETag holds the SDK's composite continuation
+        # token (a response_hook would only see the raw per-range ETag); no other thread uses this client
+        continuation = self.container.client_connection.last_response_headers.get("etag")
+        if continuation:
+            self._continuation = continuation
+            self._save()
+        return changed
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[ANN Index] Change feed poll failed: {e}")
+
+    def start(self):
+        try:
+            self.poll()
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"[ANN Index] Change feed poll failed: {e}")
+        threading.Thread(target=self._run, name="ann-change-feed", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        return {"vectorsApplied": self.applied, "lastPoll": self.last_poll, "lastError": self.last_error}
+
+
+def _rejected_continuation(error):
+    """True for the SDK refusing a saved continuation token, as opposed to a failed request"""
+    if isinstance(error, (ValueError, KeyError, TypeError)):
+        return True  # not a token this SDK version can decode
+    # The service answers 400 for a token of another container or an unknown partition range
+    return getattr(error, "status_code", None) == 400
+
+
+# Global instance
+_ann_index_instance = None
+_ann_index_failed = False
+_ann_index_lock = threading.Lock()
+
+
+def get_ann_index(container=None):
+    """
+    Get or create the global ANN index, starting its change feed consumer when a container is given
+
+    Returns:
+        AnnIndex: The shared index, or None when disabled or its directory is unavailable
+            (callers then fall back to the in-memory EmbeddingIndexCache)
+    """
+    global _ann_index_instance, _ann_index_failed
+
+    if not ANN_INDEX_ENABLED or _ann_index_failed:
+        return None
+
+    with _ann_index_lock:
+        if _ann_index_instance is None:
+            try:
+                _ann_index_instance = AnnIndex()
+            except (OSError, RuntimeError, sqlite3.Error) as e:
+                print(f"[ANN Index] Disabled, cannot use {ANN_INDEX_DIR}: {e}")
+                _ann_index_failed = True
+                return None
+        if container is not None and _ann_index_instance.consumer is None:
+            from clients import new_cosmos_container
+
+            # The consumer reads its continuation from the client's last response headers, so it
+            # gets a client of its own
+            _ann_index_instance.consumer = ChangeFeedConsumer(_ann_index_instance, new_cosmos_container() or container)
+            _ann_index_instance.consumer.start()
+
+    return _ann_index_instance
+
+
+def close_ann_index():
+    """Close the global ANN index if it was opened (on graceful shutdown)"""
+    global _ann_index_instance
+
+    with _ann_index_lock:
+        if _ann_index_instance is not None:
+            _ann_index_instance.close()
+            _ann_index_instance = None
@@ -0,0 +1,99 @@
+"""
+Answer cache for the RAG endpoint
+Stores answers per user, keyed on the normalized question and a version stamp of the user's document set
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from embedding_cache import normalize_text
+
+
+RAG_ANSWER_CACHE_SIZE = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "1000"))
+RAG_ANSWER_CACHE_TTL_SECONDS = float(os.getenv("RAG_ANSWER_CACHE_TTL_SECONDS", "900"))
+
+
+def normalize_question(question):
+    """Case- and whitespace-insensitive form of a question"""
+    return normalize_text(question).lower()
+
+
+class AnswerCache:
+    """LRU + TTL cache of RAG responses"""
+
+    def __init__(self, max_entries=RAG_ANSWER_CACHE_SIZE, ttl_seconds=RAG_ANSWER_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # (user_id, key) -> (stored_at, response)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(question, version, *options):
+        """
+        Build the per-user key
+
+        Args:
+            question (str): The user's question
+            version (str): Version stamp of the user's document set
+            *options: Anything else that changes the answer (top-k, threshold, ...)
+        """
+        return (normalize_question(question), version, *options)
+
+    def get(self, user_id, key):
+        """Return the cached response, or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[(user_id, key)]
+                self.misses += 1
+                return None
+            self._entries.move_to_end((user_id, key))
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, key, response):
+        with self._lock:
+            self._entries[(user_id, key)] = (time.monotonic(), response)
+            self._entries.move_to_end((user_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Hit/miss counters since startup"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def invalidate_user(self, user_id):
+        """Drop every entry of a user (called after their uploads)"""
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[entry_key]
+
+
+# Global instance
+_answer_cache_instance = None
+
+
+def get_answer_cache():
+    """
+    Get or create the global answer cache
+
+    Returns:
+        AnswerCache: The shared cache instance
+    """
+    global _answer_cache_instance
+
+    if _answer_cache_instance is None:
+        _answer_cache_instance = AnswerCache()
+
+    return _answer_cache_instance
@@ -0,0 +1,565 @@
+"""
+ASGI entry point (async serving mode)
+Chat, RAG and upload requests run on the worker's event loop with the async OpenAI and Cosmos DB
+clients; every other route is passed through to the Flask app in server.py
+
+Usage (from backend/):
+    gunicorn -c gunicorn.conf.py asgi:application
+"""
+import os
+import asyncio
+from functools import wraps
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, Response, request, jsonify, g
+
+import server
+from ann_index import close_ann_index
+from async_clients import get_async_clients
+from context_packing import pack_context, format_context, source_summaries, RAG_PACK_CANDIDATE_FACTOR
+from conversation_store import valid_session_id
+from csv_ingest import spool_upload
+from embeddings import embed_text_async
+from resilience import ServiceUnavailableError
+from retrieval import fetch_contents_async, fuse_rankings, RAG_FUSION_CANDIDATES
+from streaming import wants_stream, sse_event, stream_chat_completion_async
+
+
+# Requests handled at once per worker; more wait up to ASYNC_QUEUE_SECONDS, then get a 503
+ASYNC_MAX_REQUESTS = int(os.getenv("ASYNC_MAX_REQUESTS", "256"))
+ASYNC_QUEUE_SECONDS = float(os.getenv("ASYNC_QUEUE_SECONDS", "5"))
+# Upstream calls one request may have in flight at once
+ASYNC_REQUEST_CONCURRENCY = int(os.getenv("ASYNC_REQUEST_CONCURRENCY", "2"))
+# Large uploads can take a while to arrive
+UPLOAD_BODY_TIMEOUT_SECONDS = float(os.getenv("UPLOAD_BODY_TIMEOUT_SECONDS", "600"))
+# On shutdown, running upload jobs get this long to finish (keep it under the server's graceful timeout)
+SHUTDOWN_JOB_SECONDS = float(os.getenv("SHUTDOWN_JOB_SECONDS", "25"))
+
+app = Quart(__name__)
+app.config["MAX_CONTENT_LENGTH"] = server.app.config["MAX_CONTENT_LENGTH"]
+app.config["BODY_TIMEOUT"] = UPLOAD_BODY_TIMEOUT_SECONDS
+
+clients = get_async_clients()
+_admission = asyncio.Semaphore(ASYNC_MAX_REQUESTS)
+_in_flight = 0
+_rejected = 0
+
+
+@app.before_serving
+async def startup():
+    """Open the async clients on the serving loop"""
+    await clients.open()
+
+
+@app.after_serving
+async def shutdown():
+    """
+    Graceful shutdown: the server has stopped accepting and drained open requests by now;
+    let upload jobs finish, then release the connection pools and the ANN index
+    """
+    try:
+        await asyncio.wait_for(asyncio.to_thread(server.job_manager.shutdown), SHUTDOWN_JOB_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"[Shutdown] Upload jobs still running after {SHUTDOWN_JOB_SECONDS:.0f}s")
+    await clients.close()
+    await asyncio.to_thread(close_ann_index)
+    print("[Shutdown] Worker stopped")
+
+
+@app.before_request
+async def apply_upload_limit():
+    """Apply the endpoint's upload limit (same limits as server.py)"""
+    limit = server.UPLOAD_LIMITS.get(request.endpoint)
+    if limit:
+        request.max_content_length = limit
+
+
+@app.after_request
+async def allow_cors(response):
+    # Preflight requests go to the Flask app, whose flask_cors defaults allow every origin
+    response.headers.setdefault("Access-Control-Allow-Origin", "*")
+    return response
+
+
+def token_required(f):
+    """server.token_required for async views"""
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if server.DEV_MODE:
+            request.user = {"sub": "dev-user", "name": "Dev User", "email": "dev@example.com"}
+            return await f(*args, **kwargs)
+
+        auth_header = request.headers.get("Authorization")
+        if not auth_header:
+            return jsonify({"error": "Token is missing"}), 401
+        try:
+            token = auth_header.split(" ")[1]
+        except IndexError:
+            return jsonify({"error": "Invalid authorization header"}), 401
+
+        # Cached claims skip the thread hop; a miss may fetch the signing keys
+        decoded = server.verified_tokens.get(token) or await asyncio.to_thread(server.verify_token, token)
+        if not decoded:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+        request.user = decoded
+        return await f(*args, **kwargs)
+
+    return decorated_function
+
+
+def _release_admission():
+    global _in_flight
+    _in_flight -= 1
+    _admission.release()
+
+
+def admitted(f):
+    """Cap the requests a worker handles at once, so a burst queues briefly instead of piling up upstream"""
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        global _in_flight, _rejected
+        try:
+            await asyncio.wait_for(_admission.acquire(), ASYNC_QUEUE_SECONDS)
+        except asyncio.TimeoutError:
+            _rejected += 1
+            return jsonify({"error": "Server is busy, try again shortly"}), 503, {"Retry-After": "1"}
+        _in_flight += 1
+        g.admission_held = True
+        try:
+            return await f(*args, **kwargs)
+        finally:
+            # An SSE response takes the slot over (see sse_response) and releases it when its stream ends
+            if g.pop("admission_held", False):
+                _release_admission()
+
+    return decorated_function
+
+
+class AdmittedStream:
+    """
+    SSE body holding the request's admission slot: released when the stream ends, fails, or is
+    closed or dropped before it started (e.g. the client disconnected)
+    """
+
+    def __init__(self, body):
+        self._body = body
+        self._held = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._body.__anext__()
+        except BaseException:
+            self._release()
+            raise
+
+    async def aclose(self):
+        try:
+            await self._body.aclose()
+        finally:
+            self._release()
+
+    def __del__(self):
+        self._release()
+
+    def _release(self):
+        if self._held:
+            self._held = False
+            _release_admission()
+
+
+class RequestCalls:
+    """
+    Upstream calls made for one request
+
+    At most ASYNC_REQUEST_CONCURRENCY run at once, and each also holds a slot of the
+    worker-wide limit of its upstream (see async_clients).
+    """
+
+    def __init__(self):
+        self._slots = asyncio.Semaphore(ASYNC_REQUEST_CONCURRENCY)
+
+    async def openai(self, call):
+        async with self._slots, clients.openai_limit.slot():
+            return await call()
+
+    async def cosmos(self, call):
+        async with self._slots, clients.cosmos_limit.slot():
+            return await call()
+
+    async def openai_stream(self, **kwargs):
+        """stream_chat_completion_async, holding its slots until the stream ends"""
+        async with self._slots, clients.openai_limit.slot():
+            async for part in stream_chat_completion_async(clients.openai, **kwargs):
+                yield part
+
+
+async def iterate_in_thread(iterator):
+    """Consume a blocking iterator (e.g. PostgresAgent.chat_stream) one item per thread hop"""
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+async def stream_message(parts, sources=None, on_complete=None, session_id=None, extra=None):
+    """server.stream_message for async parts; on_complete runs on a thread since it may write to Cosmos DB"""
+    text = []
+    usage = None
+    async for kind, value in parts:
+        if kind == "token":
+            text.append(value)
+            yield "token", {"text": value}
+        elif kind == "usage":
+            usage = value
+
+    message = "".join(text)
+    if on_complete:
+        await asyncio.to_thread(on_complete, message)
+
+    done = {"message": message, "usage": usage}
+    if sources is not None:
+        done["sources"] = sources
+    if session_id:
+        done["sessionId"] = session_id
+    done.update(extra or {})
+    yield "done", done
+
+
+async def _events(events):
+    for event in events:
+        yield event
+
+
+def sse_response(events):
+    """streaming.sse_response for an async generator of (event, data) tuples"""
+    async def generate():
+        try:
+            async for event, data in events:
+                yield sse_event(event, data)
+        except Exception as e:
+            print(f"[SSE] Stream failed: {e}")
+            yield sse_event("error", {"error": str(e)})
+
+    # A streamed answer counts against ASYNC_MAX_REQUESTS until its last event is sent
+    body = AdmittedStream(generate()) if g.pop("admission_held", False) else generate()
+    response = Response(body, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    # Long answers may stream for longer than the default response timeout
+    response.timeout = None
+    return response
+
+
+def current_user_id():
+    return request.user.get("oid") or request.user.get("sub") or "default-user"
+
+
+@app.route("/api/chat", methods=["POST"])
+@token_required
+@admitted
+async def chat():
+    """Chat endpoint - requires valid Azure AD token"""
+    try:
+        data = await request.get_json(force=True) or {}
+        message = data.get("message")
+        history = data.get("conversationHistory", [])
+        model_source = (data.get("model") or "azure").lower()
+        session_id = data.get("sessionId")
+
+        if not message:
+            return jsonify({"error": "Missing 'message'"}), 400
+
+        # With a session id the server keeps the history; the client only sends the new message
+        user_id = current_user_id()
+        if session_id:
+            if not valid_session_id(session_id):
+                return jsonify({"error": "Invalid 'sessionId'"}), 400
+            store = server.conversations()
+            session = await asyncio.to_thread(store.get, user_id, session_id)
+            history = store.history(session) if session else []
+
+        def remember(text):
+            if session_id:
+                server.save_turn(user_id, session_id, message, text)
+
+        messages = (
+            [{"role": "system", "content": "You are a helpful assistant."}]
+            + history
+            + [{"role": "user", "content": message}]
+        )
+
+        if model_source == "postgres":
+            # The Foundry agent client is synchronous: its calls run on threads, under its own concurrency cap
+            agent = server.postgres_agent
+            if not await asyncio.to_thread(agent.is_ready):
+                return jsonify({"error": "Postgres AI Agent not configured"}), 400
+
+            if wants_stream(request, data):
+                # Admitted before the response starts (may wait for a slot), so a busy or failing agent gets a 503
+                try:
+                    parts = await asyncio.to_thread(agent.chat_stream, message, history)
+                except ServiceUnavailableError as e:
+                    return jsonify({"error": str(e)}), 503
+                return sse_response(stream_message(
+                    iterate_in_thread(parts), on_complete=remember, session_id=session_id
+                ))
+
+            try:
+                text = await asyncio.to_thread(agent.chat, message, history)
+                await asyncio.to_thread(remember, text)
+                return jsonify({"message": text, "sessionId": session_id}), 200
+            except ServiceUnavailableError as e:
+                return jsonify({"error": str(e)}), 503
+            except Exception as e:
+                return jsonify({"error": str(e)}), 500
+
+        calls = RequestCalls()
+        options = {
+            "model": os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+            "messages": messages,
+            "max_tokens": 512,
+            "temperature": 0.7,
+        }
+
+        if wants_stream(request, data):
+            return sse_response(stream_message(
+                calls.openai_stream(**options), on_complete=remember, session_id=session_id
+            ))
+
+        completion = await calls.openai(lambda: clients.openai.chat.completions.create(**options))
+        text = completion.choices[0].message.content if completion.choices else ""
+        await asyncio.to_thread(remember, text)
+        return jsonify({"message": text, "sessionId": session_id}), 200
+
+    except ServiceUnavailableError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        print(f"Error in chat endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/rag-query", methods=["POST"])
+@token_required
+@admitted
+async def rag_query():
+    """RAG query endpoint - uses uploaded documents as context"""
+    container = clients.container
+    if not container:
+        return jsonify({"error": "Cosmos DB container not initialized."}), 500
+
+    data = await request.get_json()
+    question = data.get("question")
+
+    if not question:
+        return jsonify({"error": "Question is required"}), 400
+
+    try:
+        top_k, min_score, context_tokens = server.parse_rag_options(data)
+    except (TypeError, ValueError):
+        return jsonify({"error": "topK, minScore and contextTokens must be numbers"}), 400
+
+    stream = wants_stream(request, data)
+
+    session_id = data.get("sessionId")
+    if session_id and not valid_session_id(session_id):
+        return jsonify({"error": "Invalid 'sessionId'"}), 400
+
+    user_id = current_user_id()
+    calls = RequestCalls()
+
+    def remember_turn(answer):
+        if session_id:
+            server.save_turn(user_id, session_id, question, answer)
+
+    # The ANN shard and keyword index are local; building them the first time scans Cosmos DB
+    # with the sync client, so that runs on a thread
+    sync_container = server.get_cosmos_container()
+    try:
+        index = await asyncio.to_thread(server.user_index, sync_container, user_id)
+    except Exception as e:
+        return jsonify({"error": f"Cosmos DB query failed: {str(e)}"}), 500
+
+    if not len(index):
+        return jsonify({"error": "No documents with embeddings found. Please upload documents first."}), 400
+
+    # Same question against the same document set: answer without calling OpenAI
+    cache_key = server.answer_cache.make_key(question, index.version, top_k, min_score, context_tokens)
+    cached = server.answer_cache.get(user_id, cache_key)
+    if cached is not None:
+        await asyncio.to_thread(remember_turn, cached["answer"])
+        if stream:
+            return sse_response(_events([
+                ("token", {"text": cached["answer"]}),
+                ("done", {"message": cached["answer"], "sources": cached["sources"], "context": cached.get("context"),
+                          "usage": None, "cached": True, "sessionId": session_id}),
+            ]))
+        return jsonify({**cached, "cached": True, "sessionId": session_id})
+
+    matches = await asyncio.to_thread(server.exact_keyword_matches, sync_container, user_id, question, index, top_k)
+
+    if not matches:
+        # Embed the question while the keyword search runs
+        candidates = max(top_k, RAG_FUSION_CANDIDATES)
+        embedding, keyword_matches = await asyncio.gather(
+            calls.openai(lambda: embed_text_async(clients.openai, question)),
+            asyncio.to_thread(server.keyword_ranking, user_id, question, candidates),
+            return_exceptions=True,
+        )
+        if isinstance(embedding, ServiceUnavailableError):
+            return jsonify({"error": str(embedding)}), 503
+        if isinstance(embedding, Exception):
+            return jsonify({"error": f"Embedding failed: {str(embedding)}"}), 500
+
+        # Scoring a large shard is CPU-bound NumPy work: keep it off the event loop
+        rankings = [await asyncio.to_thread(index.search, embedding, k=candidates, min_score=min_score)]
+        if isinstance(keyword_matches, list):
+            rankings.append(keyword_matches)
+        # Extra candidates let the packing stage replace near-duplicates
+        matches = fuse_rankings(rankings, top_k * RAG_PACK_CANDIDATE_FACTOR)
+
+    try:
+        items = await calls.cosmos(lambda: fetch_contents_async(container, user_id, matches))
+    except ServiceUnavailableError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": f"Cosmos DB query failed: {str(e)}"}), 500
+
+    if not items:
+        answer = "No documents matched the question closely enough to answer it."
+        if stream:
+            return sse_response(_events([
+                ("token", {"text": answer}),
+                ("done", {"message": answer, "sources": [], "usage": None}),
+            ]))
+        return jsonify({"answer": answer, "sources": []})
+
+    # Fit the most relevant distinct passages into the context budget
+    items, packing = await asyncio.to_thread(pack_context, question, items, top_k, context_tokens)
+    sources = source_summaries(items)
+    messages = server.rag_messages(question, format_context(items))
+
+    if stream:
+        def remember(answer):
+            server.answer_cache.put(user_id, cache_key, {"answer": answer, "sources": sources, "context": packing})
+            remember_turn(answer)
+
+        return sse_response(stream_message(
+            calls.openai_stream(model=os.getenv("AZURE_OPENAI_DEPLOYMENT"), messages=messages),
+            sources=sources,
+            on_complete=remember,
+            session_id=session_id,
+            extra={"context": packing},
+        ))
+
+    try:
+        completion = await calls.openai(lambda: clients.openai.chat.completions.create(
+            model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+            messages=messages
+        ))
+        answer = completion.choices[0].message.content
+
+        response = {"answer": answer, "sources": sources, "context": packing}
+        server.answer_cache.put(user_id, cache_key, response)
+        await asyncio.to_thread(remember_turn, answer)
+        return jsonify({**response, "sessionId": session_id})
+    except ServiceUnavailableError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": f"Chat completion failed: {str(e)}"}), 500
+
+
+# Uploads only spool the files and queue a job: ingestion runs on the job pool (server.ingest_*_job),
+# off the event loop, exactly as in the WSGI server
+
+@app.route("/api/upload-excel-direct", methods=["POST"])
+@token_required
+@admitted
+async def upload_excel_direct():
+    """Upload CSV and replace the user's rows in a background job; poll /api/jobs/<jobId>"""
+    if not await asyncio.to_thread(server.get_cosmos_container):
+        return jsonify({"error": "Cosmos DB not configured"}), 500
+
+    files = await request.files
+    if "file" not in files:
+        return jsonify({"error": "No file uploaded (must be 'file')."}), 400
+
+    file = files["file"]
+    filename = (file.filename or "").lower()
+    user_id = current_user_id()
+
+    if not filename.endswith(".csv"):
+        return jsonify({"error": "Only .csv files supported."}), 400
+
+    path = await asyncio.to_thread(spool_upload, file)
+
+    # Submitting stores the job document with the sync container
+    job = await asyncio.to_thread(
+        server.job_manager.submit, user_id, "csv", "rows", [filename], server.ingest_csv_job, path, user_id, filename
+    )
+    return jsonify({"status": "queued", "jobId": job.id, "statusUrl": f"/api/jobs/{job.id}"}), 202
+
+
+@app.route("/api/upload-policy-documents", methods=["POST"])
+@token_required
+@admitted
+async def upload_policy_documents():
+    """Upload policy documents and replace the user's stored ones in a background job; poll /api/jobs/<jobId>"""
+    if not await asyncio.to_thread(server.get_cosmos_container):
+        return jsonify({"error": "Cosmos DB not configured"}), 500
+
+    files = await request.files
+    if "files" not in files:
+        return jsonify({"error": "No files uploaded (must be 'files')."}), 400
+
+    user_id = current_user_id()
+    spooled = [
+        (await asyncio.to_thread(spool_upload, file), file.filename or "unknown")
+        for file in files.getlist("files")
+    ]
+
+    job = await asyncio.to_thread(
+        server.job_manager.submit, user_id, "policy", "files", [name for _, name in spooled],
+        server.ingest_policy_job, spooled, user_id
+    )
+    return jsonify({"status": "queued", "jobId": job.id, "statusUrl": f"/api/jobs/{job.id}"}), 202
+
+
+@app.route("/api/stats/async", methods=["GET"])
+@token_required
+async def async_stats():
+    """Admission and per-upstream concurrency of this worker"""
+    return jsonify({
+        "requests": {
+            "inFlight": _in_flight,
+            "maxConcurrency": ASYNC_MAX_REQUESTS,
+            "rejected": _rejected,
+        },
+        "perRequestConcurrency": ASYNC_REQUEST_CONCURRENCY,
+        **clients.stats(),
+    }), 200
+
+
+# Routes served by the Quart app; everything else (and CORS preflights) goes to Flask
+ASYNC_ROUTES = {
+    (method, rule.rule)
+    for rule in app.url_map.iter_rules()
+    if rule.endpoint != "static"
+    for method in rule.methods
+    if method not in ("OPTIONS", "HEAD")
+}
+flask_application = WsgiToAsgi(server.app)
+
+
+async def application(scope, receive, send):
+    """ASGI app: async routes and lifespan events to Quart, the rest to the Flask app"""
+    if scope["type"] == "http" and (scope["method"], scope["path"]) not in ASYNC_ROUTES:
+        await flask_application(scope, receive, send)
+    else:
+        await app(scope, receive, send)
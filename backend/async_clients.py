@@ -0,0 +1,186 @@
+"""
+Async service clients for the ASGI server
+One AsyncOpenAI client and one azure.cosmos.aio container per worker process, each over a size-limited
+connection pool, plus per-upstream limits on calls in flight shared by every request of the worker
+"""
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+from resilience import LatencyHistogram, ServiceUnavailableError
+
+
+# Connections kept per worker for each upstream
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))
+COSMOS_MAX_CONNECTIONS = int(os.getenv("COSMOS_MAX_CONNECTIONS", "64"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+
+# Calls in flight per worker, across all requests (size these from the upstream quotas divided
+# by the worker count); a call waits up to UPSTREAM_QUEUE_SECONDS for a slot, then gets a 503
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "32"))
+COSMOS_CONCURRENCY = int(os.getenv("COSMOS_CONCURRENCY", "48"))
+UPSTREAM_QUEUE_SECONDS = float(os.getenv("UPSTREAM_QUEUE_SECONDS", "10"))
+
+
+class UpstreamLimit:
+    """Cap on concurrent calls to one upstream, with wait-time and latency counters"""
+
+    def __init__(self, name, limit, queue_seconds=UPSTREAM_QUEUE_SECONDS):
+        self.name = name
+        self.limit = limit
+        self.queue_seconds = queue_seconds
+        self._slots = asyncio.Semaphore(limit)
+        self.latency = LatencyHistogram()
+        self.in_flight = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold one slot for the duration of a call
+
+        Raises:
+            ServiceUnavailableError: If no slot freed up within queue_seconds
+        """
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_seconds)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ServiceUnavailableError(f"{self.name} is busy, try again shortly")
+
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.latency.observe(time.monotonic() - started)
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "inFlight": self.in_flight,
+            "maxConcurrency": self.limit,
+            "rejected": self.rejected,
+            "latency": self.latency.snapshot(),
+        }
+
+
+class AsyncClients:
+    """
+    Clients bound to the worker's event loop
+
+    open() must run on the serving loop (the ASGI startup hook), and close() on the same loop
+    at shutdown, so pooled connections are released cleanly.
+    """
+
+    def __init__(self):
+        self.openai = None
+        self.container = None
+        self._http_client = None
+        self._cosmos_client = None
+        self._cosmos_session = None
+        self.openai_limit = UpstreamLimit("Azure OpenAI", OPENAI_CONCURRENCY)
+        self.cosmos_limit = UpstreamLimit("Cosmos DB", COSMOS_CONCURRENCY)
+
+    async def open(self):
+        """Create the clients; Cosmos DB stays None when it is not configured or unreachable"""
+        self.openai = self._open_openai()
+        try:
+            self.container = await self._open_cosmos()
+        except Exception as e:
+            print(f"[Cosmos Init] Warning: {e}")
+
+    def _open_openai(self):
+        import httpx
+        from openai import AsyncOpenAI, AsyncAzureOpenAI
+
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=10.0),
+        )
+
+        if os.getenv("AZURE_OPENAI_API_VERSION"):
+            return AsyncAzureOpenAI(
+                api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                http_client=self._http_client,
+            )
+
+        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        if endpoint and not endpoint.endswith("/openai/v1"):
+            endpoint = endpoint.rstrip("/") + "/openai/v1"
+        return AsyncOpenAI(
+            base_url=endpoint,
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            http_client=self._http_client,
+        )
+
+    async def _open_cosmos(self):
+        endpoint = os.getenv("COSMOS_ENDPOINT")
+        key = os.getenv("COSMOS_KEY")
+        if not (endpoint and key):
+            print("[Cosmos Init] Missing COSMOS_ENDPOINT or COSMOS_KEY.")
+            return None
+
+        import aiohttp
+        from azure.core.pipeline.transport import AioHttpTransport
+        from azure.cosmos.aio import CosmosClient
+
+        self._cosmos_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=COSMOS_MAX_CONNECTIONS)
+        )
+        self._cosmos_client = CosmosClient(
+            url=endpoint, credential=key,
+            transport=AioHttpTransport(session=self._cosmos_session, session_owner=False),
+        )
+        # Fetches the account's regions, as the sync client does in its constructor
+        await self._cosmos_client.__aenter__()
+        container_name = os.getenv("COSMOS_CONTAINER_NAME")
+        container = self._cosmos_client.get_database_client(
+            os.getenv("COSMOS_DB_NAME")
+        ).get_container_client(container_name)
+        print(f"[Cosmos] Async client ready. Using container: {container_name}")
+        return container
+
+    async def close(self):
+        """Close the clients and their connection pools"""
+        for name, close in (
+            ("Cosmos DB client", self._cosmos_client and self._cosmos_client.close),
+            ("Cosmos DB connections", self._cosmos_session and self._cosmos_session.close),
+            ("OpenAI connections", self._http_client and self._http_client.aclose),
+        ):
+            if close:
+                try:
+                    await close()
+                except Exception as e:
+                    print(f"[Async Clients] Closing {name} failed: {e}")
+        self.openai = self.container = None
+
+    def stats(self):
+        return {
+            "openai": self.openai_limit.stats(),
+            "cosmos": self.cosmos_limit.stats(),
+            "maxConnections": {"openai": OPENAI_MAX_CONNECTIONS, "cosmos": COSMOS_MAX_CONNECTIONS},
+        }
+
+
+# Global instance
+_async_clients_instance = None
+
+
+def get_async_clients():
+    """
+    Get or create the worker's async clients (opened by the ASGI startup hook)
+
+    Returns:
+        AsyncClients: The shared instance
+    """
+    global _async_clients_instance
+
+    if _async_clients_instance is None:
+        _async_clients_instance = AsyncClients()
+
+    return _async_clients_instance
@@ -0,0 +1,74 @@
+"""
+Verified token cache
+Keeps the claims of already-verified access tokens until they expire, so warm requests skip signature checks
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+AUTH_CACHE_TOKENS = int(os.getenv("AUTH_CACHE_TOKENS", "10000"))
+
+# Signing keys rotate rarely; an unknown kid triggers a refresh anyway
+JWKS_LIFESPAN_SECONDS = int(os.getenv("JWKS_LIFESPAN_SECONDS", "86400"))
+
+
+def token_key(token):
+    """SHA-256 of the raw token, so the cache never holds bearer tokens"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class VerifiedTokenCache:
+    """LRU cache of decoded claims, each entry valid until the token's exp"""
+
+    def __init__(self, max_tokens=AUTH_CACHE_TOKENS):
+        self.max_tokens = max_tokens
+        self._claims = OrderedDict()  # token hash -> (exp, claims)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """Return the cached claims, or None when unknown or expired"""
+        key = token_key(token)
+        with self._lock:
+            entry = self._claims.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._claims[key]
+                return None
+            self._claims.move_to_end(key)
+            return entry[1]
+
+    def put(self, token, claims):
+        """Remember verified claims; tokens without an exp are not cached"""
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)) or exp <= time.time():
+            return
+        key = token_key(token)
+        with self._lock:
+            self._claims[key] = (exp, claims)
+            self._claims.move_to_end(key)
+            while len(self._claims) > self.max_tokens:
+                self._claims.popitem(last=False)
+
+
+def prefetch_jwks(jwks_client):
+    """
+    Fetch the signing keys in a background thread
+
+    The first authenticated request then finds the key set already loaded instead of
+    blocking on the network. Failures are only logged; the next request fetches again.
+
+    Args:
+        jwks_client (jwt.PyJWKClient): Client whose key set should be loaded
+    """
+    def fetch():
+        try:
+            jwks_client.get_signing_keys()
+            print("[Auth] JWKS prefetched")
+        except Exception as e:
+            print(f"[Auth] JWKS prefetch failed: {e}")
+
+    threading.Thread(target=fetch, name="jwks-prefetch", daemon=True).start()
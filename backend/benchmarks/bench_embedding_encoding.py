@@ -0,0 +1,75 @@
+"""
+Benchmark: embedding encodings
+Compares stored size, load time and retrieval quality of each vector_codec encoding against
+exact float32 search over the same vectors
+
+Usage (from backend/):
+    python benchmarks/bench_embedding_encoding.py [items] [queries] [dimensions]
+"""
+import os
+import sys
+import json
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_codec import ENCODINGS, encode_embedding, stack_embeddings
+
+TOP_K = 5
+
+
+def make_corpus(items, queries, dimensions, seed=0):
+    """Clustered unit vectors (like embeddings of related documents) and nearby queries"""
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(max(1, items // 50), dimensions))
+    corpus = centroids[rng.integers(0, len(centroids), items)] + 0.6 * rng.normal(size=(items, dimensions))
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    picks = rng.integers(0, items, queries)
+    questions = corpus[picks] + 0.04 * rng.normal(size=(queries, dimensions))
+    questions /= np.linalg.norm(questions, axis=1, keepdims=True)
+    return corpus.astype(np.float32), questions.astype(np.float32)
+
+
+def top_k(matrix, questions, k=TOP_K):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    scores = questions @ (matrix / norms).T
+    return np.argsort(-scores, axis=1)[:, :k], scores
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    dimensions = int(sys.argv[3]) if len(sys.argv) > 3 else 1536
+
+    corpus, questions = make_corpus(items, queries, dimensions)
+    exact, exact_scores = top_k(corpus, questions)
+    vectors = corpus.tolist()
+
+    print(f"{items} items x {dimensions} dims, {queries} queries, recall@{TOP_K} vs exact float32")
+    for encoding in ENCODINGS:
+        documents = []
+        for i, vector in enumerate(vectors):
+            document = {"id": f"item-{i}"}
+            encode_embedding(document, vector, encoding)
+            documents.append(document)
+        payload = [json.dumps(document) for document in documents]
+
+        # What a retrieval load pays: parse the JSON the service returns, then build the matrix
+        started = time.perf_counter()
+        matrix = stack_embeddings([json.loads(text) for text in payload])
+        load_s = time.perf_counter() - started
+
+        found, scores = top_k(matrix, questions)
+        recall = np.mean([len(set(a) & set(b)) / TOP_K for a, b in zip(found, exact)])
+        top1 = np.mean(found[:, 0] == exact[:, 0])
+        score_error = np.max(np.abs(scores - exact_scores))
+
+        print(f"{encoding:8s} {sum(map(len, payload)) / items / 1024:6.1f} KB/item  "
+              f"load {load_s:6.3f}s  recall {recall:.4f}  top-1 {top1:.4f}  max score error {score_error:.5f}")
+
+
+if __name__ == "__main__":
+    main()
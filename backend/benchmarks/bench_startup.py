@@ -0,0 +1,94 @@
+"""
+Benchmark: server startup
+Imports server.py in fresh processes and reports import time, the slowest top-level imports and the
+latency of the first and second request, with and without the background warm-up
+
+Usage (from backend/):
+    python benchmarks/bench_startup.py [runs] [path]
+
+The server reads .env as usual, so with real credentials the first request includes building the
+OpenAI/Cosmos DB clients; without them it measures import and Flask overhead only.
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process: import the server, then time two requests through the test client
+CHILD = """
+import json, sys, time, threading
+started = time.perf_counter()
+import server
+imported = time.perf_counter() - started
+if {wait}:
+    for thread in threading.enumerate():
+        if thread.name == "warm-up":
+            thread.join()
+warmed = time.perf_counter() - started
+app = server.app.test_client()
+latencies = []
+for _ in range(2):
+    t = time.perf_counter()
+    status = app.get({path!r}).status_code
+    latencies.append(time.perf_counter() - t)
+print("RESULT " + json.dumps({{"import": imported, "ready": warmed, "first": latencies[0], "second": latencies[1], "status": status}}))
+"""
+
+
+def run_child(path, warmup, wait=False, importtime=False):
+    env = {**os.environ, "DEV_MODE": "true", "STARTUP_WARMUP": "true" if warmup else "false"}
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD.format(path=path, wait=wait)]
+    completed = subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    result = next(json.loads(line[7:]) for line in completed.stdout.splitlines() if line.startswith("RESULT "))
+    return result, completed.stderr
+
+
+def slowest_imports(stderr, count=10):
+    """Modules imported directly by server.py, by cumulative import time (-X importtime output)"""
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        # A module is listed after everything it imported, so server's children precede it
+        if depth == 1:
+            children.append((int(cumulative), name.strip()))
+        elif depth == 0:
+            if name.strip() == "server":
+                return sorted(children, reverse=True)[:count]
+            children = []
+    return []
+
+
+def report(label, results):
+    def median_ms(key):
+        return statistics.median(result[key] for result in results) * 1000
+
+    print(f"{label:28s} import {median_ms('import'):7.1f} ms  ready {median_ms('ready'):7.1f} ms  "
+          f"first request {median_ms('first'):7.1f} ms  second {median_ms('second'):6.1f} ms  "
+          f"(status {results[0]['status']})")
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    path = sys.argv[2] if len(sys.argv) > 2 else "/api/chat/history/bench-session"
+
+    _, stderr = run_child(path, warmup=False, importtime=True)
+    print("Slowest imports of server.py (cumulative):")
+    for micros, name in slowest_imports(stderr):
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+
+    print(f"\nMedian of {runs} cold starts, GET {path}:")
+    report("lazy (default)", [run_child(path, warmup=False)[0] for _ in range(runs)])
+    report("warm-up, request at once", [run_child(path, warmup=True)[0] for _ in range(runs)])
+    report("warm-up finished first", [run_child(path, warmup=True, wait=True)[0] for _ in range(runs)])
+
+
+if __name__ == "__main__":
+    main()
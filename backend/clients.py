@@ -0,0 +1,146 @@
+"""
+Service clients for the backend, built on first use
+The OpenAI, Cosmos DB and JWKS clients are created by thread-safe accessors instead of at import,
+so the server starts without importing their SDKs or waiting on the network
+"""
+import os
+import threading
+
+from auth_cache import JWKS_LIFESPAN_SECONDS
+
+# One lock per client, so a slow Cosmos DB handshake doesn't hold up the others
+_openai_client = None
+_openai_lock = threading.Lock()
+_cosmos_container = None
+_cosmos_failed = False
+_cosmos_lock = threading.Lock()
+_jwks_client = None
+_jwks_lock = threading.Lock()
+
+
+def _build_openai_client():
+    """Azure OpenAI client (supporting both SDK styles)"""
+    from openai import OpenAI, AzureOpenAI
+
+    if os.getenv("AZURE_OPENAI_API_VERSION"):
+        # Use AzureOpenAI SDK
+        return AzureOpenAI(
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        )
+
+    # Use OpenAI SDK with Azure endpoint
+    endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+    if endpoint and not endpoint.endswith("/openai/v1"):
+        endpoint = endpoint.rstrip("/") + "/openai/v1"
+    return OpenAI(
+        base_url=endpoint,
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+    )
+
+
+def get_openai_client():
+    """
+    Get or create the shared Azure OpenAI client
+
+    Returns:
+        OpenAI | AzureOpenAI: The client (one instance, so HTTP connections are reused)
+    """
+    global _openai_client
+
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                _openai_client = _build_openai_client()
+    return _openai_client
+
+
+def _build_cosmos_container(endpoint, key):
+    """Container client on a CosmosClient of its own"""
+    from azure.cosmos import CosmosClient
+
+    # The client fetches the account's regions while it is constructed
+    cosmos_client = CosmosClient(url=endpoint, credential=key)
+    return cosmos_client.get_database_client(
+        os.getenv("COSMOS_DB_NAME")
+    ).get_container_client(os.getenv("COSMOS_CONTAINER_NAME"))
+
+
+def get_cosmos_container():
+    """
+    Get or create the Cosmos DB container client
+
+    Returns:
+        ContainerProxy: The container, or None when Cosmos DB is not configured or could not
+            be reached (the failure is remembered, as it was when this ran at import)
+    """
+    global _cosmos_container, _cosmos_failed
+
+    if _cosmos_container is not None or _cosmos_failed:
+        return _cosmos_container
+
+    with _cosmos_lock:
+        if _cosmos_container is not None or _cosmos_failed:
+            return _cosmos_container
+
+        endpoint = os.getenv("COSMOS_ENDPOINT")
+        key = os.getenv("COSMOS_KEY")
+        if not (endpoint and key):
+            print("[Cosmos Init] Missing COSMOS_ENDPOINT or COSMOS_KEY.")
+            _cosmos_failed = True
+            return None
+
+        try:
+            _cosmos_container = _build_cosmos_container(endpoint, key)
+            print(f"[Cosmos] Ready. Using container: {os.getenv('COSMOS_CONTAINER_NAME')}")
+        except Exception as e:
+            print(f"[Cosmos Init] Warning: {e}")
+            _cosmos_failed = True
+
+    return _cosmos_container
+
+
+def new_cosmos_container():
+    """
+    Create a Cosmos DB container client that shares nothing with get_cosmos_container()
+
+    For readers of the client's last response headers (the change feed's continuation token
+    is only exposed there), which other threads' requests would overwrite on the shared client
+
+    Returns:
+        ContainerProxy: A new container, or None when Cosmos DB is not configured or could not be reached
+    """
+    endpoint = os.getenv("COSMOS_ENDPOINT")
+    key = os.getenv("COSMOS_KEY")
+    if not (endpoint and key):
+        return None
+    try:
+        return _build_cosmos_container(endpoint, key)
+    except Exception as e:
+        print(f"[Cosmos Init] Warning: {e}")
+        return None
+
+
+def get_jwks_client(jwks_url):
+    """
+    Get or create the client for the Azure AD signing keys
+
+    The key set is cached for JWKS_LIFESPAN_SECONDS; a token signed with an unknown kid
+    makes PyJWKClient refetch it, so rotated keys are picked up immediately.
+
+    Args:
+        jwks_url (str): The tenant's key set URL (used when the client is created)
+
+    Returns:
+        PyJWKClient: The shared client
+    """
+    global _jwks_client
+
+    if _jwks_client is None:
+        with _jwks_lock:
+            if _jwks_client is None:
+                from jwt import PyJWKClient
+
+                _jwks_client = PyJWKClient(jwks_url, lifespan=JWKS_LIFESPAN_SECONDS)
+    return _jwks_client
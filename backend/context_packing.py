@@ -0,0 +1,199 @@
+"""
+Context packing for RAG prompts
+Fills a token budget with retrieved passages in relevance order, skipping near-duplicates
+(maximal marginal relevance) and trimming long passages to the sentences around the best match
+"""
+import os
+import re
+import math
+from collections import Counter
+
+from embeddings import estimate_tokens
+from keyword_index import tokenize
+
+
+# Prompt budget for retrieved passages (overridable per request with "contextTokens")
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "3000"))
+# Longer passages are trimmed to the sentences around the best-matching span
+RAG_PASSAGE_TOKENS = int(os.getenv("RAG_PASSAGE_TOKENS", "500"))
+# MMR trade-off: 1.0 ranks by relevance only, lower values favour passages unlike those already packed
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+# Passages at least this similar (term cosine) to a packed one are dropped as duplicates
+RAG_DUPLICATE_SIMILARITY = float(os.getenv("RAG_DUPLICATE_SIMILARITY", "0.95"))
+# Retrieve this many times topK candidates, so dropped duplicates can be replaced
+RAG_PACK_CANDIDATE_FACTOR = 2
+# Length of the passage preview returned with each source (full text is fetched from /api/sources)
+RAG_SNIPPET_CHARS = int(os.getenv("RAG_SNIPPET_CHARS", "200"))
+# A passage cut to fit the remaining budget must keep at least this many tokens
+_MIN_PASSAGE_TOKENS = 48
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WHITESPACE = re.compile(r"\s+")
+# Source fields returned to the browser alongside the answer
+_SOURCE_FIELDS = ("id", "title", "sourceFile", "fileName", "score", "keywordScore", "fusedScore", "trimmed")
+
+
+def _cosine(a, b):
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b[term] for term, count in a.items() if term in b)
+    return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
+
+
+def _units(text):
+    """Sentences (or lines, for CSV 'col: value' rows) with the separator that followed each"""
+    units = []
+    for line in text.split("\n"):
+        sentences = [s for s in _SENTENCE_END.split(line) if s]
+        units.extend((sentence, " ") for sentence in sentences[:-1])
+        if sentences:
+            units.append((sentences[-1], "\n"))
+    return units
+
+
+def trim_passage(text, question_terms, max_tokens):
+    """
+    Cut a passage down to about max_tokens around its best-matching sentence
+
+    Args:
+        text (str): The passage
+        question_terms (set): Terms of the question
+        max_tokens (int): Token limit for the result
+
+    Returns:
+        tuple: (text, trimmed)
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text, False
+
+    units = _units(text)
+    if not units:
+        return text[:max_tokens * 4], True
+    overlap = [len(question_terms & set(tokenize(unit))) for unit, _ in units]
+    best = max(range(len(units)), key=lambda i: overlap[i])
+
+    # A single sentence over the limit: keep the characters around the first question term
+    if estimate_tokens(units[best][0]) > max_tokens:
+        sentence = units[best][0]
+        lowered = sentence.lower()
+        hits = [lowered.find(term) for term in question_terms if term in lowered]
+        center = min(hits) if hits else 0
+        start = max(0, center - max_tokens * 2)
+        return "… " + sentence[start:start + max_tokens * 4].strip() + " …", True
+
+    # Grow the window one sentence at a time, after then before the best one
+    lo = hi = best
+    used = estimate_tokens(units[best][0])
+    while True:
+        grew = False
+        for i in (hi + 1, lo - 1):
+            if 0 <= i < len(units) and used + estimate_tokens(units[i][0]) <= max_tokens:
+                used += estimate_tokens(units[i][0])
+                lo, hi = min(lo, i), max(hi, i)
+                grew = True
+        if not grew:
+            break
+
+    window = "".join(unit + sep for unit, sep in units[lo:hi + 1]).strip()
+    return ("… " if lo > 0 else "") + window + (" …" if hi < len(units) - 1 else ""), True
+
+
+def _source_label(item):
+    return item.get("sourceFile") or item.get("fileName") or item.get("title")
+
+
+def pack_context(question, candidates, max_passages, budget=RAG_CONTEXT_TOKENS):
+    """
+    Choose and trim the passages that go into the prompt
+
+    Candidates are taken by maximal marginal relevance (rank-based relevance minus similarity to
+    what is already packed), so near-identical rows don't crowd out distinct ones.
+
+    Args:
+        question (str): The user's question
+        candidates (list): Retrieved items with 'content', best first
+        max_passages (int): At most this many passages are packed
+        budget (int): Token budget for the packed context
+
+    Returns:
+        tuple: (packed items with 'content' replaced by the packed passage, report dict)
+    """
+    question_terms = set(tokenize(question))
+    count = len(candidates)
+    relevance = [1.0 - i / count for i in range(count)] if count else []
+    terms = [Counter(tokenize(item.get("content") or "")) for item in candidates]
+
+    remaining = list(range(count))
+    chosen = []
+    packed = []
+    used = 0
+    duplicates = over_budget = trimmed = 0
+
+    while remaining and len(packed) < max_passages:
+        similarity = {
+            i: max((_cosine(terms[i], terms[j]) for j in chosen), default=0.0)
+            for i in remaining
+        }
+        pick = max(remaining, key=lambda i: RAG_MMR_LAMBDA * relevance[i] - (1 - RAG_MMR_LAMBDA) * similarity[i])
+        remaining.remove(pick)
+
+        if similarity[pick] >= RAG_DUPLICATE_SIMILARITY:
+            duplicates += 1
+            continue
+
+        item = candidates[pick]
+        header = f"[Source: {_source_label(item)}]\n"
+        room = budget - used - estimate_tokens(header)
+        limit = min(RAG_PASSAGE_TOKENS, room)
+        content = item.get("content") or ""
+        if estimate_tokens(content) > limit and limit < _MIN_PASSAGE_TOKENS:
+            over_budget += 1
+            continue
+        passage, was_trimmed = trim_passage(content, question_terms, limit)
+
+        used += estimate_tokens(header + passage)
+        trimmed += was_trimmed
+        chosen.append(pick)
+        packed.append({**item, "content": passage, "trimmed": was_trimmed})
+
+    report = {
+        "candidates": count,
+        "packed": len(packed),
+        "dropped": count - len(packed),
+        "droppedDuplicates": duplicates,
+        "droppedOverBudget": over_budget,
+        "droppedOverLimit": len(remaining),
+        "trimmed": trimmed,
+        "contextTokens": used,
+        "budgetTokens": budget,
+    }
+    return packed, report
+
+
+def format_context(packed):
+    """The prompt's context section: one [Source: ...] block per packed passage"""
+    return "\n\n".join(f"[Source: {_source_label(item)}]\n{item['content']}" for item in packed)
+
+
+def snippet(text, max_chars=RAG_SNIPPET_CHARS):
+    """The start of a passage on one line, cut at a word boundary"""
+    text = _WHITESPACE.sub(" ", text or "").strip()
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > max_chars // 2 else cut).rstrip(" ,;:") + " …"
+
+
+def source_summaries(packed):
+    """
+    The sources reported with an answer: ids, names, scores and a short snippet
+
+    The packed passages themselves stay server-side; the browser fetches full
+    content for the sources it shows from /api/sources.
+    """
+    return [
+        {**{field: item[field] for field in _SOURCE_FIELDS if field in item},
+         "snippet": snippet(item.get("content"))}
+        for item in packed
+    ]
@@ -0,0 +1,355 @@
+"""
+Server-side chat sessions
+Keeps each user's conversations in Cosmos DB (or a local SQLite file) behind an in-memory LRU,
+and builds the prompt history from a rolling summary plus the most recent turns
+"""
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timezone
+from collections import OrderedDict
+
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError, CosmosResourceExistsError
+
+from embeddings import estimate_tokens
+from data_access import read_user_item, write_user_item
+
+
+# Prompt budget for history (summary + recent turns) sent with each message
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "3000"))
+# Messages kept per stored session; older ones only survive in the summary
+CHAT_SESSION_MAX_MESSAGES = int(os.getenv("CHAT_SESSION_MAX_MESSAGES", "500"))
+CHAT_SESSION_CACHE_SIZE = int(os.getenv("CHAT_SESSION_CACHE_SIZE", "1000"))
+# Turns saved by another worker process only show up in a cached session after this long
+CHAT_SESSION_TTL_SECONDS = float(os.getenv("CHAT_SESSION_TTL_SECONDS", "30"))
+CHAT_SESSION_WRITE_ATTEMPTS = 5
+CHAT_STORE_PATH = os.getenv("CHAT_STORE_PATH") or os.path.join(tempfile.gettempdir(), "chat-sessions.sqlite3")
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for an assistant that will continue it. "
+    "Keep facts, names, numbers, decisions and open questions. Be brief."
+)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def valid_session_id(session_id):
+    """Session ids are client-generated; allow only short URL-safe strings"""
+    return bool(session_id) and bool(SESSION_ID_PATTERN.match(session_id))
+
+
+class SessionConflictError(Exception):
+    """The stored session changed since it was read (or was created meanwhile)"""
+
+
+def _message_tokens(message):
+    return estimate_tokens(message.get("content") or "") + 4
+
+
+class CosmosSessionBackend:
+    """Sessions as chatSession documents in the user's partition"""
+
+    def __init__(self, container):
+        self.container = container
+
+    def load(self, user_id, session_id):
+        return read_user_item(self.container, user_id, f"chat-{session_id}", "chat.read")
+
+    def save(self, session):
+        """
+        Write the session if the stored copy is still the one it was read from
+
+        Returns:
+            dict: The stored session (with its new _etag)
+
+        Raises:
+            SessionConflictError: If another writer got there first
+        """
+        try:
+            if session.get("_etag"):
+                return write_user_item(self.container, session, "chat.save", etag=session["_etag"])
+            return write_user_item(self.container, session, "chat.create", create=True)
+        except (CosmosAccessConditionFailedError, CosmosResourceExistsError):
+            raise SessionConflictError(session["id"])
+
+
+class SqliteSessionBackend:
+    """Sessions as JSON rows in a local SQLite file (development / no Cosmos)"""
+
+    def __init__(self, path=CHAT_STORE_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                document TEXT NOT NULL,
+                PRIMARY KEY (user_id, session_id)
+            )
+        """)
+        self._db.commit()
+
+    def load(self, user_id, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT document FROM sessions WHERE user_id = ? AND session_id = ?",
+                (user_id, session_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session):
+        """CosmosSessionBackend.save, with the etag kept in the JSON document"""
+        with self._lock:
+            # The write lock is taken before the check, so other processes sharing the file can't interleave
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT document FROM sessions WHERE user_id = ? AND session_id = ?",
+                    (session["userId"], session["sessionId"])
+                ).fetchone()
+                if (json.loads(row[0]).get("_etag") if row else None) != session.get("_etag"):
+                    raise SessionConflictError(session["id"])
+                stored = {**session, "_etag": uuid.uuid4().hex}
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions (user_id, session_id, document) VALUES (?, ?, ?)",
+                    (session["userId"], session["sessionId"], json.dumps(stored))
+                )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+        return stored
+
+
+class ConversationStore:
+    """Chat sessions with an in-memory hot tier in front of a persistent backend"""
+
+    def __init__(self, backend, max_cached=CHAT_SESSION_CACHE_SIZE, history_tokens=CHAT_HISTORY_TOKENS,
+                 ttl_seconds=CHAT_SESSION_TTL_SECONDS):
+        self.backend = backend
+        self.max_cached = max_cached
+        self.history_tokens = history_tokens
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()  # (user_id, session_id) -> (loaded at, session document)
+        self._lock = threading.Lock()
+
+    def _remember(self, session):
+        key = (session["userId"], session["sessionId"])
+        with self._lock:
+            self._sessions[key] = (time.monotonic(), session)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_cached:
+                self._sessions.popitem(last=False)
+
+    def get(self, user_id, session_id):
+        """
+        Load a session
+
+        Returns:
+            dict: The session document, or None when it doesn't exist
+        """
+        with self._lock:
+            entry = self._sessions.get((user_id, session_id))
+            if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+                self._sessions.move_to_end((user_id, session_id))
+                return entry[1]
+
+        return self._load(user_id, session_id)
+
+    def _load(self, user_id, session_id):
+        session = self.backend.load(user_id, session_id)
+        if session is not None:
+            self._remember(session)
+        else:
+            self.invalidate(user_id, session_id)
+        return session
+
+    def invalidate(self, user_id, session_id):
+        """Drop a cached session so the next read goes to the backend"""
+        with self._lock:
+            self._sessions.pop((user_id, session_id), None)
+
+    def _new_session(self, user_id, session_id):
+        now = _now()
+        return {
+            "id": f"chat-{session_id}",
+            "userId": user_id,
+            "documentType": "chatSession",
+            "sessionId": session_id,
+            "messages": [],
+            "summary": "",
+            "summarizedCount": 0,
+            "createdAt": now,
+            "updatedAt": now,
+        }
+
+    def _update(self, user_id, session_id, change):
+        """
+        Read-modify-write of a session, guarded by its etag
+
+        The first attempt starts from the cached copy; when another thread or worker process
+        saved the session in the meantime, it is re-read and the change applied again.
+
+        Args:
+            change (callable): Takes the current session document and returns the new one
+
+        Returns:
+            dict: The stored session
+
+        Raises:
+            RuntimeError: If the session kept changing under every attempt
+        """
+        session = self.get(user_id, session_id)
+        for _ in range(CHAT_SESSION_WRITE_ATTEMPTS):
+            updated = change(session or self._new_session(user_id, session_id))
+            overflow = len(updated["messages"]) - CHAT_SESSION_MAX_MESSAGES
+            if overflow > 0:
+                updated["messages"] = updated["messages"][overflow:]
+                updated["summarizedCount"] = max(0, updated["summarizedCount"] - overflow)
+            updated["updatedAt"] = _now()
+
+            try:
+                stored = self.backend.save(updated)
+            except SessionConflictError:
+                session = self._load(user_id, session_id)
+                continue
+
+            self._remember(stored)
+            return stored
+
+        # Too much contention: let the next read fetch whatever won
+        self.invalidate(user_id, session_id)
+        raise RuntimeError(f"Could not update chat session {session_id}")
+
+    def replace(self, user_id, session_id, messages):
+        """Store a whole conversation, replacing what the session held"""
+        stored_messages = [
+            {"role": m["role"], "content": m["content"], "timestamp": m.get("timestamp") or _now()}
+            for m in messages
+        ]
+        return self._update(user_id, session_id, lambda session: {
+            **session,
+            "messages": stored_messages,
+            "summary": "",
+            "summarizedCount": 0,
+        })
+
+    def append(self, user_id, session_id, messages, client=None, model=None):
+        """
+        Add turns to a session (creating it if needed), then roll old turns into the summary
+
+        Args:
+            user_id (str): Partition key of the user
+            session_id (str): Client-generated session id
+            messages (list): {"role", "content"} dicts to add
+            client: OpenAI client used to summarize; without it old turns are just dropped from the prompt
+            model (str, optional): Chat deployment for the summary
+        """
+        added = [{"role": m["role"], "content": m["content"], "timestamp": _now()} for m in messages]
+
+        def change(session):
+            session = {**session, "messages": session["messages"] + added}
+            self._compact(session, client, model)
+            return session
+
+        return self._update(user_id, session_id, change)
+
+    def history(self, session):
+        """
+        Prompt messages for a session: the summary (if any) plus every turn not yet summarized
+
+        Returns:
+            list: {"role", "content"} dicts
+        """
+        history = []
+        if session.get("summary"):
+            history.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{session['summary']}"
+            })
+        for message in session["messages"][session.get("summarizedCount", 0):]:
+            history.append({"role": message["role"], "content": message["content"]})
+        return history
+
+    def _compact(self, session, client, model):
+        """Move the oldest unsummarized turns into the summary until the rest fits the token budget"""
+        recent = session["messages"][session["summarizedCount"]:]
+        used = estimate_tokens(session["summary"]) + sum(_message_tokens(m) for m in recent)
+        if used <= self.history_tokens:
+            return
+
+        # Roll up the older half of the budget's overflow in one go, keeping whole user/assistant pairs
+        keep_tokens = self.history_tokens // 2
+        kept = 0
+        cut = len(recent)
+        while cut > 0 and kept + _message_tokens(recent[cut - 1]) <= keep_tokens:
+            cut -= 1
+            kept += _message_tokens(recent[cut])
+        if cut < len(recent) and recent[cut]["role"] == "assistant":
+            cut += 1
+        cut = max(cut, 1)
+
+        rolled = recent[:cut]
+        summary = session["summary"]
+        if client is not None:
+            try:
+                summary = self._summarize(client, model, summary, rolled)
+            except Exception as e:
+                print(f"[Conversation Store] Summary failed, dropping {len(rolled)} turns from the prompt: {e}")
+
+        session["summary"] = summary
+        session["summarizedCount"] += len(rolled)
+
+    def _summarize(self, client, model, summary, messages):
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        if summary:
+            transcript = f"Earlier summary:\n{summary}\n\nNew turns:\n{transcript}"
+        completion = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+            max_tokens=400,
+            temperature=0.2,
+        )
+        return completion.choices[0].message.content or summary
+
+
+# Global instance
+_conversation_store_instance = None
+_conversation_store_lock = threading.Lock()
+
+
+def get_conversation_store(container=None):
+    """
+    Get or create the global conversation store
+
+    Args:
+        container: Cosmos DB container client; without one sessions go to CHAT_STORE_PATH
+
+    Returns:
+        ConversationStore: The shared store instance
+    """
+    global _conversation_store_instance
+
+    with _conversation_store_lock:
+        if _conversation_store_instance is None:
+            if container is not None:
+                backend = CosmosSessionBackend(container)
+            else:
+                print(f"[Conversation Store] No Cosmos container, storing sessions in {CHAT_STORE_PATH}")
+                backend = SqliteSessionBackend()
+            _conversation_store_instance = ConversationStore(backend)
+
+    return _conversation_store_instance
@@ -0,0 +1,109 @@
+"""
+CSV row to Cosmos document transformation
+Builds the id/title/content of every row column by column instead of row by row
+"""
+import uuid
+import hashlib
+
+import numpy as np
+
+
+# Namespace for ids of rows that have no 'id' column value
+ROW_ID_NAMESPACE = uuid.UUID("5b0f7c1e-2f59-4a55-9a8e-6f3c1d2b7e40")
+
+
+def _row_values(df, col, row_dtype):
+    """Column values as iterrows would see them, converted to str"""
+    values = df[col].to_numpy()
+    if row_dtype != object:
+        # iterrows yields one Series per row, upcast to the frame's common dtype (e.g. int -> float)
+        values = values.astype(row_dtype)
+    return values.astype(str).astype(object)
+
+
+def dataframe_to_documents(df, user_id, source_file, occurrences=None):
+    """
+    Turn every DataFrame row into a csvData document
+
+    Rules per row:
+      - id: the 'id' column when present and not null, else a UUID derived from the
+        file name and row content, so an unchanged row keeps its id across re-uploads
+      - title: the 'title' column when present and not null, else "Record <id>"
+      - content: the 'content' column when present and not null, else one
+        "col: value" line per non-null column except userId
+
+    Args:
+        df (pandas.DataFrame): Parsed CSV
+        user_id (str): Partition key for the documents
+        source_file (str): Original file name stored as sourceFile
+        occurrences (dict, optional): Counts of id-less row contents seen so far; pass the
+            same dict for every chunk of a file so identical rows still get distinct ids
+
+    Returns:
+        list: (row index, document) tuples in row order
+    """
+    n = len(df)
+    if n == 0:
+        return []
+
+    row_dtype = df.iloc[:0].to_numpy().dtype
+    notna = df.notna()
+    columns = list(df.columns)
+
+    def column_or_none(name):
+        if name not in columns:
+            return None, np.zeros(n, dtype=bool)
+        return _row_values(df, name, row_dtype), notna[name].to_numpy()
+
+    ids, has_id = column_or_none("id")
+    titles, has_title = column_or_none("title")
+    contents, has_content = column_or_none("content")
+
+    row_ids = np.empty(n, dtype=object)
+    if ids is not None:
+        row_ids[has_id] = ids[has_id]
+
+    row_titles = np.empty(n, dtype=object)
+    if titles is not None:
+        row_titles[has_title] = titles[has_title]
+
+    # Join "col: value" lines column by column, skipping nulls
+    joined = np.full(n, "", dtype=object)
+    started = np.zeros(n, dtype=bool)
+    for col in columns:
+        if col == "userId":
+            continue
+        present = notna[col].to_numpy()
+        line = f"{col}: " + _row_values(df, col, row_dtype)
+        separator = np.where(started & present, "\n", "").astype(object)
+        joined = np.where(present, joined + separator + line, joined)
+        started |= present
+
+    row_contents = joined
+    if contents is not None:
+        row_contents[has_content] = contents[has_content]
+
+    missing = np.flatnonzero(~has_id)
+    if len(missing):
+        occurrences = {} if occurrences is None else occurrences
+        for i in missing:
+            key = hashlib.md5(row_contents[i].encode("utf-8")).digest()
+            seen = occurrences.get(key, 0)
+            occurrences[key] = seen + 1
+            row_ids[i] = str(uuid.uuid5(ROW_ID_NAMESPACE, f"{source_file}\n{seen}\n{row_contents[i]}"))
+
+    untitled = ~has_title
+    row_titles[untitled] = "Record " + row_ids[untitled]
+
+    return [
+        (idx, {
+            "id": row_id,
+            "userId": user_id,
+            "documentType": "csvData",
+            "title": title,
+            "content": content,
+            "version": "v1",
+            "sourceFile": source_file
+        })
+        for idx, row_id, title, content in zip(df.index, row_ids, row_titles, row_contents)
+    ]
@@ -0,0 +1,245 @@
+"""
+Streaming CSV ingestion
+Spools an upload to disk and pushes fixed-size row chunks through transform -> embed -> write stages
+"""
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from csv_documents import dataframe_to_documents
+from embeddings import embed_texts
+from vector_codec import encode_embedding
+from cosmos_bulk import BulkWriteResult, bulk_upsert
+from ingest_queue import use_queue, send_documents
+from hashing import content_hash
+
+
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "2000"))
+# Chunks allowed to wait between two stages; bounds peak memory to a few chunks
+CSV_PIPELINE_DEPTH = int(os.getenv("CSV_PIPELINE_DEPTH", "2"))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+_DONE = object()
+
+
+def spool_upload(file):
+    """
+    Copy an uploaded file to a temporary file on disk
+
+    Args:
+        file: Werkzeug FileStorage from request.files
+
+    Returns:
+        str: Path of the spooled file; the caller removes it when done
+    """
+    suffix = os.path.splitext(file.filename or "")[1]
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=suffix, dir=UPLOAD_SPOOL_DIR)
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(file.stream, out, 1024 * 1024)
+    return path
+
+
+class CsvIngestResult:
+    """Per-row outcome of a streaming CSV ingest"""
+
+    def __init__(self):
+        self.processed_ids = []
+        self.failed_rows = []
+        self.unchanged = 0
+        self.seen_ids = set()
+        self.write_result = BulkWriteResult()
+
+
+def _embed_stage(client, chunk):
+    """Attach embeddings to a chunk's documents, recording per-row failures"""
+    to_embed = [(idx, doc) for idx, doc in chunk["documents"] if doc["content"].strip()]
+    vectors, emb_errors = embed_texts(client, [doc["content"] for _, doc in to_embed])
+    for (idx, doc), vector in zip(to_embed, vectors):
+        if vector is not None:
+            encode_embedding(doc, vector)
+    for pos, emb_err in emb_errors.items():
+        idx, doc = to_embed[pos]
+        print(f"[Embedding Error] Row {idx} (ID: {doc['id']}): {emb_err}")
+        chunk["failed"].append(f"Row {idx}: embedding failed - {emb_err}")
+    return chunk
+
+
+def _diff_chunk(documents, existing, seen_ids):
+    """Stamp content hashes and split a chunk into changed documents and unchanged ids"""
+    changed = []
+    unchanged = []
+    for idx, doc in documents:
+        doc["contentHash"] = content_hash(doc)
+        seen_ids.add(doc["id"])
+        stored = existing.get(doc["id"])
+        # Unchanged only if the stored copy also got its embedding (or needs none)
+        if stored and stored[0] == doc["contentHash"] and (stored[1] or not doc["content"].strip()):
+            unchanged.append(doc["id"])
+        else:
+            changed.append((idx, doc))
+    return {"documents": changed, "unchanged": unchanged, "failed": []}
+
+
+def _write_stage(container, chunk, result, on_progress, on_written=None):
+    """Write a chunk's documents once each and fold the outcome into the result"""
+    documents = chunk["documents"]
+    failed = {}
+    if documents and use_queue():
+        sent, failed = send_documents([doc for _, doc in documents])
+        result.write_result.merge(sent, failed, 0.0)
+    elif documents:
+        written = bulk_upsert(container, [doc for _, doc in documents])
+        failed = written.failed
+        result.write_result.merge(written.written, written.failed, written.request_charge)
+
+    result.failed_rows.extend(chunk["failed"])
+    result.unchanged += len(chunk["unchanged"])
+    result.processed_ids.extend(chunk["unchanged"])
+    for idx, document in documents:
+        if document["id"] in failed:
+            result.failed_rows.append(f"Row {idx}: {failed[document['id']]}")
+        else:
+            result.processed_ids.append(document["id"])
+
+    if on_written and documents:
+        on_written([doc for _, doc in documents if doc["id"] not in failed])
+    if on_progress:
+        on_progress(len(result.processed_ids), len(result.failed_rows))
+
+
+def _run_stage(work, inbox, outbox, errors):
+    """Consume a stage's inbox until _DONE; after any failure keep draining so upstream never blocks"""
+    while True:
+        chunk = inbox.get()
+        if chunk is _DONE:
+            if outbox is not None:
+                outbox.put(_DONE)
+            return
+        if errors:
+            continue
+        try:
+            out = work(chunk)
+            if outbox is not None:
+                outbox.put(out)
+        except Exception as e:
+            errors.append(e)
+
+
+def count_rows(path):
+    """Approximate data rows in a CSV (line count minus header), for progress and ETA"""
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    if last != b"\n":
+        lines += 1  # final line without a trailing newline
+    return max(0, lines - 1)
+
+
+def _column_dtypes(pd, path, chunk_rows):
+    """
+    The dtype pandas infers for each column when reading the whole file
+
+    Chunked reads infer dtypes per chunk, so the same value could be formatted differently
+    (1 or 1.0) depending on where the chunks split; reading every chunk with these dtypes
+    keeps ids and contents what a single read of the file gives.
+    """
+    dtypes = {}
+    with pd.read_csv(path, chunksize=chunk_rows) as reader:
+        for df in reader:
+            for col, dtype in df.dtypes.items():
+                seen = dtypes.setdefault(col, dtype)
+                if seen == dtype:
+                    continue
+                if pd.api.types.is_numeric_dtype(seen) and pd.api.types.is_numeric_dtype(dtype) \
+                        and not pd.api.types.is_bool_dtype(seen) and not pd.api.types.is_bool_dtype(dtype):
+                    dtypes[col] = np.result_type(seen, dtype)  # int chunks next to float (or all-null) ones
+                else:
+                    dtypes[col] = np.dtype(object)
+    return dtypes
+
+
+def ingest_csv_file(container, client, path, user_id, source_file, chunk_rows=CSV_CHUNK_ROWS,
+                    on_progress=None, existing=None, on_written=None):
+    """
+    Ingest a CSV from disk chunk by chunk
+
+    Reading/transforming, embedding and writing run as separate stages, so chunk N+1
+    is parsed while chunk N is being embedded and chunk N-1 written. Only a few
+    chunks are held in memory at once, whatever the file size.
+
+    Args:
+        container: Cosmos DB container client
+        client: OpenAI or AzureOpenAI client
+        path (str): Spooled CSV file
+        user_id (str): Partition key for the documents
+        source_file (str): File name stored as sourceFile
+        chunk_rows (int): Rows per chunk
+        on_progress (callable, optional): Called as on_progress(rows_done, rows_failed) after each chunk
+        existing (dict, optional): id -> (contentHash, has embedding) of the rows already stored;
+            rows that match are neither embedded nor written
+        on_written (callable, optional): Called with the documents written (or queued) by each chunk
+
+    In queue mode (INGEST_MODE=queue) documents are sent to QueueToCosmos, which embeds
+    and writes them, instead of being embedded and written here.
+
+    Returns:
+        CsvIngestResult: Processed ids (including unchanged ones), failed rows, seen ids and write stats
+
+    Raises:
+        Exception: The first error raised by a stage (e.g. a CSV parse error)
+    """
+    result = CsvIngestResult()
+    existing = existing or {}
+    occurrences = {}
+    errors = []
+    to_embed = queue.Queue(maxsize=CSV_PIPELINE_DEPTH)
+    to_write = queue.Queue(maxsize=CSV_PIPELINE_DEPTH)
+
+    stages = [
+        threading.Thread(
+            target=_run_stage,
+            args=(lambda chunk: chunk if use_queue() else _embed_stage(client, chunk), to_embed, to_write, errors),
+            daemon=True,
+        ),
+        threading.Thread(
+            target=_run_stage,
+            args=(lambda chunk: _write_stage(container, chunk, result, on_progress, on_written), to_write, None, errors),
+            daemon=True,
+        ),
+    ]
+    for stage in stages:
+        stage.start()
+
+    started = time.perf_counter()
+
+    try:
+        # Imported here so the server starts without loading pandas
+        import pandas as pd
+
+        dtypes = _column_dtypes(pd, path, chunk_rows)
+        with pd.read_csv(path, chunksize=chunk_rows, dtype=dtypes) as reader:
+            for df in reader:
+                if errors:
+                    break
+                documents = dataframe_to_documents(df, user_id, source_file, occurrences)
+                to_embed.put(_diff_chunk(documents, existing, result.seen_ids))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        to_embed.put(_DONE)
+        for stage in stages:
+            stage.join()
+
+    result.write_result.elapsed = time.perf_counter() - started
+
+    if errors:
+        raise errors[0]
+    return result
@@ -0,0 +1,154 @@
+"""
+Per-user Cosmos DB access
+Routes every per-user operation to the user's partition (partition key /userId) and records its RU charge
+"""
+import os
+import time
+import threading
+
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+
+
+# Print one line per operation with its request charge
+COSMOS_LOG_CHARGES = os.getenv("COSMOS_LOG_CHARGES", "on").lower() not in ("off", "false", "0")
+
+_stats = {}  # operation -> {"calls", "items", "requestCharge", "seconds"}
+_stats_lock = threading.Lock()
+
+
+class _Charge:
+    """response_hook that adds up x-ms-request-charge over every page of a response"""
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.request_charge = 0.0
+        self.started = time.monotonic()
+
+    def __call__(self, headers, _result):
+        try:
+            self.request_charge += float((headers or {}).get("x-ms-request-charge", 0) or 0)
+        except (TypeError, ValueError):
+            pass
+
+    def record(self, items):
+        elapsed = time.monotonic() - self.started
+        with _stats_lock:
+            entry = _stats.setdefault(self.operation, {"calls": 0, "items": 0, "requestCharge": 0.0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["items"] += items
+            entry["requestCharge"] += self.request_charge
+            entry["seconds"] += elapsed
+        if COSMOS_LOG_CHARGES:
+            print(f"[Cosmos] {self.operation}: {items} item(s), {self.request_charge:.2f} RU, {elapsed * 1000:.0f} ms")
+
+
+def query_user_items(container, user_id, operation, query, parameters=None):
+    """
+    Run a query inside one user's partition
+
+    The query should not filter on c.userId itself and should select only the fields it needs.
+
+    Args:
+        container: Cosmos DB container client
+        user_id (str): Partition key of the user
+        operation (str): Name used in the RU log and stats
+        query (str): SQL query
+        parameters (list, optional): Query parameters
+
+    Returns:
+        list: The matching items
+    """
+    charge = _Charge(operation)
+    items = list(container.query_items(
+        query=query,
+        parameters=parameters or [],
+        partition_key=user_id,
+        response_hook=charge
+    ))
+    charge.record(len(items))
+    return items
+
+
+async def query_user_items_async(container, user_id, operation, query, parameters=None):
+    """
+    query_user_items for an azure.cosmos.aio container (used by the ASGI server)
+
+    Returns:
+        list: The matching items
+    """
+    charge = _Charge(operation)
+    items = [
+        item async for item in container.query_items(
+            query=query,
+            parameters=parameters or [],
+            partition_key=user_id,
+            response_hook=charge
+        )
+    ]
+    charge.record(len(items))
+    return items
+
+
+def read_user_item(container, user_id, item_id, operation):
+    """
+    Point read of one item in the user's partition
+
+    Returns:
+        dict: The item, or None when it doesn't exist
+    """
+    charge = _Charge(operation)
+    try:
+        item = container.read_item(item=item_id, partition_key=user_id, response_hook=charge)
+    except CosmosResourceNotFoundError:
+        charge.record(0)
+        return None
+    charge.record(1)
+    return item
+
+
+def write_user_item(container, item, operation, etag=None, create=False):
+    """
+    Write one item (it carries its own userId partition key)
+
+    Args:
+        container: Cosmos DB container client
+        item (dict): The document
+        operation (str): Name used in the RU log and stats
+        etag (str, optional): Replace only if the stored item still has this etag
+        create (bool): Fail if the item already exists instead of overwriting it
+
+    Returns:
+        dict: The stored item
+
+    Raises:
+        CosmosAccessConditionFailedError: If etag no longer matches
+        CosmosResourceExistsError: If create is set and the item exists
+    """
+    charge = _Charge(operation)
+    if etag:
+        stored = container.replace_item(
+            item=item["id"], body=item, etag=etag,
+            match_condition=MatchConditions.IfNotModified, response_hook=charge
+        )
+    elif create:
+        stored = container.create_item(item, response_hook=charge)
+    else:
+        stored = container.upsert_item(item, response_hook=charge)
+    charge.record(1)
+    return stored
+
+
+def charge_stats():
+    """RU totals per operation since startup"""
+    with _stats_lock:
+        return {
+            operation: {
+                "calls": entry["calls"],
+                "items": entry["items"],
+                "requestCharge": round(entry["requestCharge"], 2),
+                "ruPerCall": round(entry["requestCharge"] / entry["calls"], 2) if entry["calls"] else 0.0,
+                "avgMs": round(entry["seconds"] * 1000 / entry["calls"], 1) if entry["calls"] else 0.0,
+            }
+            for operation, entry in _stats.items()
+        }
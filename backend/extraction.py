@@ -0,0 +1,188 @@
+"""
+Text extraction for policy documents
+Parses PDF/DOCX files on a process pool, splitting large PDFs into page ranges parsed in parallel
+"""
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from chunking import PAGE_BREAK
+
+
+# Worker processes for CPU-bound parsing (0 parses in the calling thread)
+EXTRACT_PROCESSES = int(os.getenv("EXTRACT_PROCESSES", str(os.cpu_count() or 2)))
+# Pages per task when a PDF is split across workers
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "20"))
+# "fork" keeps workers from re-running server.py at startup, which "spawn"/"forkserver" would do
+# (server.py is run as a script and builds the app at import time). Forking is only safe while
+# the process has a single thread, so the pool is started by start_pool() before any others exist.
+EXTRACT_START_METHOD = os.getenv(
+    "EXTRACT_START_METHOD",
+    "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+# PyPDF2 and python-docx are imported where they are used, so importing this module
+# (and starting the server) doesn't pay for them until a policy document arrives
+
+def _page_text(page):
+    # Every page ends with a form feed so chunks can report page numbers
+    return (page.extract_text() or "") + "\n" + PAGE_BREAK
+
+
+def extract_text_from_docx(file):
+    """Extract text from DOCX/DOC file."""
+    try:
+        from docx import Document
+
+        file.seek(0)
+        doc = Document(file)
+        text = "\n".join([para.text for para in doc.paragraphs])
+        return text
+    except Exception as e:
+        logging.error(f"DOCX extraction error: {str(e)}")
+        raise
+
+
+# --- Worker functions (run in pool processes, so they take paths rather than open files) ---
+
+def _pdf_pages(path, start=0, stop=None):
+    """Text of pages [start, stop) of a PDF (to the last page without stop)"""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    stop = len(reader.pages) if stop is None else stop
+    return "".join(_page_text(reader.pages[i]) for i in range(start, stop))
+
+
+def _pdf_head(path):
+    """Page count of a PDF and the text of its first PDF_PAGES_PER_TASK pages"""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    page_count = len(reader.pages)
+    stop = min(page_count, PDF_PAGES_PER_TASK)
+    return page_count, "".join(_page_text(reader.pages[i]) for i in range(stop))
+
+
+def _ready():
+    return True
+
+
+def _docx_text(path):
+    with open(path, "rb") as file:
+        return extract_text_from_docx(file)
+
+
+# Global instance
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _new_pool():
+    return ProcessPoolExecutor(
+        max_workers=EXTRACT_PROCESSES,
+        mp_context=multiprocessing.get_context(EXTRACT_START_METHOD),
+    )
+
+
+def start_pool():
+    """
+    Create the process pool and start its workers now
+
+    Call at startup, before the server starts any thread: a forked worker inherits only the
+    forking thread, so locks held by other threads (logging, SQLite, HTTP pools...) would
+    stay locked in it forever.
+    """
+    global _pool
+
+    if EXTRACT_PROCESSES <= 0:
+        return
+    with _pool_lock:
+        if _pool is None:
+            pool = _new_pool()
+            # Fork every worker up front; a fork pool doesn't add workers later
+            for future in [pool.submit(_ready) for _ in range(EXTRACT_PROCESSES)]:
+                future.result()
+            _pool = pool
+
+
+def _get_pool():
+    """Shared process pool, or None when parsing should stay in-process"""
+    global _pool
+
+    if EXTRACT_PROCESSES <= 0:
+        return None
+    with _pool_lock:
+        # Without start_pool() (e.g. a script using this module), only fork while single-threaded
+        if _pool is None and (EXTRACT_START_METHOD != "fork" or threading.active_count() == 1):
+            _pool = _new_pool()
+    return _pool
+
+
+def _reset_pool():
+    """Drop a broken pool; a fork pool is only replaced if no other thread is running by now"""
+    global _pool
+    with _pool_lock:
+        _pool = None
+    logging.warning("Extraction pool broke, parsing in-process")
+
+
+def _run(fn, *args):
+    """Run fn on the pool and wait for it; falls back to the current thread when the pool is unavailable"""
+    pool = _get_pool()
+    if pool is None:
+        return fn(*args)
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        _reset_pool()
+        return fn(*args)
+
+
+def _extract_pdf(path):
+    pool = _get_pool()
+    if pool is None:
+        return _pdf_pages(path)
+
+    # The first worker counts the pages (and parses the first range), so the calling thread never
+    # parses the PDF; a large PDF's other page ranges then go to different workers, joined in page order
+    try:
+        page_count, head = pool.submit(_pdf_head, path).result()
+        ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count))
+                  for start in range(PDF_PAGES_PER_TASK, page_count, PDF_PAGES_PER_TASK)]
+        futures = [pool.submit(_pdf_pages, path, start, stop) for start, stop in ranges]
+        return head + "".join(future.result() for future in futures)
+    except BrokenProcessPool:
+        _reset_pool()
+        return _pdf_pages(path)
+
+
+def extract_file(path, filename):
+    """
+    Extract the text of a spooled upload
+
+    Safe to call from many threads at once; parsing itself runs on the process pool.
+
+    Args:
+        path (str): Spooled file
+        filename (str): Original name, used for the file type
+
+    Returns:
+        str: The extracted text
+
+    Raises:
+        ValueError: If the file type is not supported
+    """
+    file_ext = filename.lower().split(".")[-1]
+    if file_ext == "pdf":
+        return _extract_pdf(path)
+    if file_ext in ("docx", "doc"):
+        return _run(_docx_text, path)
+    if file_ext == "txt":
+        with open(path, "rb") as file:
+            return file.read().decode("utf-8", errors="ignore")
+    raise ValueError("Unsupported file type. Use PDF, DOCX, DOC, or TXT.")
@@ -0,0 +1,181 @@
+"""
+Per-user file manifest
+One small document per user listing uploaded CSV and policy files, kept current by the upload jobs
+so the file listing is a single point read instead of DISTINCT scans over every row
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError, CosmosResourceExistsError
+
+from data_access import query_user_items, read_user_item, write_user_item
+
+
+MANIFEST_ID = "file-manifest"
+MANIFEST_CACHE_USERS = int(os.getenv("MANIFEST_CACHE_USERS", "1000"))
+# Uploads handled by another worker process only show up here after this long
+MANIFEST_TTL_SECONDS = float(os.getenv("MANIFEST_TTL_SECONDS", "60"))
+# Questions re-read the manifest at most this often to notice uploads handled by another worker
+# process (its etag is the version stamp the search caches are checked against)
+MANIFEST_VERSION_SECONDS = float(os.getenv("MANIFEST_VERSION_SECONDS", "5"))
+MANIFEST_WRITE_ATTEMPTS = 5
+
+
+class FileManifestStore:
+    """Reads and writes manifests, with an in-memory LRU in front of Cosmos DB"""
+
+    def __init__(self, max_users=MANIFEST_CACHE_USERS, ttl_seconds=MANIFEST_TTL_SECONDS):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._manifests = OrderedDict()  # user id -> (loaded at, manifest)
+        self._lock = threading.Lock()
+
+    def _remember(self, user_id, manifest):
+        with self._lock:
+            self._manifests[user_id] = (time.monotonic(), manifest)
+            self._manifests.move_to_end(user_id)
+            while len(self._manifests) > self.max_users:
+                self._manifests.popitem(last=False)
+
+    def get(self, container, user_id, max_age=None):
+        """
+        Get the user's manifest, building it from the stored documents the first time
+
+        Args:
+            container: Cosmos DB container client
+            user_id (str): Partition key of the user
+            max_age (float, optional): Oldest cached copy to accept, in seconds (default: the TTL)
+
+        Returns:
+            dict: The manifest document
+        """
+        max_age = self.ttl_seconds if max_age is None else max_age
+        with self._lock:
+            entry = self._manifests.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] < max_age:
+                self._manifests.move_to_end(user_id)
+                return entry[1]
+
+        manifest = read_user_item(container, user_id, MANIFEST_ID, "manifest.read")
+        if manifest is None:
+            # Uploads made before manifests existed: scan once, then keep the result
+            try:
+                manifest = write_user_item(container, self._build(container, user_id), "manifest.create", create=True)
+            except CosmosResourceExistsError:
+                manifest = read_user_item(container, user_id, MANIFEST_ID, "manifest.read")
+
+        self._remember(user_id, manifest)
+        return manifest
+
+    def update(self, container, user_id, csv_files=None, policy_files=None):
+        """
+        Replace the CSV and/or policy file lists of a user's manifest
+
+        Args:
+            container: Cosmos DB container client
+            user_id (str): Partition key of the user
+            csv_files (list, optional): {"name", "rows", "uploadedAt"} entries
+            policy_files (list, optional): {"name", "chunks", "uploadedAt"} entries
+
+        Returns:
+            dict: The stored manifest
+        """
+        # Read-modify-write guarded by the etag, so concurrent uploads (possibly in other
+        # worker processes) don't overwrite each other's changes
+        for _ in range(MANIFEST_WRITE_ATTEMPTS):
+            manifest = read_user_item(container, user_id, MANIFEST_ID, "manifest.read")
+            updated = dict(manifest or self._build(container, user_id))
+            if csv_files is not None:
+                updated["csvFiles"] = csv_files
+            if policy_files is not None:
+                updated["policyFiles"] = policy_files
+            updated["updatedAt"] = time.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+            try:
+                if manifest is None:
+                    stored = write_user_item(container, updated, "manifest.create", create=True)
+                else:
+                    stored = write_user_item(container, updated, "manifest.replace", etag=manifest["_etag"])
+            except (CosmosAccessConditionFailedError, CosmosResourceExistsError):
+                continue
+
+            self._remember(user_id, stored)
+            return stored
+
+        # Too much contention: let the next read fetch whatever won
+        self.invalidate(user_id)
+        raise RuntimeError(f"Could not update the file manifest of user {user_id}")
+
+    def version(self, container, user_id):
+        """
+        Version stamp of the user's document set: the manifest's etag, which every upload changes
+
+        Returns:
+            str: The etag, at most MANIFEST_VERSION_SECONDS old
+        """
+        return self.get(container, user_id, max_age=MANIFEST_VERSION_SECONDS).get("_etag")
+
+    def invalidate(self, user_id):
+        """Drop a user's cached manifest so the next read goes to Cosmos DB"""
+        with self._lock:
+            self._manifests.pop(user_id, None)
+
+    def _build(self, container, user_id):
+        csv_files = {}
+        for item in query_user_items(
+            container, user_id, "manifest.buildCsv",
+            """
+            SELECT c.sourceFile, COUNT(1) AS rowCount
+            FROM c
+            WHERE (c.documentType = @csvType OR NOT IS_DEFINED(c.documentType))
+              AND IS_DEFINED(c.sourceFile)
+            GROUP BY c.sourceFile
+            """,
+            [{"name": "@csvType", "value": "csvData"}]
+        ):
+            csv_files[item["sourceFile"]] = {"name": item["sourceFile"], "rows": item["rowCount"], "uploadedAt": None}
+
+        policy_files = {}
+        for item in query_user_items(
+            container, user_id, "manifest.buildPolicy",
+            """
+            SELECT c.fileName, c.uploadedAt
+            FROM c
+            WHERE c.documentType = @policyType
+            """,
+            [{"name": "@policyType", "value": "policyDocument"}]
+        ):
+            entry = policy_files.setdefault(item.get("fileName"), {
+                "name": item.get("fileName"), "chunks": 0, "uploadedAt": item.get("uploadedAt")
+            })
+            entry["chunks"] += 1
+
+        return {
+            "id": MANIFEST_ID,
+            "userId": user_id,
+            "documentType": "fileManifest",
+            "csvFiles": list(csv_files.values()),
+            "policyFiles": list(policy_files.values()),
+            "updatedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+
+
+# Global instance
+_manifest_store_instance = None
+
+
+def get_manifest_store():
+    """
+    Get or create the global manifest store
+
+    Returns:
+        FileManifestStore: The shared store instance
+    """
+    global _manifest_store_instance
+
+    if _manifest_store_instance is None:
+        _manifest_store_instance = FileManifestStore()
+
+    return _manifest_store_instance
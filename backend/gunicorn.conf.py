@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for the async serving mode
+Each worker runs one uvicorn event loop serving asgi:application (see README, "Async serving mode")
+
+Usage (from backend/):
+    gunicorn -c gunicorn.conf.py asgi:application
+"""
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# One event loop per core; an async worker keeps many requests in flight, so the sync-worker
+# rule of 2 x cores + 1 doesn't apply
+workers = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count())))
+
+# After SIGTERM a worker stops accepting, finishes open requests and then runs the ASGI shutdown
+# (upload jobs, connection pools); whatever is still running after this many seconds is killed
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "30"))
+# Workers silent for this long are restarted
+timeout = int(os.getenv("WORKER_TIMEOUT_SECONDS", "120"))
+keepalive = int(os.getenv("KEEPALIVE_SECONDS", "5"))
+
+# Recycle workers now and then to bound memory growth (the jitter keeps them from restarting together)
+max_requests = int(os.getenv("WORKER_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+
+# Clients, connection pools and the ANN index lock belong to one process: create them after the fork
+preload_app = False
+
+accesslog = "-"
+
+# Every worker has its own document parsing pool; share the cores between them
+os.environ.setdefault("EXTRACT_PROCESSES", str(max(1, multiprocessing.cpu_count() // workers)))
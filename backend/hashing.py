@@ -0,0 +1,29 @@
+"""
+Content hashes for incremental re-uploads
+A document whose hash is unchanged since the last upload needs no new embedding and no write
+"""
+import hashlib
+import json
+
+
+# Fields whose change requires the stored document to be rewritten
+HASHED_FIELDS = ("title", "content", "sourceFile", "fileName", "version")
+
+
+def content_hash(document):
+    """SHA-256 over the document's user-visible fields"""
+    payload = json.dumps(
+        [document.get(field) for field in HASHED_FIELDS],
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+    """SHA-256 of a file's bytes, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,72 @@
+"""
+Compressed, revalidatable JSON responses
+Bodies are tagged with an ETag so repeat requests get a 304, and compressed with brotli (when
+installed) or gzip for clients that accept it
+"""
+import os
+import gzip
+import json
+import hashlib
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+
+# Bodies smaller than this are sent uncompressed (the headers would cost more than they save)
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+
+def _encoders():
+    encoders = {"gzip": lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL)}
+    if brotli is not None:
+        encoders["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+    return encoders
+
+
+def negotiate_encoding(request):
+    """The best content coding the client accepts and we support, or None for identity"""
+    encoders = _encoders()
+    # Prefer brotli when both are equally acceptable
+    offered = [name for name in ("br", "gzip") if name in encoders]
+    return request.accept_encodings.best_match(offered)
+
+
+def cached_json(request, payload, max_age=0):
+    """
+    JSON response with a weak ETag, answered with 304 when the client already has it
+
+    The ETag is weak because the same JSON is sent with different content codings;
+    If-None-Match uses weak comparison, so a gzip client and a brotli client both revalidate.
+
+    Args:
+        request: The Flask request
+        payload: JSON-serializable body
+        max_age (int): Seconds the browser may reuse the body without revalidating
+
+    Returns:
+        Response: 200 with the (possibly compressed) body, or 304 Not Modified
+    """
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+    response = Response(body, mimetype="application/json")
+    response.set_etag(hashlib.sha256(body).hexdigest()[:32], weak=True)
+    # Per-user data: private caches only, and revalidate once max_age has passed
+    response.headers["Cache-Control"] = f"private, max-age={max_age}, must-revalidate"
+    response.vary.add("Accept-Encoding")
+    response.vary.add("Authorization")
+
+    response = response.make_conditional(request)
+    if response.status_code == 304 or len(body) < COMPRESS_MIN_BYTES:
+        return response
+
+    encoding = negotiate_encoding(request)
+    if encoding:
+        response.set_data(_encoders()[encoding](body))
+        response.headers["Content-Encoding"] = encoding
+    return response
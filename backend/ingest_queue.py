@@ -0,0 +1,109 @@
+"""
+Hand-off to the QueueToCosmos function
+Sends documents to the Azure Storage queue (myqueue-items) instead of writing them from the API process
+"""
+import os
+import json
+import threading
+
+
+# "local" writes from the API's worker pool; "queue" hands documents to QueueToCosmos
+INGEST_MODE = os.getenv("INGEST_MODE", "local").lower()
+INGEST_QUEUE_NAME = os.getenv("INGEST_QUEUE_NAME", "myqueue-items")
+INGEST_QUEUE_CONNECTION = os.getenv("AZURE_STORAGE_CONNECTION_STRING") or os.getenv("AzureWebJobsStorage")
+
+# Documents packed into one queue message, so QueueToCosmos handles them in one invocation
+INGEST_QUEUE_BATCH_SIZE = int(os.getenv("INGEST_QUEUE_BATCH_SIZE", "32"))
+# Queue messages are capped at 64 KB after base64 encoding (which adds a third)
+MAX_MESSAGE_BYTES = 46 * 1024
+
+_queue_client = None
+_queue_lock = threading.Lock()
+
+
+def use_queue():
+    """True when uploads should be handed to QueueToCosmos"""
+    return INGEST_MODE == "queue"
+
+
+def _get_queue_client():
+    global _queue_client
+
+    with _queue_lock:
+        if _queue_client is None:
+            if not INGEST_QUEUE_CONNECTION:
+                raise RuntimeError("INGEST_MODE=queue needs AZURE_STORAGE_CONNECTION_STRING")
+            from azure.storage.queue import QueueClient, TextBase64EncodePolicy
+
+            # The Functions queue trigger expects base64-encoded messages by default
+            _queue_client = QueueClient.from_connection_string(
+                INGEST_QUEUE_CONNECTION,
+                INGEST_QUEUE_NAME,
+                message_encode_policy=TextBase64EncodePolicy(),
+            )
+    return _queue_client
+
+
+def _batch_messages(documents, version, max_items, max_bytes):
+    """
+    Pack documents into batch messages of at most max_items documents / max_bytes (UTF-8)
+
+    A document too large for a message even on its own is not sent: the queue would reject it.
+
+    Yields:
+        tuple: (document ids, message body, None), or ([document id], None, error) for a document too large
+    """
+    envelope = len(_batch_body([], version).encode("utf-8"))
+    ids = []
+    items = []
+    size = envelope
+    for document in documents:
+        item = json.dumps({"id": document["id"], "userId": document["userId"], "data": document}, default=str)
+        item_bytes = len(item.encode("utf-8")) + 1  # with its separating comma
+        if envelope + item_bytes > max_bytes:
+            yield [document["id"]], None, (
+                f"Document is {envelope + item_bytes} bytes as a queue message, over the {max_bytes}-byte limit"
+            )
+            continue
+        if items and (len(items) >= max_items or size + item_bytes > max_bytes):
+            yield ids, _batch_body(items, version), None
+            ids, items, size = [], [], envelope
+        ids.append(document["id"])
+        items.append(item)
+        size += item_bytes
+    if items:
+        yield ids, _batch_body(items, version), None
+
+
+def _batch_body(items, version):
+    return f'{{"action": "upsert", "version": {json.dumps(version)}, "items": [{",".join(items)}]}}'
+
+
+def send_documents(documents, version="v1", max_items=INGEST_QUEUE_BATCH_SIZE, max_bytes=MAX_MESSAGE_BYTES):
+    """
+    Enqueue upsert messages, several documents per message
+
+    Args:
+        documents (list): Cosmos documents including id and userId
+        version (str): Version stamp written by QueueToCosmos
+        max_items (int): Maximum documents per message
+        max_bytes (int): Maximum message size in UTF-8 bytes before encoding
+
+    Returns:
+        tuple: (sent ids, {failed id: error}); documents too large for a message are failed, not sent
+    """
+    queue_client = _get_queue_client()
+    sent = []
+    failed = {}
+    for ids, body, error in _batch_messages(documents, version, max_items, max_bytes):
+        if error:
+            print(f"[Ingest Queue] Not sending {ids[0]}: {error}")
+            failed[ids[0]] = error
+            continue
+        try:
+            queue_client.send_message(body)
+            sent.extend(ids)
+        except Exception as e:
+            for doc_id in ids:
+                failed[doc_id] = str(e)
+    return sent, failed
@@ -0,0 +1,227 @@
+"""
+Background ingestion jobs
+Runs uploads on a local worker pool and tracks their progress for /api/jobs/<id>
+Job state is also written to a per-job document in the user's partition, so a poll that reaches
+another worker process still finds the job
+"""
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from data_access import read_user_item, write_user_item
+
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+# Progress reaches the stored job document at most this often (status changes are written at once)
+JOB_PUBLISH_SECONDS = float(os.getenv("JOB_PUBLISH_SECONDS", "2"))
+
+_STORED_FIELDS = ("kind", "unit", "file_names", "status", "total", "done", "failed", "result", "error",
+                  "created_at", "started_at", "finished_at")
+
+
+class Job:
+    """Progress of one background upload"""
+
+    def __init__(self, user_id, kind, unit, file_names):
+        self.id = str(uuid.uuid4())
+        self.user_id = user_id
+        self.kind = kind
+        self.unit = unit
+        self.file_names = file_names
+        self.status = "queued"
+        self.total = None
+        self.done = 0
+        self.failed = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.published_at = 0.0
+        self.on_change = None  # called with the job after progress, set by JobManager
+        self._lock = threading.Lock()
+
+    def progress(self, done=None, failed=None, total=None):
+        """Record progress; called from the worker thread"""
+        with self._lock:
+            if done is not None:
+                self.done = done
+            if failed is not None:
+                self.failed = failed
+            if total is not None:
+                self.total = total
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def to_document(self, retention_seconds):
+        """Cosmos DB document holding the job's state (expires with the container's TTL enabled)"""
+        with self._lock:
+            document = {
+                "id": f"job-{self.id}",
+                "userId": self.user_id,
+                "documentType": "ingestJob",
+                "ttl": int(retention_seconds),
+            }
+            for field in _STORED_FIELDS:
+                document[field] = getattr(self, field)
+            return document
+
+    @classmethod
+    def from_document(cls, document):
+        """Rebuild a job written by another worker process (read only)"""
+        job = cls(document["userId"], document["kind"], document["unit"], document["file_names"])
+        job.id = document["id"][len("job-"):]
+        for field in _STORED_FIELDS:
+            setattr(job, field, document.get(field))
+        return job
+
+    def to_dict(self):
+        """JSON-friendly status including throughput and ETA"""
+        with self._lock:
+            now = self.finished_at or time.time()
+            elapsed = now - self.started_at if self.started_at else 0.0
+            processed = self.done + self.failed
+            throughput = processed / elapsed if elapsed > 0 else 0.0
+
+            eta = None
+            if self.status == "running" and self.total and throughput > 0:
+                eta = max(0.0, (self.total - processed) / throughput)
+            elif self.status in ("completed", "failed"):
+                eta = 0.0
+
+            return {
+                "jobId": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "files": self.file_names,
+                "unit": self.unit,
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "elapsedSeconds": round(elapsed, 2),
+                "throughput": round(throughput, 1),
+                "etaSeconds": round(eta, 1) if eta is not None else None,
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class JobManager:
+    """Local worker pool plus an in-memory registry of recent jobs, shared through Cosmos DB"""
+
+    def __init__(self, max_workers=INGEST_WORKERS, retention_seconds=JOB_RETENTION_SECONDS, get_container=None):
+        """
+        Args:
+            get_container (callable, optional): Returns the Cosmos DB container (or None) the job
+                documents go to; without one, jobs are only visible to this process
+        """
+        self.retention_seconds = retention_seconds
+        self.get_container = get_container
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, user_id, kind, unit, file_names, work, *args):
+        """
+        Queue work for the pool
+
+        Args:
+            user_id (str): Owner of the job
+            kind (str): Job type, e.g. "csv" or "policy"
+            unit (str): What progress counts, e.g. "rows" or "files"
+            file_names (list): Uploaded file names, for display
+            work (callable): Called as work(job, *args); its return value becomes job.result
+
+        Returns:
+            Job: The queued job
+        """
+        job = Job(user_id, kind, unit, file_names)
+        job.on_change = self._progressed
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._publish(job)
+        self._pool.submit(self._run, job, work, args)
+        return job
+
+    def get(self, job_id, user_id):
+        """Return the job if it exists and belongs to the user, reading other processes' jobs from Cosmos DB"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job if job.user_id == user_id else None
+
+        container = self.get_container() if self.get_container else None
+        if container is None:
+            return None
+        # The document lives in the user's partition, so another user's job id is simply not found
+        document = read_user_item(container, user_id, f"job-{job_id}", "job.read")
+        return Job.from_document(document) if document else None
+
+    def _publish(self, job):
+        """Write the job's state for the other worker processes; a failure only delays what they see"""
+        job.published_at = time.monotonic()
+        container = self.get_container() if self.get_container else None
+        if container is None:
+            return
+        try:
+            write_user_item(container, job.to_document(self.retention_seconds), "job.save")
+        except Exception as e:
+            print(f"[Jobs] Could not store {job.kind} job {job.id}: {e}")
+
+    def _progressed(self, job):
+        if time.monotonic() - job.published_at >= JOB_PUBLISH_SECONDS:
+            self._publish(job)
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; with wait, block until queued and running jobs have finished"""
+        self._pool.shutdown(wait=wait)
+
+    def _run(self, job, work, args):
+        job.status = "running"
+        job.started_at = time.time()
+        self._publish(job)
+        try:
+            job.result = work(job, *args)
+            job.status = "completed"
+        except Exception as e:
+            print(f"[Jobs] {job.kind} job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            self._publish(job)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# Global instance
+_job_manager_instance = None
+
+
+def get_job_manager(get_container=None):
+    """
+    Get or create the global job manager
+
+    Args:
+        get_container (callable, optional): Returns the Cosmos DB container job state is shared through
+
+    Returns:
+        JobManager: The shared job manager
+    """
+    global _job_manager_instance
+
+    if _job_manager_instance is None:
+        _job_manager_instance = JobManager(get_container=get_container)
+
+    return _job_manager_instance
@@ -0,0 +1,374 @@
+"""
+Per-user BM25 keyword index
+Inverted index in a local SQLite file, updated by the upload jobs, for exact-term lookups
+(invoice numbers, vendor names, account codes) that embedding similarity handles poorly
+"""
+import os
+import re
+import math
+import heapq
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+
+from data_access import query_user_items
+
+
+KEYWORD_INDEX_ENABLED = os.getenv("RAG_KEYWORD_INDEX", "on").lower() not in ("off", "false", "0")
+KEYWORD_INDEX_PATH = os.getenv("KEYWORD_INDEX_PATH") or os.path.join(tempfile.gettempdir(), "keyword-index.sqlite3")
+
+# BM25 parameters
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Terms found in more than this share of a user's documents are skipped (they carry almost
+# no weight, and CSV column names appear in every row)
+KEYWORD_MAX_DF_RATIO = float(os.getenv("KEYWORD_MAX_DF_RATIO", "0.5"))
+
+# Words, numbers and identifiers such as INV-2024-0012 or 4010.200; identifiers are indexed
+# whole and also by their parts
+_TOKEN = re.compile(r"[0-9a-z]+(?:[-_./#][0-9a-z]+)*")
+_SEPARATORS = re.compile(r"[-_./#]")
+# Digits that are not record ids: decimals (10.5), quantities with a unit or ordinal (100k, 5mb, 3rd)
+# and reporting periods (q3, h1, fy24, q3-2024)
+_NOT_IDENTIFIER = re.compile(
+    r"[0-9]+\.[0-9]+|[0-9]+(?:\.[0-9]+)?[a-z]{1,2}|(?:q[1-4]|h[12]|fy[0-9]{2,4})(?:[-_./][0-9]{2,4})?"
+)
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it of on or that the this to was were "
+    "what when where which who why with show find me give list tell about".split()
+)
+
+
+def tokenize(text):
+    """Lowercased terms of a text, with compound identifiers also split into their parts"""
+    terms = []
+    for token in _TOKEN.findall((text or "").lower()):
+        if token not in _STOPWORDS:
+            terms.append(token)
+        if _SEPARATORS.search(token):
+            terms.extend(part for part in _SEPARATORS.split(token) if part and part not in _STOPWORDS)
+    return terms
+
+
+def _is_identifier(term):
+    """ID-shaped terms (INV-2024-0012, ACC4010, 4010-200): digits mixed with letters or joined by separators"""
+    if len(term) < 3 or not any(ch.isdigit() for ch in term) or _NOT_IDENTIFIER.fullmatch(term):
+        return False
+    return bool(_SEPARATORS.search(term)) or any(ch.isalpha() for ch in term)
+
+
+def _document_text(document):
+    return f"{document.get('title') or ''}\n{document.get('content') or ''}"
+
+
+class KeywordIndex:
+    """BM25 over each user's documents; only users whose index has been built are kept current"""
+
+    def __init__(self, path=KEYWORD_INDEX_PATH):
+        self._lock = threading.Lock()
+        self._checked = {}  # user id -> embedding index version last compared against
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS kw_users (
+                user_id TEXT PRIMARY KEY,
+                doc_count INTEGER NOT NULL,
+                total_length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS kw_docs (
+                user_id TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                title TEXT,
+                source_file TEXT,
+                file_name TEXT,
+                PRIMARY KEY (user_id, doc_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS kw_terms (
+                user_id TEXT NOT NULL,
+                term TEXT NOT NULL,
+                df INTEGER NOT NULL,
+                PRIMARY KEY (user_id, term)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS kw_postings (
+                user_id TEXT NOT NULL,
+                term TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (user_id, term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS kw_postings_doc ON kw_postings (user_id, doc_id);
+        """)
+        self._db.commit()
+
+    # --- Maintenance (upload jobs) ---
+
+    def _is_built(self, user_id):
+        return self._db.execute("SELECT 1 FROM kw_users WHERE user_id = ?", (user_id,)).fetchone() is not None
+
+    def _remove(self, user_id, doc_ids):
+        removed_docs = 0
+        removed_length = 0
+        for doc_id in doc_ids:
+            row = self._db.execute(
+                "SELECT length FROM kw_docs WHERE user_id = ? AND doc_id = ?", (user_id, doc_id)
+            ).fetchone()
+            if row is None:
+                continue
+            terms = [t for (t,) in self._db.execute(
+                "SELECT term FROM kw_postings WHERE user_id = ? AND doc_id = ?", (user_id, doc_id)
+            )]
+            self._db.executemany(
+                "UPDATE kw_terms SET df = df - 1 WHERE user_id = ? AND term = ?",
+                [(user_id, term) for term in terms]
+            )
+            self._db.execute("DELETE FROM kw_postings WHERE user_id = ? AND doc_id = ?", (user_id, doc_id))
+            self._db.execute("DELETE FROM kw_docs WHERE user_id = ? AND doc_id = ?", (user_id, doc_id))
+            removed_docs += 1
+            removed_length += row[0]
+        self._db.execute("DELETE FROM kw_terms WHERE user_id = ? AND df <= 0", (user_id,))
+        return removed_docs, removed_length
+
+    def _insert(self, user_id, documents):
+        doc_rows = []
+        postings = []
+        df = Counter()
+        total_length = 0
+        for document in documents:
+            terms = Counter(tokenize(_document_text(document)))
+            length = sum(terms.values())
+            total_length += length
+            doc_rows.append((
+                user_id, document["id"], length,
+                document.get("title"), document.get("sourceFile"), document.get("fileName"),
+            ))
+            postings.extend((user_id, term, document["id"], tf) for term, tf in terms.items())
+            df.update(terms.keys())
+
+        self._db.executemany(
+            "INSERT INTO kw_docs (user_id, doc_id, length, title, source_file, file_name) VALUES (?, ?, ?, ?, ?, ?)",
+            doc_rows
+        )
+        self._db.executemany("INSERT INTO kw_postings (user_id, term, doc_id, tf) VALUES (?, ?, ?, ?)", postings)
+        self._db.executemany(
+            "INSERT INTO kw_terms (user_id, term, df) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, term) DO UPDATE SET df = df + excluded.df",
+            [(user_id, term, count) for term, count in df.items()]
+        )
+        return len(doc_rows), total_length
+
+    def _adjust_totals(self, user_id, docs, length):
+        self._db.execute(
+            "UPDATE kw_users SET doc_count = doc_count + ?, total_length = total_length + ? WHERE user_id = ?",
+            (docs, length, user_id)
+        )
+
+    def add_documents(self, user_id, documents):
+        """
+        Index new or rewritten documents of a user
+
+        Users whose index hasn't been built yet are skipped; their first query builds it from Cosmos DB.
+
+        Args:
+            user_id (str): Partition key of the user
+            documents (list): Documents with 'id' and 'content' (plus title/sourceFile/fileName)
+        """
+        # The last copy of a repeated id wins, as in the bulk write
+        documents = list({doc["id"]: doc for doc in documents if doc.get("content") is not None}.values())
+        if not documents:
+            return
+        with self._lock:
+            if not self._is_built(user_id):
+                return
+            removed_docs, removed_length = self._remove(user_id, [doc["id"] for doc in documents])
+            added_docs, added_length = self._insert(user_id, documents)
+            self._adjust_totals(user_id, added_docs - removed_docs, added_length - removed_length)
+            self._db.commit()
+
+    def remove_documents(self, user_id, doc_ids):
+        """Drop deleted documents from a user's index"""
+        if not doc_ids:
+            return
+        with self._lock:
+            if not self._is_built(user_id):
+                return
+            removed_docs, removed_length = self._remove(user_id, doc_ids)
+            self._adjust_totals(user_id, -removed_docs, -removed_length)
+            self._db.commit()
+
+    def build(self, container, user_id):
+        """
+        (Re)build a user's index from the documents stored in Cosmos DB
+
+        Args:
+            container: Cosmos DB container client
+            user_id (str): Partition key of the user
+
+        Returns:
+            int: Number of documents indexed
+        """
+        documents = query_user_items(
+            container, user_id, "keyword.build",
+            "SELECT c.id, c.title, c.content, c.sourceFile, c.fileName FROM c WHERE IS_STRING(c.content)"
+        )
+        with self._lock:
+            for table in ("kw_postings", "kw_terms", "kw_docs", "kw_users"):
+                self._db.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            doc_count, total_length = self._insert(user_id, documents)
+            self._db.execute(
+                "INSERT INTO kw_users (user_id, doc_count, total_length) VALUES (?, ?, ?)",
+                (user_id, doc_count, total_length)
+            )
+            self._db.commit()
+        print(f"[Keyword Index] Built index of {doc_count} documents for user {user_id}")
+        return doc_count
+
+    def ensure_current(self, container, user_id, embedding_index):
+        """
+        Build the user's index if it is missing or lacks documents the embedding index has
+
+        Uploads through another server instance only reach this file that way. The comparison
+        only runs when the embedding index version changes.
+
+        Args:
+            container: Cosmos DB container client
+            user_id (str): Partition key of the user
+            embedding_index: The user's current UserEmbeddingIndex or AnnShard
+        """
+        if self._checked.get(user_id) == embedding_index.version:
+            return
+        with self._lock:
+            built = self._is_built(user_id)
+            indexed = {doc_id for (doc_id,) in self._db.execute(
+                "SELECT doc_id FROM kw_docs WHERE user_id = ?", (user_id,)
+            )} if built else set()
+        if not built or any(doc_id not in indexed for doc_id in embedding_index.doc_ids()):
+            self.build(container, user_id)
+        self._checked[user_id] = embedding_index.version
+
+    # --- Queries ---
+
+    def _score(self, user_id, terms, k):
+        """BM25 top-k over the given terms"""
+        terms = list(set(terms))
+        if not terms:
+            return []
+        with self._lock:
+            totals = self._db.execute(
+                "SELECT doc_count, total_length FROM kw_users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if not totals or not totals[0]:
+                return []
+            doc_count, total_length = totals
+            marks = ",".join("?" * len(terms))
+            idf = {}
+            for term, df in self._db.execute(
+                f"SELECT term, df FROM kw_terms WHERE user_id = ? AND term IN ({marks})", [user_id, *terms]
+            ):
+                if df <= doc_count * KEYWORD_MAX_DF_RATIO or doc_count == 1:
+                    idf[term] = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            if not idf:
+                return []
+            marks = ",".join("?" * len(idf))
+            rows = self._db.execute(
+                f"""
+                SELECT p.doc_id, p.term, p.tf, d.length
+                FROM kw_postings p JOIN kw_docs d ON d.user_id = p.user_id AND d.doc_id = p.doc_id
+                WHERE p.user_id = ? AND p.term IN ({marks})
+                """,
+                [user_id, *idf]
+            ).fetchall()
+
+            average_length = total_length / doc_count or 1.0
+            scores = Counter()
+            for doc_id, term, tf, length in rows:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                scores[doc_id] += idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            if not top:
+                return []
+            marks = ",".join("?" * len(top))
+            meta = {
+                row[0]: row[1:]
+                for row in self._db.execute(
+                    f"SELECT doc_id, title, source_file, file_name FROM kw_docs WHERE user_id = ? AND doc_id IN ({marks})",
+                    [user_id, *(doc_id for doc_id, _ in top)]
+                )
+            }
+
+        return [
+            {
+                "id": doc_id,
+                "title": meta[doc_id][0],
+                "sourceFile": meta[doc_id][1],
+                "fileName": meta[doc_id][2],
+                "score": None,  # no vector similarity computed
+                "keywordScore": round(score, 4),
+            }
+            for doc_id, score in top
+        ]
+
+    def search(self, user_id, question, k):
+        """
+        BM25 ranking of a user's documents for a question
+
+        Returns:
+            list: {"id", "title", "sourceFile", "fileName", "score": None, "keywordScore"} dicts, best first
+        """
+        return self._score(user_id, tokenize(question), k)
+
+    def exact_matches(self, user_id, question, limit):
+        """
+        Documents matched by rare identifiers in the question (e.g. an invoice number)
+
+        Only identifiers (see _is_identifier; plain numbers such as years don't count) found in
+        at most `limit` documents count, so a question naming a specific record resolves to just
+        that record without a vector search.
+
+        Returns:
+            list: Like search(); empty when the question names no rare identifier
+        """
+        identifiers = list({term for term in tokenize(question) if _is_identifier(term)})
+        if not identifiers:
+            return []
+        with self._lock:
+            marks = ",".join("?" * len(identifiers))
+            rare = [
+                term for term, df in self._db.execute(
+                    f"SELECT term, df FROM kw_terms WHERE user_id = ? AND term IN ({marks})", [user_id, *identifiers]
+                )
+                if df <= limit
+            ]
+        return self._score(user_id, rare, limit) if rare else []
+
+
+# Global instance
+_keyword_index_instance = None
+_keyword_index_failed = False
+_keyword_index_lock = threading.Lock()
+
+
+def get_keyword_index():
+    """
+    Get or create the global keyword index
+
+    Returns:
+        KeywordIndex: The shared index, or None when disabled or the file can't be opened
+    """
+    global _keyword_index_instance, _keyword_index_failed
+
+    if not KEYWORD_INDEX_ENABLED or _keyword_index_failed:
+        return None
+
+    with _keyword_index_lock:
+        if _keyword_index_instance is None:
+            try:
+                _keyword_index_instance = KeywordIndex()
+            except sqlite3.Error as e:
+                print(f"[Keyword Index] Disabled, cannot open {KEYWORD_INDEX_PATH}: {e}")
+                _keyword_index_failed = True
+                return None
+
+    return _keyword_index_instance
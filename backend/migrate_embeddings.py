@@ -0,0 +1,147 @@
+"""
+Re-encode stored embeddings
+Rewrites items whose embedding is not in the target encoding (see vector_codec), one user or all users
+
+Usage (from backend/):
+    python migrate_embeddings.py float16 [--user USER_ID] [--batch 200] [--dry-run]
+"""
+import os
+import sys
+import argparse
+
+from dotenv import load_dotenv
+from azure.cosmos import CosmosClient
+
+from cosmos_bulk import BulkWriteResult, bulk_replace
+from data_access import read_user_item
+from vector_codec import ENCODINGS, encode_embedding, decode_embedding
+
+# Server-maintained properties that shouldn't be sent back on replace
+SYSTEM_PROPERTIES = ("_rid", "_self", "_etag", "_attachments", "_ts")
+
+# Items changed by an upload mid-migration are re-read and converted again at most this often
+MIGRATE_CONFLICT_ROUNDS = 3
+
+
+def _needs_reencode(item, encoding):
+    if not item.get("embedding"):
+        return False
+    if encoding == "json":
+        return "embeddingEncoding" in item
+    return item.get("embeddingEncoding") != encoding
+
+
+def _pending_query(encoding):
+    if encoding == "json":
+        return "SELECT * FROM c WHERE IS_DEFINED(c.embeddingEncoding)", []
+    return (
+        """
+        SELECT * FROM c
+        WHERE IS_DEFINED(c.embedding)
+          AND (NOT IS_DEFINED(c.embeddingEncoding) OR c.embeddingEncoding != @encoding)
+        """,
+        [{"name": "@encoding", "value": encoding}],
+    )
+
+
+def reencode(item, encoding):
+    """Copy of a stored item with its embedding in the target encoding"""
+    document = {k: v for k, v in item.items() if k not in SYSTEM_PROPERTIES}
+    vector = decode_embedding(item["embedding"], item.get("embeddingEncoding"))
+    encode_embedding(document, vector.tolist(), encoding)
+    return document
+
+
+def migrate_embeddings(container, encoding, user_id=None, batch_size=200, dry_run=False):
+    """
+    Convert stored embeddings to another encoding
+
+    Items are rewritten in bulk batches while the scan is still paging, so memory stays
+    bounded. Each write is a replace conditioned on the etag the item was read with, so a
+    document an upload rewrote in the meantime is never overwritten with the stale copy: it is
+    read again and converted only if it still needs it. Converting from int8 keeps its
+    quantization error.
+
+    Args:
+        container: Cosmos DB container client
+        encoding (str): Target encoding, one of vector_codec.ENCODINGS
+        user_id (str, optional): Only migrate this user's partition
+        batch_size (int): Items per bulk write
+        dry_run (bool): Count the items that would change without writing
+
+    Returns:
+        tuple: (items found, BulkWriteResult of the writes; 'conflicts' lists items that kept changing)
+
+    Raises:
+        ValueError: If the encoding is unknown
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown embedding encoding '{encoding}'. Use one of: {', '.join(ENCODINGS)}")
+
+    query, parameters = _pending_query(encoding)
+    if user_id:
+        items = container.query_items(query=query, parameters=parameters, partition_key=user_id)
+    else:
+        items = container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True)
+
+    found = 0
+    result = BulkWriteResult()
+    batch = []
+    for item in items:
+        found += 1
+        if dry_run:
+            continue
+        batch.append(item)
+        if len(batch) >= batch_size:
+            result.merge(*_write(container, batch, encoding))
+            batch = []
+    if batch:
+        result.merge(*_write(container, batch, encoding))
+    return found, result
+
+
+def _write(container, items, encoding):
+    """Replace a batch of scanned items, re-reading the ones an upload changed since the scan"""
+    result = BulkWriteResult()
+    for _ in range(MIGRATE_CONFLICT_ROUNDS):
+        written = bulk_replace(container, [(reencode(item, encoding), item["_etag"]) for item in items])
+        print(f"[Migrate] {written.summary()}")
+        result.merge(written.written, written.failed, written.request_charge)
+
+        changed = set(written.conflicts)
+        fresh = (read_user_item(container, item["userId"], item["id"], "migrate.reread")
+                 for item in items if item["id"] in changed)
+        # Deleted meanwhile, or rewritten by an upload already in the target encoding: nothing to do
+        items = [item for item in fresh if item is not None and _needs_reencode(item, encoding)]
+        if not items:
+            return result.written, result.failed, result.request_charge, []
+
+    print(f"[Migrate] Skipped {len(items)} item(s) that kept changing; run the migration again for them")
+    return result.written, result.failed, result.request_charge, [item["id"] for item in items]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encode stored embeddings")
+    parser.add_argument("encoding", choices=ENCODINGS)
+    parser.add_argument("--user", help="Only migrate this user id")
+    parser.add_argument("--batch", type=int, default=200, help="Items per bulk write")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the items to convert")
+    args = parser.parse_args()
+
+    load_dotenv()
+    cosmos_client = CosmosClient(url=os.environ["COSMOS_ENDPOINT"], credential=os.environ["COSMOS_KEY"])
+    container = cosmos_client.get_database_client(os.environ["COSMOS_DB_NAME"]).get_container_client(
+        os.environ["COSMOS_CONTAINER_NAME"]
+    )
+
+    found, result = migrate_embeddings(container, args.encoding, args.user, args.batch, args.dry_run)
+    if args.dry_run:
+        print(f"{found} item(s) would be converted to {args.encoding}")
+        return 0
+    print(f"Converted {len(result.written)} of {found} item(s) to {args.encoding}, {len(result.failed)} failed, "
+          f"{len(result.conflicts)} skipped after concurrent changes")
+    return 1 if result.failed or result.conflicts else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
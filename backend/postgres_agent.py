@@ -3,8 +3,27 @@ Azure AI Foundry Postgres Agent Client
 This module handles interactions with the postgres-rag-agent in Azure AI Foundry
 """
 import os
-from azure.identity import DefaultAzureCredential
-from azure.ai.projects import AIProjectClient
+import time
+import threading
+from contextlib import contextmanager
+
+from resilience import CircuitBreaker, LatencyHistogram, ServiceUnavailableError
+
+
+# Per-call limits for the agent (the SDK retries timeouts and 429/5xx up to MAX_RETRIES times)
+POSTGRES_AGENT_TIMEOUT_SECONDS = float(os.getenv("POSTGRES_AGENT_TIMEOUT_SECONDS", "60"))
+POSTGRES_AGENT_MAX_RETRIES = int(os.getenv("POSTGRES_AGENT_MAX_RETRIES", "1"))
+
+# At most this many agent calls in flight; others wait up to QUEUE_SECONDS, then get a 503
+POSTGRES_AGENT_CONCURRENCY = int(os.getenv("POSTGRES_AGENT_CONCURRENCY", "4"))
+POSTGRES_AGENT_QUEUE_SECONDS = float(os.getenv("POSTGRES_AGENT_QUEUE_SECONDS", "5"))
+
+# Fail fast after this many consecutive failures, for RESET_SECONDS
+POSTGRES_AGENT_BREAKER_FAILURES = int(os.getenv("POSTGRES_AGENT_BREAKER_FAILURES", "5"))
+POSTGRES_AGENT_BREAKER_RESET_SECONDS = float(os.getenv("POSTGRES_AGENT_BREAKER_RESET_SECONDS", "30"))
+
+# Roles the Responses API accepts as input messages
+HISTORY_ROLES = ("user", "assistant", "system", "developer")
 
 
 class PostgresAgent:
@@ -17,10 +36,34 @@ class PostgresAgent:
         self.project_client = None
         self.openai_client = None
         self._initialized = False
-        
-        # Initialize the client
-        self._initialize()
-    
+        self._init_attempted = False
+        self._init_lock = threading.Lock()
+
+        self._slots = threading.BoundedSemaphore(POSTGRES_AGENT_CONCURRENCY)
+        self.breaker = CircuitBreaker(
+            "Postgres Agent",
+            failure_threshold=POSTGRES_AGENT_BREAKER_FAILURES,
+            reset_seconds=POSTGRES_AGENT_BREAKER_RESET_SECONDS,
+        )
+        self.latency = LatencyHistogram()
+        self._in_flight = 0
+        self._rejected = 0
+        self._counter_lock = threading.Lock()
+
+    def ensure_initialized(self):
+        """
+        Connect to Azure AI Foundry on first use (or from the startup warm-up)
+
+        Building the credential chain and project client can take seconds, so it is not
+        done at import. Only one thread attempts it; the others wait for its result.
+        """
+        if self._init_attempted:
+            return
+        with self._init_lock:
+            if not self._init_attempted:
+                self._initialize()
+                self._init_attempted = True
+
     def _initialize(self):
         """Initialize connection to Azure AI Foundry"""
         if not self.endpoint:
@@ -29,6 +72,8 @@ class PostgresAgent:
         
         try:
             print(f"[Postgres Agent] Initializing with endpoint: {self.endpoint}")
+            from azure.identity import DefaultAzureCredential
+            from azure.ai.projects import AIProjectClient
             
             # Create project client with DefaultAzureCredential
             self.project_client = AIProjectClient(
@@ -36,8 +81,11 @@ class PostgresAgent:
                 credential=DefaultAzureCredential(),
             )
             
-            # Get OpenAI client for responses API
-            self.openai_client = self.project_client.get_openai_client()
+            # Get OpenAI client for responses API (one client, so its HTTP connections are reused)
+            self.openai_client = self.project_client.get_openai_client().with_options(
+                timeout=POSTGRES_AGENT_TIMEOUT_SECONDS,
+                max_retries=POSTGRES_AGENT_MAX_RETRIES,
+            )
             
             self._initialized = True
             print(f"[Postgres Agent] Successfully initialized. Agent: {self.agent_name}")
@@ -47,9 +95,98 @@ class PostgresAgent:
             self._initialized = False
     
     def is_ready(self):
-        """Check if the agent is ready to use"""
+        """Check if the agent is ready to use (initializing it on the first call)"""
+        self.ensure_initialized()
         return self._initialized and self.openai_client is not None
     
+    def stats(self):
+        """Latency histogram, breaker state and concurrency counters"""
+        return {
+            # Reported without triggering initialization
+            "ready": self._initialized and self.openai_client is not None,
+            "initAttempted": self._init_attempted,
+            "inFlight": self._in_flight,
+            "maxConcurrency": POSTGRES_AGENT_CONCURRENCY,
+            "rejected": self._rejected,
+            "circuit": self.breaker.snapshot(),
+            "latency": self.latency.snapshot(),
+        }
+
+    def _build_input(self, message, conversation_history):
+        """History (oldest first) followed by the new user message"""
+        messages = [
+            {"role": m["role"], "content": m["content"]}
+            for m in conversation_history or []
+            if m.get("role") in HISTORY_ROLES and m.get("content")
+        ]
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def _admit(self):
+        """
+        Take a concurrency slot and pass the breaker, before the call is made
+
+        Raises:
+            ServiceUnavailableError: If the breaker is open or no slot freed up in time
+        """
+        # Don't queue for a slot just to be turned away by an open breaker
+        if self.breaker.state == "open":
+            self.breaker.before_call()
+
+        if not self._slots.acquire(timeout=POSTGRES_AGENT_QUEUE_SECONDS):
+            with self._counter_lock:
+                self._rejected += 1
+            raise ServiceUnavailableError("Postgres Agent is busy, try again shortly")
+
+        try:
+            self.breaker.before_call()
+        except ServiceUnavailableError:
+            self._slots.release()
+            raise
+
+        with self._counter_lock:
+            self._in_flight += 1
+
+    def _finish(self, started, succeeded):
+        """
+        Release an admitted call's slot and report its outcome to the breaker
+
+        Args:
+            started (float): time.monotonic() when the call was admitted
+            succeeded (bool): Outcome, or None when the call was abandoned (it says nothing
+                about the agent's health, but must not leave a half-open trial running)
+        """
+        if succeeded:
+            self.breaker.record_success()
+        elif succeeded is None:
+            self.breaker.release_trial()
+        else:
+            self.breaker.record_failure()
+        self.latency.observe(time.monotonic() - started)
+        with self._counter_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    @contextmanager
+    def _guarded_call(self):
+        """
+        Run one agent call under the breaker and the concurrency cap, recording its latency
+
+        Raises:
+            ServiceUnavailableError: If the breaker is open or no slot freed up in time
+        """
+        self._admit()
+        started = time.monotonic()
+        succeeded = None
+        try:
+            yield
+            succeeded = True
+        except Exception:
+            succeeded = False
+            raise
+        finally:
+            self._finish(started, succeeded)
+
     def chat(self, message, conversation_history=None):
         """
         Send a message to the Postgres agent and get a response
@@ -63,50 +200,150 @@ class PostgresAgent:
             
         Raises:
             RuntimeError: If the agent is not properly initialized
+            ServiceUnavailableError: If the agent is failing or saturated
             Exception: If the API call fails
         """
         if not self.is_ready():
             raise RuntimeError("Postgres Agent is not initialized. Check configuration.")
         
+        with self._guarded_call():
+            try:
+                # Use Responses API with agent reference
+                # The agent has access to PostgreSQL database through its configured tools
+                response = self.openai_client.responses.create(
+                    input=self._build_input(message, conversation_history),
+                    extra_body={
+                        "agent": {
+                            "name": self.agent_name,
+                            "type": "agent_reference"
+                        }
+                    },
+                )
+                
+                # Extract response text
+                if hasattr(response, 'output_text'):
+                    return response.output_text
+                else:
+                    return str(response)
+                    
+            except Exception as e:
+                error_msg = f"Agent call failed: {type(e).__name__}: {str(e)}"
+                print(f"[Postgres Agent] {error_msg}")
+                raise Exception(error_msg)
+
+    def chat_stream(self, message, conversation_history=None):
+        """
+        Send a message to the Postgres agent and stream the response
+
+        The concurrency slot and the breaker are checked here, before the caller starts its
+        response, so a busy or failing agent can still be answered with a 503. The slot is
+        held until the stream has been fully read or closed.
+
+        Args:
+            message (str): The user's message
+            conversation_history (list, optional): Previous conversation messages
+
+        Returns:
+            AgentStream: Iterator of ("token", text) for each output text delta, then ("usage", dict or None)
+
+        Raises:
+            RuntimeError: If the agent is not properly initialized
+            ServiceUnavailableError: If the agent is failing or saturated
+        """
+        if not self.is_ready():
+            raise RuntimeError("Postgres Agent is not initialized. Check configuration.")
+
+        self._admit()
+        return AgentStream(self, self._stream_events(message, conversation_history))
+
+    def _stream_events(self, message, conversation_history):
         try:
-            # Use Responses API with agent reference
-            # The agent has access to PostgreSQL database through its configured tools
-            response = self.openai_client.responses.create(
-                input=[{"role": "user", "content": message}],
+            stream = self.openai_client.responses.create(
+                input=self._build_input(message, conversation_history),
                 extra_body={
                     "agent": {
                         "name": self.agent_name,
                         "type": "agent_reference"
                     }
                 },
+                stream=True,
             )
-            
-            # Extract response text
-            if hasattr(response, 'output_text'):
-                return response.output_text
-            else:
-                return str(response)
-                
+
+            usage = None
+            for event in stream:
+                event_type = getattr(event, "type", "")
+                if event_type == "response.output_text.delta":
+                    yield "token", event.delta
+                elif event_type == "response.completed":
+                    usage = getattr(event.response, "usage", None)
+                    if usage is not None and hasattr(usage, "model_dump"):
+                        usage = usage.model_dump(exclude_none=True)
+                elif event_type in ("response.failed", "error"):
+                    raise RuntimeError(getattr(event, "message", None) or event_type)
+
+            yield "usage", usage
+
         except Exception as e:
             error_msg = f"Agent call failed: {type(e).__name__}: {str(e)}"
             print(f"[Postgres Agent] {error_msg}")
             raise Exception(error_msg)
 
 
+class AgentStream:
+    """
+    An admitted streaming call: iterates the agent's events and releases the call's slot when
+    they run out, fail, or the stream is closed or dropped unread (e.g. the client disconnected)
+    """
+
+    def __init__(self, agent, events):
+        self._agent = agent
+        self._events = events
+        self._started = time.monotonic()
+        self._finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._events)
+        except StopIteration:
+            self._finish(True)
+            raise
+        except Exception:
+            self._finish(False)
+            raise
+
+    def close(self):
+        self._events.close()
+        self._finish(None)
+
+    __del__ = close
+
+    def _finish(self, succeeded):
+        if not self._finished:
+            self._finished = True
+            self._agent._finish(self._started, succeeded)
+
+
 # Global instance
 _postgres_agent_instance = None
+_postgres_agent_lock = threading.Lock()
 
 
 def get_postgres_agent():
     """
     Get or create the global Postgres Agent instance
     
+    The agent connects to Azure AI Foundry on first use (see ensure_initialized).
+
     Returns:
-        PostgresAgent: The initialized agent instance
+        PostgresAgent: The shared agent instance
     """
     global _postgres_agent_instance
     
-    if _postgres_agent_instance is None:
-        _postgres_agent_instance = PostgresAgent()
+    with _postgres_agent_lock:
+        if _postgres_agent_instance is None:
+            _postgres_agent_instance = PostgresAgent()
     
     return _postgres_agent_instance
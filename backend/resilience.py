@@ -0,0 +1,127 @@
+"""
+Call guards for remote dependencies
+Circuit breaker that fails fast while a service is degraded, and a fixed-bucket latency histogram
+"""
+import time
+import bisect
+import threading
+
+
+class ServiceUnavailableError(RuntimeError):
+    """Raised instead of calling a service that is failing or saturated"""
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures; while open every call
+    fails fast. After `reset_seconds` one trial call is let through (half-open): success
+    closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        """
+        Raises:
+            ServiceUnavailableError: While the breaker is open (or a half-open trial is running)
+        """
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return
+            retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+            raise ServiceUnavailableError(
+                f"{self.name} is temporarily unavailable (circuit open, retry in {retry_in:.0f}s)"
+            )
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_running:
+                    print(f"[{self.name}] Circuit opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def release_trial(self):
+        """End a call that was abandoned before it succeeded or failed (e.g. a client disconnect)"""
+        with self._lock:
+            # Stays half-open, so the next call becomes the trial
+            self._trial_running = False
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self._state(), "consecutiveFailures": self._failures}
+
+
+class LatencyHistogram:
+    """Counts of call durations per bucket (upper bounds in seconds)"""
+
+    DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last bucket: above the largest bound
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._sum += seconds
+
+    def _quantile(self, counts, total, q):
+        # Upper bound of the bucket holding the q-th observation
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        """Bucket counts plus count, mean and bucket-resolution p50/p95/p99"""
+        with self._lock:
+            counts = list(self._counts)
+            total_seconds = self._sum
+        total = sum(counts)
+        labels = [f"le_{b}" for b in self.buckets] + ["le_inf"]
+        snapshot = {
+            "count": total,
+            "meanSeconds": round(total_seconds / total, 3) if total else 0.0,
+            "buckets": dict(zip(labels, counts)),
+        }
+        if total:
+            for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                value = self._quantile(counts, total, q)
+                snapshot[f"{name}Seconds"] = None if value == float("inf") else value
+        return snapshot
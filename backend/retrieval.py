@@ -0,0 +1,294 @@
+"""
+Vector retrieval for the RAG endpoint
+Scores a question embedding against a user's stored embeddings and keeps the top-k matches,
+optionally fused with keyword matches
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from data_access import query_user_items, query_user_items_async
+from vector_codec import stack_embeddings
+
+
+# Retrieval defaults (overridable per request in /api/rag-query)
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
+RAG_SCORE_THRESHOLD = float(os.getenv("RAG_SCORE_THRESHOLD", "0.0"))
+
+# Hybrid retrieval: candidates taken from each ranking, and the reciprocal rank fusion constant
+RAG_FUSION_CANDIDATES = int(os.getenv("RAG_FUSION_CANDIDATES", "20"))
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+
+# /api/sources: full source content is served in pages of this many items
+SOURCES_PAGE_SIZE = int(os.getenv("SOURCES_PAGE_SIZE", "10"))
+SOURCES_MAX_PAGE_SIZE = int(os.getenv("SOURCES_MAX_PAGE_SIZE", "50"))
+SOURCES_MAX_IDS = int(os.getenv("SOURCES_MAX_IDS", "200"))
+
+# Per-user embedding matrices kept in memory between questions
+RAG_INDEX_CACHE_USERS = int(os.getenv("RAG_INDEX_CACHE_USERS", "64"))
+RAG_INDEX_TTL_SECONDS = float(os.getenv("RAG_INDEX_TTL_SECONDS", "300"))
+
+
+class UserEmbeddingIndex:
+    """Normalized embedding matrix plus lightweight metadata for one user"""
+
+    def __init__(self, items):
+        """
+        Build the index from Cosmos items
+
+        Args:
+            items (list): Items carrying an 'embedding' (and 'embeddingEncoding') plus id/title/sourceFile/fileName/_ts
+        """
+        items = [x for x in items if x.get("embedding")]
+
+        # Changes whenever an item is added, removed or rewritten (_ts is the last-write time)
+        stamp = hashlib.sha1()
+        for item_id, ts in sorted((x["id"], x.get("_ts", 0)) for x in items):
+            stamp.update(f"{item_id}:{ts}\n".encode("utf-8"))
+        self.version = stamp.hexdigest()
+
+        self.meta = [
+            {
+                "id": x["id"],
+                "title": x.get("title"),
+                "sourceFile": x.get("sourceFile"),
+                "fileName": x.get("fileName"),
+            }
+            for x in items
+        ]
+
+        if items:
+            matrix = stack_embeddings(items)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.matrix = matrix / norms
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+        self.loaded_at = time.monotonic()
+        self.document_version = None
+
+    def __len__(self):
+        return len(self.meta)
+
+    def doc_ids(self):
+        return [meta["id"] for meta in self.meta]
+
+    def search(self, query_embedding, k=RAG_TOP_K, min_score=RAG_SCORE_THRESHOLD):
+        """
+        Return the top-k items by cosine similarity
+
+        Args:
+            query_embedding (list): The question embedding
+            k (int): Maximum number of matches to return
+            min_score (float): Matches scoring below this are dropped
+
+        Returns:
+            list: Metadata dicts with an added 'score', best match first
+        """
+        if not len(self) or k <= 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+
+        scores = self.matrix @ (query / norm)
+
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            {**self.meta[i], "score": float(scores[i])}
+            for i in top
+            if scores[i] >= min_score
+        ]
+
+
+class EmbeddingIndexCache:
+    """LRU cache of per-user embedding indexes loaded from Cosmos DB"""
+
+    def __init__(self, max_users=RAG_INDEX_CACHE_USERS, ttl_seconds=RAG_INDEX_TTL_SECONDS):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, container, user_id, document_version=None):
+        """
+        Get the user's index, scanning Cosmos DB only when it is missing or stale
+
+        Args:
+            container: Cosmos DB container client
+            user_id (str): Partition key of the user
+            document_version (str, optional): Version stamp of the user's document set; an index
+                loaded under another stamp is stale (e.g. after an upload to another worker process)
+
+        Returns:
+            UserEmbeddingIndex: The user's index (possibly empty)
+        """
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and time.monotonic() - index.loaded_at < self.ttl_seconds \
+                    and (document_version is None or index.document_version == document_version):
+                self._indexes.move_to_end(user_id)
+                return index
+
+        index = UserEmbeddingIndex(_load_embeddings(container, user_id))
+        index.document_version = document_version
+
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+
+        return index
+
+    def invalidate(self, user_id):
+        """Drop a user's cached index so the next query reloads it"""
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+
+def _load_embeddings(container, user_id):
+    """Scan a user's embedded items, without their content"""
+    query = """
+    SELECT c.id, c.title, c.sourceFile, c.fileName, c.embedding, c.embeddingEncoding, c._ts
+    FROM c
+    WHERE IS_DEFINED(c.embedding)
+    """
+    return query_user_items(container, user_id, "rag.loadEmbeddings", query)
+
+
+def fuse_rankings(rankings, k, rrf_k=RAG_RRF_K):
+    """
+    Merge ranked match lists with reciprocal rank fusion
+
+    Each list contributes 1 / (rrf_k + rank) to an item's fused score, so items ranked well by
+    both the vector and the keyword search come first without comparing their raw scores.
+
+    Args:
+        rankings (list): Lists of match dicts (with 'id'), best first
+        k (int): Maximum number of matches to return
+
+    Returns:
+        list: Merged match dicts with an added 'fusedScore', best first
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            entry = fused.setdefault(match["id"], {"fusedScore": 0.0})
+            for key, value in match.items():
+                if entry.get(key) is None:
+                    entry[key] = value
+            entry["fusedScore"] += 1.0 / (rrf_k + rank)
+
+    ordered = sorted(fused.values(), key=lambda match: match["fusedScore"], reverse=True)[:k]
+    for match in ordered:
+        match["fusedScore"] = round(match["fusedScore"], 5)
+    return ordered
+
+
+_CONTENTS_QUERY = "SELECT c.id, c.content FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+
+
+def _attach_contents(matches, rows):
+    contents = {item["id"]: item.get("content", "") for item in rows}
+    results = []
+    for match in matches:
+        if match["id"] not in contents:
+            print(f"[Retrieval] Skipping {match['id']}: no longer stored")
+            continue
+        results.append({**match, "content": contents[match["id"]]})
+    return results
+
+
+def fetch_contents(container, user_id, matches):
+    """
+    Attach the 'content' of each match, fetched in one query for just the matched ids
+
+    Args:
+        container: Cosmos DB container client
+        user_id (str): Partition key of the user
+        matches (list): Results of UserEmbeddingIndex.search
+
+    Returns:
+        list: Matches that could still be read, with 'content' added
+    """
+    if not matches:
+        return []
+
+    rows = query_user_items(
+        container, user_id, "rag.fetchContents", _CONTENTS_QUERY,
+        [{"name": "@ids", "value": [match["id"] for match in matches]}]
+    )
+    return _attach_contents(matches, rows)
+
+
+async def fetch_contents_async(container, user_id, matches):
+    """fetch_contents for an azure.cosmos.aio container (used by the ASGI server)"""
+    if not matches:
+        return []
+
+    rows = await query_user_items_async(
+        container, user_id, "rag.fetchContents", _CONTENTS_QUERY,
+        [{"name": "@ids", "value": [match["id"] for match in matches]}]
+    )
+    return _attach_contents(matches, rows)
+
+
+def fetch_sources(container, user_id, ids):
+    """
+    Full stored text of the given sources, in the order asked for
+
+    Args:
+        container: Cosmos DB container client
+        user_id (str): Partition key of the user
+        ids (list): Item ids, as reported in an answer's 'sources'
+
+    Returns:
+        tuple: (found sources with their 'content', ids that are no longer stored)
+    """
+    if not ids:
+        return [], []
+
+    found = {
+        item["id"]: item
+        for item in query_user_items(
+            container, user_id, "rag.fetchSources",
+            """
+            SELECT c.id, c.title, c.sourceFile, c.fileName, c.content, c.pageStart, c.pageEnd,
+                   c.chunkIndex, c.chunkCount, c.uploadedAt
+            FROM c WHERE ARRAY_CONTAINS(@ids, c.id)
+            """,
+            [{"name": "@ids", "value": list(ids)}]
+        )
+    }
+    sources = [{k: v for k, v in found[doc_id].items() if v is not None} for doc_id in ids if doc_id in found]
+    return sources, [doc_id for doc_id in ids if doc_id not in found]
+
+
+# Global instance
+_index_cache_instance = None
+
+
+def get_index_cache():
+    """
+    Get or create the global embedding index cache
+
+    Returns:
+        EmbeddingIndexCache: The shared cache instance
+    """
+    global _index_cache_instance
+
+    if _index_cache_instance is None:
+        _index_cache_instance = EmbeddingIndexCache()
+
+    return _index_cache_instance
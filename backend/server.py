@@ -3,18 +3,39 @@ import json
 import uuid
 import time
 import logging
-import pandas as pd
+import importlib
+import threading
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
-from openai import OpenAI, AzureOpenAI
-from azure.identity import DefaultAzureCredential
-from jwt import PyJWKClient, decode
+from jwt import decode
 from functools import wraps
-from azure.cosmos import CosmosClient
-from docx import Document
-from PyPDF2 import PdfReader
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from clients import get_openai_client, get_cosmos_container, get_jwks_client
 from postgres_agent import get_postgres_agent
+from resilience import ServiceUnavailableError
+from chunking import chunk_text
+from extraction import extract_file, start_pool as start_extraction_pool
+from embeddings import embed_texts, embed_text
+from embedding_cache import get_embedding_cache
+from vector_codec import encode_embedding
+from csv_ingest import spool_upload, count_rows, ingest_csv_file
+from cosmos_bulk import BulkWriteResult, bulk_upsert, bulk_delete
+from ingest_queue import use_queue, send_documents
+from jobs import get_job_manager
+from hashing import content_hash, file_hash
+from retrieval import (get_index_cache, fetch_contents, fetch_sources, fuse_rankings, RAG_TOP_K, RAG_SCORE_THRESHOLD,
+                       RAG_FUSION_CANDIDATES, SOURCES_PAGE_SIZE, SOURCES_MAX_PAGE_SIZE, SOURCES_MAX_IDS)
+from keyword_index import get_keyword_index
+from ann_index import get_ann_index
+from context_packing import pack_context, format_context, source_summaries, RAG_CONTEXT_TOKENS, RAG_PACK_CANDIDATE_FACTOR
+from http_responses import cached_json
+from answer_cache import get_answer_cache
+from file_manifest import get_manifest_store
+from data_access import query_user_items, charge_stats
+from streaming import wants_stream, sse_response, stream_chat_completion
+from conversation_store import get_conversation_store, valid_session_id
+from auth_cache import VerifiedTokenCache, prefetch_jwks
 
 load_dotenv()
 
@@ -30,61 +51,119 @@ print("DEV_MODE:", DEV_MODE)
 app = Flask(__name__)
 CORS(app)
 
-# Optional: limit upload size (e.g., 10 MB)
-app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024  # 10 MB
+# Limit request size (default 10 MB); upload endpoints get their own limits below
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_MB", "10")) * 1024 * 1024
 
-# --- Azure OpenAI client (supporting both SDK styles) ---
-if os.getenv("AZURE_OPENAI_API_VERSION"):
-    # Use AzureOpenAI SDK
-    client = AzureOpenAI(
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    )
-else:
-    # Use OpenAI SDK with Azure endpoint
-    endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-    if endpoint and not endpoint.endswith("/openai/v1"):
-        endpoint = endpoint.rstrip("/") + "/openai/v1"
-    
-    client = OpenAI(
-        base_url=endpoint,
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    )
+# Per-endpoint upload limits (CSV uploads are streamed from disk, so they can be large)
+UPLOAD_LIMITS = {
+    "upload_excel_direct": int(os.getenv("MAX_CSV_UPLOAD_MB", "2048")) * 1024 * 1024,
+    "upload_policy_documents": int(os.getenv("MAX_POLICY_UPLOAD_MB", "100")) * 1024 * 1024,
+}
+
+# Policy files prepared (extracted, chunked, embedded) at the same time within one upload
+POLICY_FILE_WORKERS = int(os.getenv("POLICY_FILE_WORKERS", "8"))
+
+# Build the service clients and import the document parsers in the background at startup,
+# instead of on the first request that needs them
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "false").lower() == "true"
+WARMUP_MODULES = ("pandas", "PyPDF2", "docx")
+
+
+@app.before_request
+def apply_upload_limit():
+    """Apply the endpoint's upload limit before the body is parsed"""
+    limit = UPLOAD_LIMITS.get(request.endpoint)
+    if limit:
+        request.max_content_length = limit
 
-# --- Azure AI Foundry Postgres Agent (db-backed with PostgreSQL access) ---
+# --- Azure OpenAI, Cosmos DB and JWKS clients are built on first use (see clients.py) ---
+
+# --- Azure AI Foundry Postgres Agent (db-backed with PostgreSQL access, connects on first use) ---
 postgres_agent = get_postgres_agent()
 
+# --- Per-user embedding index and answer caches used by /api/rag-query ---
+index_cache = get_index_cache()
+answer_cache = get_answer_cache()
+keyword_index = get_keyword_index()
+
+# --- Document parsing workers are forked now, while this is still the only thread (see extraction.py) ---
+start_extraction_pool()
+
+
+def invalidate_user_caches(user_id):
+    """Forget cached retrieval state for a user whose documents changed"""
+    index_cache.invalidate(user_id)
+    answer_cache.invalidate_user(user_id)
+    ann = ann_index()
+    if ann:
+        # Pull the new vectors now rather than at the next change feed poll
+        try:
+            ann.sync()
+        except Exception as e:
+            print(f"[ANN Index] Sync failed: {e}")
+
+
+def update_search_indexes(user_id, added=None, removed=None):
+    """Apply written/deleted documents to the local indexes; a failure only costs a rebuild later"""
+    try:
+        ann = ann_index()
+        if ann and removed:
+            # The change feed reports writes only, so deletes are applied here
+            ann.remove(user_id, removed)
+        if keyword_index and removed:
+            keyword_index.remove_documents(user_id, removed)
+        if keyword_index and added:
+            keyword_index.add_documents(user_id, added)
+    except Exception as e:
+        print(f"[Search Index] Update failed for user {user_id}: {e}")
+
+# --- Background worker pool for uploads ---
+job_manager = get_job_manager(get_cosmos_container)
+
+# --- Per-user list of uploaded files, maintained by the upload jobs ---
+manifest_store = get_manifest_store()
+
+
+def update_manifest(user_id, **files):
+    """Record the user's current files; a failure only costs a rebuild on the next read"""
+    try:
+        manifest_store.update(get_cosmos_container(), user_id, **files)
+    except Exception as e:
+        manifest_store.invalidate(user_id)
+        print(f"[Manifest] Update failed for user {user_id}: {e}")
+
 # Azure AD Configuration
 TENANT_ID = "9f58333b-9cca-4bd9-a7d8-e151e43b79f3"
 CLIENT_ID = "a9bda2e7-4cd0-4203-9ae0-62635c58d984"
 JWKS_URL = f"https://login.microsoftonline.com/{TENANT_ID}/discovery/v2.0/keys"
 
-# Initialize JWKS client for token validation
-jwks_client = PyJWKClient(JWKS_URL)
+# Load the signing keys in the background, so the first authenticated request doesn't wait for them
+if not DEV_MODE:
+    prefetch_jwks(get_jwks_client(JWKS_URL))
 
-# --- Initialize Cosmos DB client ---
-cosmos_endpoint = os.getenv("COSMOS_ENDPOINT")
-cosmos_key = os.getenv("COSMOS_KEY")
-cosmos_db_name = os.getenv("COSMOS_DB_NAME")
-cosmos_container_name = os.getenv("COSMOS_CONTAINER_NAME")
+# Claims of tokens that already passed verification, kept until they expire
+verified_tokens = VerifiedTokenCache()
+
+
+def conversations():
+    """Chat sessions (Cosmos DB when configured, local file otherwise)"""
+    return get_conversation_store(get_cosmos_container())
+
+
+def ann_index():
+    """Persistent per-user ANN index fed by the change feed (None: index_cache scans instead)"""
+    container = get_cosmos_container()
+    return get_ann_index(container) if container else None
 
-container = None
-if cosmos_endpoint and cosmos_key:
-    try:
-        cosmos_client = CosmosClient(url=cosmos_endpoint, credential=cosmos_key)
-        cosmos_db = cosmos_client.get_database_client(cosmos_db_name)
-        container = cosmos_db.get_container_client(cosmos_container_name)
-        print(f"[Cosmos] Ready. Using container: {cosmos_container_name}")
-    except Exception as e:
-        print(f"[Cosmos Init] Warning: {e}")
-else:
-    print("[Cosmos Init] Missing COSMOS_ENDPOINT or COSMOS_KEY.")
 
 def verify_token(token):
     """Verify and decode Azure AD token"""
+    cached = verified_tokens.get(token)
+    if cached is not None:
+        return cached
+
     try:
-        signing_key = jwks_client.get_signing_key_from_jwt(token)
+        signing_key = get_jwks_client(JWKS_URL).get_signing_key_from_jwt(token)
         decoded = decode(
             token,
             signing_key.key,
@@ -92,6 +171,7 @@ def verify_token(token):
             audience=CLIENT_ID,
             issuer=f"https://login.microsoftonline.com/{TENANT_ID}/v2.0"
         )
+        verified_tokens.put(token, decoded)
         return decoded
     except Exception as e:
         print(f"Token verification failed: {e}")
@@ -152,6 +232,54 @@ def verify_auth():
     else:
         return jsonify({"valid": False, "error": "Token verification failed"}), 401
 
+def stream_message(parts, sources=None, on_complete=None, session_id=None, extra=None):
+    """
+    Turn ("token", text)/("usage", dict) tuples into SSE events
+
+    Tokens are forwarded as they arrive; the final 'done' event carries the full
+    message, the sources (RAG only) and the token usage.
+
+    Args:
+        parts: Generator from stream_chat_completion or PostgresAgent.chat_stream
+        sources (list, optional): Retrieved sources to report with the answer
+        on_complete (callable, optional): Called with the full text once the stream ends
+        session_id (str, optional): Chat session the turn was added to
+        extra (dict, optional): More fields for the 'done' event
+    """
+    text = []
+    usage = None
+    for kind, value in parts:
+        if kind == "token":
+            text.append(value)
+            yield "token", {"text": value}
+        elif kind == "usage":
+            usage = value
+
+    message = "".join(text)
+    if on_complete:
+        on_complete(message)
+
+    done = {"message": message, "usage": usage}
+    if sources is not None:
+        done["sources"] = sources
+    if session_id:
+        done["sessionId"] = session_id
+    done.update(extra or {})
+    yield "done", done
+
+
+def save_turn(user_id, session_id, question, answer):
+    """Add a finished question/answer turn to a chat session"""
+    try:
+        conversations().append(
+            user_id, session_id,
+            [{"role": "user", "content": question}, {"role": "assistant", "content": answer}],
+            client=get_openai_client(), model=os.getenv("AZURE_OPENAI_DEPLOYMENT")
+        )
+    except Exception as e:
+        print(f"[Conversation Store] Could not save session {session_id}: {e}")
+
+
 @app.route("/api/chat", methods=["POST"])
 @token_required
 def chat():
@@ -161,10 +289,24 @@ def chat():
         message = data.get("message")
         history = data.get("conversationHistory", [])
         model_source = (data.get("model") or "azure").lower()
+        session_id = data.get("sessionId")
 
         if not message:
             return jsonify({"error": "Missing 'message'"}), 400
 
+        # With a session id the server keeps the history; the client only sends the new message
+        if session_id:
+            if not valid_session_id(session_id):
+                return jsonify({"error": "Invalid 'sessionId'"}), 400
+            user_id = request.user.get("oid") or request.user.get("sub") or "default-user"
+            store = conversations()
+            session = store.get(user_id, session_id)
+            history = store.history(session) if session else []
+
+        def remember(text):
+            if session_id:
+                save_turn(user_id, session_id, message, text)
+
         messages = (
             [{"role": "system", "content": "You are a helpful assistant."}]
             + history
@@ -176,16 +318,36 @@ def chat():
             # Use Azure AI Foundry Postgres Agent (has PostgreSQL database access)
             if not postgres_agent.is_ready():
                 return jsonify({"error": "Postgres AI Agent not configured"}), 400
+
+            if wants_stream(request, data):
+                # Admitted before the response starts, so a busy or failing agent still gets a 503
+                try:
+                    parts = postgres_agent.chat_stream(message, history)
+                except ServiceUnavailableError as e:
+                    return jsonify({"error": str(e)}), 503
+                return sse_response(stream_message(parts, on_complete=remember, session_id=session_id))
             
             try:
                 text = postgres_agent.chat(message, history)
-                return jsonify({"message": text}), 200
+                remember(text)
+                return jsonify({"message": text, "sessionId": session_id}), 200
+            except ServiceUnavailableError as e:
+                return jsonify({"error": str(e)}), 503
             except Exception as e:
                 return jsonify({"error": str(e)}), 500
         else:
             # Use regular Azure OpenAI for non-postgres requests
-            active_client = client
+            active_client = get_openai_client()
             active_model = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+
+            if wants_stream(request, data):
+                return sse_response(stream_message(stream_chat_completion(
+                    active_client,
+                    model=active_model,
+                    messages=messages,
+                    max_tokens=512,
+                    temperature=0.7,
+                ), on_complete=remember, session_id=session_id))
             
             completion = active_client.chat.completions.create(
                 model=active_model,
@@ -195,13 +357,63 @@ def chat():
             )
 
             text = completion.choices[0].message.content if completion.choices else ""
-            return jsonify({"message": text}), 200
+            remember(text)
+            return jsonify({"message": text, "sessionId": session_id}), 200
 
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/chat/history/<session_id>", methods=["GET"])
+@token_required
+def get_chat_history(session_id):
+    """Return the stored messages of one of the user's chat sessions"""
+    if not valid_session_id(session_id):
+        return jsonify({"error": "Invalid session id"}), 400
+
+    user_id = request.user.get("oid") or request.user.get("sub") or "default-user"
+    try:
+        session = conversations().get(user_id, session_id)
+    except Exception as e:
+        return jsonify({"error": f"Could not load session: {str(e)}"}), 500
+
+    if not session:
+        return jsonify({"error": "Session not found"}), 404
+
+    return jsonify({
+        "sessionId": session_id,
+        "messages": session["messages"],
+        "summary": session.get("summary", ""),
+        "updatedAt": session.get("updatedAt"),
+    }), 200
+
+
+@app.route("/api/chat/save", methods=["POST"])
+@token_required
+def save_chat_session():
+    """Store a whole conversation (e.g. one started before sessions existed)"""
+    data = request.get_json(force=True) or {}
+    messages = data.get("messages")
+    session_id = data.get("sessionId") or str(uuid.uuid4())
+
+    if not valid_session_id(session_id):
+        return jsonify({"error": "Invalid 'sessionId'"}), 400
+    if not isinstance(messages, list) or any(
+        not isinstance(m, dict) or m.get("role") not in ("user", "assistant") or not isinstance(m.get("content"), str)
+        for m in messages
+    ):
+        return jsonify({"error": "'messages' must be a list of {role, content} objects"}), 400
+
+    user_id = request.user.get("oid") or request.user.get("sub") or "default-user"
+    try:
+        session = conversations().replace(user_id, session_id, messages)
+    except Exception as e:
+        return jsonify({"error": f"Could not save session: {str(e)}"}), 500
+
+    return jsonify({"sessionId": session_id, "messageCount": len(session["messages"])}), 200
+
+
 @app.route("/api/get-uploaded-files", methods=["GET"])
 @token_required
 def get_uploaded_files():
@@ -209,55 +421,27 @@ def get_uploaded_files():
     Fetch existing uploaded files for a user.
     Returns both CSV data and policy documents.
     """
+    container = get_cosmos_container()
     if not container:
         return jsonify({"error": "Cosmos DB not configured"}), 500
 
     try:
         # Get userId from authenticated user
         user_id = request.user.get("oid") or request.user.get("sub") or "default-user"
-        
-        # Query for CSV data (get distinct source files).
-        csv_query = """
-        SELECT DISTINCT c.sourceFile
-        FROM c
-        WHERE (c.documentType = @csvType OR NOT IS_DEFINED(c.documentType))
-          AND IS_DEFINED(c.sourceFile)
-          AND c.userId = @userId
-        """
-
-        csv_items = list(container.query_items(
-            query=csv_query,
-            parameters=[
-                {"name": "@csvType", "value": "csvData"},
-                {"name": "@userId", "value": user_id}
-            ],
-            enable_cross_partition_query=True
-        ))
-
-        # Query for policy documents
-        policy_query = """
-        SELECT DISTINCT c.fileName, c.uploadedAt
-        FROM c
-        WHERE c.documentType = @policyType
-          AND c.userId = @userId
-        """
 
-        policy_items = list(container.query_items(
-            query=policy_query,
-            parameters=[
-                {"name": "@policyType", "value": "policyDocument"},
-                {"name": "@userId", "value": user_id}
-            ],
-            enable_cross_partition_query=True
-        ))
+        # One point read (or a cache hit) instead of scanning the user's rows
+        manifest = manifest_store.get(container, user_id)
 
         # Format CSV files
-        csv_files = [{"name": item.get("sourceFile", "Unknown")} for item in csv_items]
+        csv_files = [
+            {"name": item.get("name", "Unknown"), "rows": item.get("rows"), "uploadedAt": item.get("uploadedAt")}
+            for item in manifest.get("csvFiles", [])
+        ]
 
         # Format policy files
         policy_files = [
-            {"name": item.get("fileName", "Unknown"), "uploadedAt": item.get("uploadedAt")}
-            for item in policy_items
+            {"name": item.get("name", "Unknown"), "chunks": item.get("chunks"), "uploadedAt": item.get("uploadedAt")}
+            for item in manifest.get("policyFiles", [])
         ]
 
         return jsonify({"csvFiles": csv_files, "policyFiles": policy_files}), 200
@@ -270,9 +454,11 @@ def get_uploaded_files():
 @token_required
 def upload_excel_direct():
     """
-    Upload CSV/XLSX and write DIRECTLY to Cosmos DB (bypass queue).
-    Deletes existing documents for the user before uploading to prevent data accumulation.
+    Upload CSV and write DIRECTLY to Cosmos DB (bypass queue).
+    Replaces the user's existing rows: unchanged rows are kept as they are, rows missing from the file are deleted.
+    The upload runs as a background job; poll /api/jobs/<jobId> for progress and the result.
     """
+    container = get_cosmos_container()
     if not container:
         return jsonify({"error": "Cosmos DB not configured"}), 500
 
@@ -285,104 +471,80 @@ def upload_excel_direct():
     # Get userId from authenticated user
     user_id = request.user.get("oid") or request.user.get("sub") or "default-user"
 
+    if not filename.endswith(".csv"):
+        return jsonify({"error": "Only .csv files supported."}), 400
+
+    # Spool to disk so the worker can read it in chunks after the request ends
+    path = spool_upload(file)
+
+    job = job_manager.submit(user_id, "csv", "rows", [filename], ingest_csv_job, path, user_id, filename)
+    return jsonify({"status": "queued", "jobId": job.id, "statusUrl": f"/api/jobs/{job.id}"}), 202
+
+
+def ingest_csv_job(job, path, user_id, filename):
+    """
+    Background job: replace the user's CSV rows with the rows of the spooled file.
+    Rows are diffed by content hash: only new or changed rows are embedded and written,
+    and stored rows that are missing from the upload are deleted.
+    """
+    container = get_cosmos_container()
     try:
-        # DELETE EXISTING DOCUMENTS FOR THIS USER FIRST
-        try:
-            delete_query = "SELECT c.id FROM c WHERE c.userId = @userId AND c.documentType = @docType"
-            existing_docs = list(container.query_items(
-                query=delete_query,
-                parameters=[
-                    {"name": "@userId", "value": user_id},
-                    {"name": "@docType", "value": "csvData"}
-                ],
-                enable_cross_partition_query=True
-            ))
-            
-            deleted_count = 0
-            for doc in existing_docs:
-                container.delete_item(item=doc["id"], partition_key=user_id)
-                deleted_count += 1
-            
-            print(f"Deleted {deleted_count} existing CSV documents for user {user_id}")
-        except Exception as del_err:
-            print(f"Warning: Failed to delete existing documents: {del_err}")
+        job.progress(total=count_rows(path))
 
-        # Read CSV file
-        if filename.endswith(".csv"):
-            df = pd.read_csv(file)
-        else:
-            return jsonify({"error": "Only .csv files supported."}), 400
+        # Hashes of the rows stored by the previous upload
+        existing_query = """
+        SELECT c.id, c.contentHash, IS_DEFINED(c.embedding) AS embedded
+        FROM c
+        WHERE c.documentType = @docType
+        """
+        existing = {
+            doc["id"]: (doc.get("contentHash"), doc.get("embedded", False))
+            for doc in query_user_items(
+                container, user_id, "csv.existingRows", existing_query,
+                [{"name": "@docType", "value": "csvData"}]
+            )
+        }
+
+        # Transform, embed and write the changed rows chunk by chunk
+        result = ingest_csv_file(
+            container, get_openai_client(), path, user_id, filename,
+            on_progress=lambda done, failed: job.progress(done=done, failed=failed),
+            existing=existing,
+            on_written=lambda documents: update_search_indexes(user_id, added=documents)
+        )
 
-        processed_ids = []
-        failed_rows = []
+        # Delete rows that are no longer in the file
+        stale_ids = [doc_id for doc_id in existing if doc_id not in result.seen_ids]
+        deleted = bulk_delete(container, user_id, stale_ids)
+        update_search_indexes(user_id, removed=deleted.written)
+        print(f"Deleted {len(deleted.written)} stale CSV documents for user {user_id}, "
+              f"{result.unchanged} rows unchanged")
 
-        for idx, row in df.iterrows():
-            try:
-                # Generate ID
-                if "id" in df.columns and pd.notna(row.get("id")):
-                    row_id = str(row["id"])
-                else:
-                    row_id = str(uuid.uuid4())
+        processed_ids = result.processed_ids
+        failed_rows = result.failed_rows
 
-                # Generate title
-                if "title" in df.columns and pd.notna(row.get("title")):
-                    title = str(row["title"])
-                else:
-                    title = f"Record {row_id}"
+        if result.write_result.written or deleted.written:
+            invalidate_user_caches(user_id)
 
-                # Generate content
-                if "content" in df.columns and pd.notna(row.get("content")):
-                    content = str(row["content"])
-                else:
-                    content = "\n".join(
-                        f"{col}: {row[col]}"
-                        for col in df.columns
-                        if col != "userId" and pd.notna(row[col])
-                    )
-
-                # Build document
-                document = {
-                    "id": row_id,
-                    "userId": user_id,
-                    "documentType": "csvData",
-                    "title": title,
-                    "content": content,
-                    "version": "v1",
-                    "sourceFile": filename
-                }
-
-                # Write to Cosmos DB
-                container.upsert_item(document)
-
-                # Create embedding
-                if content.strip():
-                    try:
-                        emb = client.embeddings.create(
-                            model=os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT"),
-                            input=content
-                        )
-                        document["embedding"] = emb.data[0].embedding
-                        container.upsert_item(document)
-                        time.sleep(0.1)  # Rate limiting
-                    except Exception as emb_err:
-                        print(f"[Embedding Error] Row {idx} (ID: {row_id}): {str(emb_err)}")
-                        failed_rows.append(f"Row {idx}: embedding failed - {str(emb_err)}")
-
-                processed_ids.append(row_id)
-
-            except Exception as row_err:
-                failed_rows.append(f"Row {idx}: {str(row_err)}")
+        # The upload replaced every stored row, so this file is now the user's only CSV
+        update_manifest(user_id, csv_files=[{
+            "name": filename,
+            "rows": result.unchanged + len(processed_ids),
+            "uploadedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }])
 
-        return jsonify({
+        return {
             "status": "completed",
-            "rowsProcessed": len(processed_ids),
+            "rowsQueued" if use_queue() else "rowsProcessed": len(processed_ids),
             "rowsFailed": len(failed_rows),
+            "rowsUnchanged": result.unchanged,
+            "rowsDeleted": len(deleted.written),
+            "ingestStats": result.write_result.summary(),
             "ids": processed_ids,
             "errors": failed_rows if failed_rows else None
-        }), 200
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        }
+    finally:
+        os.remove(path)
 
 
 @app.route("/api/upload-policy-documents", methods=["POST"])
@@ -390,8 +552,11 @@ def upload_excel_direct():
 def upload_policy_documents():
     """
     Upload policy documents (PDF, DOCX, DOC, TXT) and store directly in Cosmos DB.
-    Deletes existing policy documents for the user before uploading new ones.
+    Replaces the user's existing policy documents: files with identical bytes are kept as they are,
+    changed files are re-chunked, and files missing from the upload are deleted.
+    The upload runs as a background job; poll /api/jobs/<jobId> for progress and the result.
     """
+    container = get_cosmos_container()
     if not container:
         return jsonify({"error": "Cosmos DB not configured"}), 500
 
@@ -403,126 +568,330 @@ def upload_policy_documents():
     # Get userId from authenticated user
     user_id = request.user.get("oid") or request.user.get("sub") or "default-user"
 
-    # DELETE EXISTING POLICY DOCUMENTS FOR THIS USER FIRST
-    try:
-        delete_query = "SELECT c.id FROM c WHERE c.userId = @userId AND c.documentType = @docType"
-        existing_docs = list(container.query_items(
-            query=delete_query,
-            parameters=[
-                {"name": "@userId", "value": user_id},
-                {"name": "@docType", "value": "policyDocument"}
-            ],
-            enable_cross_partition_query=True
-        ))
-        
-        deleted_count = 0
-        for doc in existing_docs:
-            container.delete_item(item=doc["id"], partition_key=user_id)
-            deleted_count += 1
-        
-        if deleted_count > 0:
-            logging.info(f"Deleted {deleted_count} existing policy documents for user {user_id}")
-    except Exception as del_err:
-        logging.warning(f"Warning: Failed to delete existing policy documents: {del_err}")
+    # Spool every file so the worker can read them after the request ends
+    spooled = [(spool_upload(file), file.filename or "unknown") for file in files]
 
-    processed_ids = []
-    failed_files = []
+    job = job_manager.submit(
+        user_id, "policy", "files", [name for _, name in spooled],
+        ingest_policy_job, spooled, user_id
+    )
+    return jsonify({"status": "queued", "jobId": job.id, "statusUrl": f"/api/jobs/{job.id}"}), 202
 
-    for file in files:
-        try:
-            filename = file.filename or "unknown"
-            file_ext = filename.lower().split(".")[-1]
-
-            # Extract text based on file type
-            content = None
-            if file_ext == "pdf":
-                content = extract_text_from_pdf(file)
-            elif file_ext in ("docx", "doc"):
-                content = extract_text_from_docx(file)
-            elif file_ext == "txt":
-                content = file.read().decode("utf-8", errors="ignore")
-            else:
-                failed_files.append(f"{filename}: Unsupported file type. Use PDF, DOCX, DOC, or TXT.")
-                continue
-
-            if not content or not content.strip():
-                failed_files.append(f"{filename}: No text content found.")
-                continue
-
-            # Create document for Cosmos DB
-            doc_id = str(uuid.uuid4())
-            document = {
-                "id": doc_id,
-                "userId": user_id,
-                "documentType": "policyDocument",
-                "title": filename.rsplit(".", 1)[0],
-                "content": content,
-                "fileName": filename,
-                "uploadedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                "version": "v1"
-            }
 
-            # Write to Cosmos DB
-            container.upsert_item(document)
+def prepare_policy_file(path, filename, user_id, stored):
+    """
+    Extract, chunk and embed one spooled policy file
 
-            # Create embedding
-            try:
-                emb = client.embeddings.create(
-                    model=os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT"),
-                    input=content[:8000]  # Limit to 8000 chars
-                )
-                document["embedding"] = emb.data[0].embedding
-                container.upsert_item(document)
-                time.sleep(0.1)
-            except Exception as emb_err:
-                logging.warning(f"Embedding failed for {filename}: {str(emb_err)}")
-
-            processed_ids.append(doc_id)
-            logging.info(f"Successfully processed policy document: {filename}")
-
-        except Exception as file_err:
-            failed_files.append(f"{file.filename}: {str(file_err)}")
-            logging.error(f"Error processing file {file.filename}: {str(file_err)}")
+    Args:
+        path (str): Spooled file
+        filename (str): Original file name
+        user_id (str): Partition key for the chunks
+        stored (dict, optional): What the previous upload stored for this file name
 
-    return jsonify({
+    Returns:
+        tuple: (parent id, chunk documents), or (stored parent id, None) when the file is unchanged
+
+    Raises:
+        ValueError: If the file type is unsupported or has no text
+    """
+    # Identical bytes to the stored copy: no extraction, embedding or writes
+    fingerprint = file_hash(path)
+    if stored and stored["fileHash"] == fingerprint and stored["embedded"]:
+        return stored["parentId"], None
+
+    content = extract_file(path, filename)
+    if not content or not content.strip():
+        raise ValueError("No text content found.")
+
+    # Split into overlapping chunks; each chunk is its own Cosmos item linked by fileName/parentId
+    doc_id = str(uuid.uuid4())
+    uploaded_at = time.strftime("%Y-%m-%dT%H:%M:%SZ")
+    chunks = chunk_text(content)
+
+    chunk_docs = [
+        {
+            "id": f"{doc_id}-chunk-{chunk_index:04d}",
+            "userId": user_id,
+            "documentType": "policyDocument",
+            "title": filename.rsplit(".", 1)[0],
+            "content": chunk["content"],
+            "fileName": filename,
+            "parentId": doc_id,
+            "chunkIndex": chunk_index,
+            "chunkCount": len(chunks),
+            "pageStart": chunk["pageStart"],
+            "pageEnd": chunk["pageEnd"],
+            "uploadedAt": uploaded_at,
+            "version": "v1",
+            "fileHash": fingerprint
+        }
+        for chunk_index, chunk in enumerate(chunks)
+    ]
+    for document in chunk_docs:
+        document["contentHash"] = content_hash(document)
+
+    # Create embeddings for all chunks of the file (QueueToCosmos embeds in queue mode)
+    if not use_queue():
+        vectors, emb_errors = embed_texts(get_openai_client(), [doc["content"] for doc in chunk_docs])
+        for document, vector in zip(chunk_docs, vectors):
+            if vector is not None:
+                encode_embedding(document, vector)
+        for pos, emb_err in emb_errors.items():
+            logging.warning(f"Embedding failed for {filename} chunk {pos}: {emb_err}")
+
+    return doc_id, chunk_docs
+
+
+def ingest_policy_job(job, spooled, user_id):
+    """Background job: replace the user's policy documents with the spooled files, skipping unchanged files"""
+    container = get_cosmos_container()
+    job.progress(total=len(spooled))
+
+    # Chunks stored by the previous upload, grouped by file
+    existing_query = """
+    SELECT c.id, c.fileName, c.parentId, c.fileHash, c.uploadedAt, IS_DEFINED(c.embedding) AS embedded
+    FROM c
+    WHERE c.documentType = @docType
+    """
+    existing_files = {}
+    for doc in query_user_items(
+        container, user_id, "policy.existingChunks", existing_query,
+        [{"name": "@docType", "value": "policyDocument"}]
+    ):
+        stored = existing_files.setdefault(doc.get("fileName"), {
+            "fileHash": doc.get("fileHash"),
+            "parentId": doc.get("parentId") or doc["id"],
+            "uploadedAt": doc.get("uploadedAt"),
+            "embedded": True,
+            "ids": [],
+        })
+        stored["ids"].append(doc["id"])
+        stored["embedded"] = stored["embedded"] and doc.get("embedded", False)
+        if doc.get("fileHash") != stored["fileHash"]:
+            stored["fileHash"] = None
+
+    processed_ids = []
+    failed_files = []
+    written_files = {}  # file name -> manifest entry
+    unchanged_files = {}  # file name -> parent id
+    result = BulkWriteResult()
+
+    # Files are prepared in parallel (parsing on the extraction process pool, embedding on
+    # these threads); each file's chunks are written as soon as it is ready, while others are
+    # still being prepared
+    with ThreadPoolExecutor(max_workers=POLICY_FILE_WORKERS) as pool:
+        futures = {
+            pool.submit(prepare_policy_file, path, filename, user_id, existing_files.get(filename)): (path, filename)
+            for path, filename in spooled
+        }
+        for future in as_completed(futures):
+            path, filename = futures[future]
+            try:
+                doc_id, chunk_docs = future.result()
+                if chunk_docs is None:
+                    unchanged_files[filename] = doc_id
+                    continue
+
+                # Write every chunk once, with its embedding
+                if use_queue():
+                    sent, failed = send_documents(chunk_docs)
+                    file_result = BulkWriteResult()
+                    file_result.merge(sent, failed, 0.0)
+                else:
+                    file_result = bulk_upsert(container, chunk_docs)
+                result.merge(file_result.written, file_result.failed, file_result.request_charge)
+                result.elapsed += file_result.elapsed
+
+                if file_result.failed:
+                    error = next(iter(file_result.failed.values()))
+                    failed_files.append(f"{filename}: {error}")
+                    logging.error(f"Error writing file {filename}: {error}")
+                else:
+                    update_search_indexes(user_id, added=chunk_docs)
+                    processed_ids.append(doc_id)
+                    written_files[filename] = {
+                        "name": filename,
+                        "chunks": len(chunk_docs),
+                        "uploadedAt": chunk_docs[0]["uploadedAt"],
+                    }
+                    logging.info(f"Successfully processed policy document: {filename}")
+
+            except Exception as file_err:
+                failed_files.append(f"{filename}: {str(file_err)}")
+                logging.error(f"Error processing file {filename}: {str(file_err)}")
+            finally:
+                os.remove(path)
+                job.progress(done=len(processed_ids) + len(unchanged_files), failed=len(failed_files))
+
+    processed_ids.extend(unchanged_files.values())
+    job.progress(done=len(processed_ids), failed=len(failed_files))
+
+    # Delete the old chunks of replaced files and of files no longer uploaded.
+    # Files whose new version failed to write keep their old chunks.
+    kept_files = set(unchanged_files)
+    uploaded_files = {filename for _, filename in spooled}
+    stale_ids = [
+        doc_id
+        for filename, stored in existing_files.items()
+        if filename not in kept_files and (filename in written_files or filename not in uploaded_files)
+        for doc_id in stored["ids"]
+    ]
+    deleted = bulk_delete(container, user_id, stale_ids)
+    update_search_indexes(user_id, removed=deleted.written)
+    if deleted.written:
+        logging.info(f"Deleted {len(deleted.written)} stale policy chunks for user {user_id}")
+
+    if result.written or deleted.written:
+        invalidate_user_caches(user_id)
+
+    # Files now stored: the ones just written plus the old versions that were kept
+    policy_files = list(written_files.values()) + [
+        {"name": filename, "chunks": len(stored["ids"]), "uploadedAt": stored["uploadedAt"]}
+        for filename, stored in existing_files.items()
+        if filename in kept_files or (filename in uploaded_files and filename not in written_files)
+    ]
+    update_manifest(user_id, policy_files=policy_files)
+
+    return {
         "status": "completed",
         "filesProcessed": len(processed_ids),
         "filesFailed": len(failed_files),
+        "filesUnchanged": len(unchanged_files),
+        "chunksCreated": len(result.written),
+        "chunksDeleted": len(deleted.written),
+        "ingestStats": result.summary(),
         "ids": processed_ids,
         "errors": failed_files if failed_files else None
-    }), 200
+    }
+
+
+@app.route("/api/stats/embedding-cache", methods=["GET"])
+@token_required
+def embedding_cache_stats():
+    """Hit/miss counters of the embedding cache"""
+    cache = get_embedding_cache()
+    if not cache:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **cache.stats()}), 200
+
+
+@app.route("/api/stats/postgres-agent", methods=["GET"])
+@token_required
+def postgres_agent_stats():
+    """Latency histogram, circuit state and concurrency of the Postgres agent"""
+    return jsonify(postgres_agent.stats()), 200
 
 
-def extract_text_from_pdf(file):
-    """Extract text from PDF file."""
+@app.route("/api/stats/answer-cache", methods=["GET"])
+@token_required
+def answer_cache_stats():
+    """Hit/miss counters of the RAG answer cache"""
+    return jsonify(answer_cache.stats()), 200
+
+
+@app.route("/api/stats/ann-index", methods=["GET"])
+@token_required
+def ann_index_stats():
+    """Open shards and change feed progress of the ANN index"""
+    ann = ann_index()
+    if not ann:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **ann.stats()}), 200
+
+
+@app.route("/api/stats/cosmos", methods=["GET"])
+@token_required
+def cosmos_stats():
+    """Request charge (RU) per partition-scoped Cosmos DB operation"""
+    return jsonify(charge_stats()), 200
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+@token_required
+def get_job(job_id):
+    """Progress of a background upload: done/failed counts, throughput, ETA and the final result"""
+    user_id = request.user.get("oid") or request.user.get("sub") or "default-user"
+
+    job = job_manager.get(job_id, user_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(job.to_dict()), 200
+
+
+def parse_rag_options(data):
+    """
+    topK, minScore and contextTokens of a RAG request, with their defaults
+
+    Raises:
+        TypeError, ValueError: If one of them is not a number
+    """
+    return (
+        int(data.get("topK", RAG_TOP_K)),
+        float(data.get("minScore", RAG_SCORE_THRESHOLD)),
+        int(data.get("contextTokens", RAG_CONTEXT_TOKENS)),
+    )
+
+
+def user_index(container, user_id):
+    """
+    The user's ANN shard, or their embeddings loaded into memory (cached between questions)
+
+    Both are checked against the file manifest's version stamp, so an upload handled by another
+    worker process is picked up within MANIFEST_VERSION_SECONDS. Cached answers are keyed on the
+    index version and follow.
+    """
     try:
-        file.seek(0)
-        pdf_reader = PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        document_version = manifest_store.version(container, user_id)
     except Exception as e:
-        logging.error(f"PDF extraction error: {str(e)}")
-        raise
+        print(f"[Manifest] Version check failed for user {user_id}: {e}")
+        document_version = None
+    ann = ann_index()
+    if ann:
+        return ann.get(container, user_id, document_version)
+    return index_cache.get(container, user_id, document_version)
 
 
-def extract_text_from_docx(file):
-    """Extract text from DOCX/DOC file."""
+def exact_keyword_matches(container, user_id, question, index, limit):
+    """
+    Records holding a rare identifier (invoice number, account code...) named in the question
+
+    Such questions are answered from these records without embedding the question.
+    """
+    if not keyword_index:
+        return []
     try:
-        file.seek(0)
-        doc = Document(file)
-        text = "\n".join([para.text for para in doc.paragraphs])
-        return text
+        keyword_index.ensure_current(container, user_id, index)
+        return keyword_index.exact_matches(user_id, question, limit)
     except Exception as e:
-        logging.error(f"DOCX extraction error: {str(e)}")
-        raise
+        print(f"[Keyword Index] Lookup failed for user {user_id}: {e}")
+        return []
+
+
+def keyword_ranking(user_id, question, k):
+    """BM25 matches to fuse with the vector ranking (None when the keyword index is unavailable)"""
+    if not keyword_index:
+        return None
+    try:
+        return keyword_index.search(user_id, question, k)
+    except Exception as e:
+        print(f"[Keyword Index] Search failed for user {user_id}: {e}")
+        return None
+
+
+def rag_messages(question, context):
+    """The RAG prompt: answer from the packed context only, citing sources by file name"""
+    return [
+        {"role": "system", "content": "You are a RAG assistant. Always cite sources by their filename when referencing information."},
+        {"role": "user", "content": f"Question: {question}\n\nContext:\n{context}\n\nAnswer using ONLY the context above. When citing sources, use the [Source: filename] format shown in the context."}
+    ]
 
 
 @app.route("/api/rag-query", methods=["POST"])
 @token_required
 def rag_query():
     """RAG query endpoint - uses uploaded documents as context"""
+    container = get_cosmos_container()
     if not container:
         return jsonify({"error": "Cosmos DB container not initialized."}), 500
     
@@ -531,61 +900,181 @@ def rag_query():
     
     if not question:
         return jsonify({"error": "Question is required"}), 400
+
+    try:
+        top_k, min_score, context_tokens = parse_rag_options(data)
+    except (TypeError, ValueError):
+        return jsonify({"error": "topK, minScore and contextTokens must be numbers"}), 400
+
+    stream = wants_stream(request, data)
+
+    session_id = data.get("sessionId")
+    if session_id and not valid_session_id(session_id):
+        return jsonify({"error": "Invalid 'sessionId'"}), 400
     
     # Get userId from authenticated user
     user_id = request.user.get("oid") or request.user.get("sub") or "default-user"
+    client = get_openai_client()
 
-    # Get question embedding
-    try:
-        qembed = client.embeddings.create(
-            model=os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT"),
-            input=question
-        ).data[0].embedding
-    except Exception as e:
-        return jsonify({"error": f"Embedding failed: {str(e)}"}), 500
-
-    # Query Cosmos DB for user's documents with embeddings
-    query = """
-    SELECT c.id, c.title, c.content, c.sourceFile, c.fileName
-    FROM c
-    WHERE IS_DEFINED(c.embedding)
-      AND c.userId = @userId
-    """
+    def remember_turn(answer):
+        if session_id:
+            save_turn(user_id, session_id, question, answer)
 
+    # Open the user's ANN shard (or load their embeddings, cached between questions)
     try:
-        items = list(container.query_items(
-            query=query,
-            parameters=[{"name": "@userId", "value": user_id}],
-            enable_cross_partition_query=True
-        ))
+        index = user_index(container, user_id)
     except Exception as e:
         return jsonify({"error": f"Cosmos DB query failed: {str(e)}"}), 500
 
-    if not items:
+    if not len(index):
         return jsonify({"error": "No documents with embeddings found. Please upload documents first."}), 400
 
-    # Combine retrieved content with source info
-    context_parts = []
-    for x in items:
-        source = x.get('sourceFile') or x.get('fileName') or x.get('title')
-        context_parts.append(f"[Source: {source}]\n{x['content']}")
-    context = "\n\n".join(context_parts)
+    # Same question against the same document set: answer without calling OpenAI
+    cache_key = answer_cache.make_key(question, index.version, top_k, min_score, context_tokens)
+    cached = answer_cache.get(user_id, cache_key)
+    if cached is not None:
+        remember_turn(cached["answer"])
+        if stream:
+            return sse_response(iter([
+                ("token", {"text": cached["answer"]}),
+                ("done", {"message": cached["answer"], "sources": cached["sources"], "context": cached.get("context"),
+                          "usage": None, "cached": True, "sessionId": session_id}),
+            ]))
+        return jsonify({**cached, "cached": True, "sessionId": session_id})
+
+    # A question naming a rare identifier (invoice number, account code...) is answered from
+    # the records holding it, without embedding the question
+    matches = exact_keyword_matches(container, user_id, question, index, top_k)
+
+    if not matches:
+        # Get question embedding
+        try:
+            qembed = embed_text(client, question)
+        except Exception as e:
+            return jsonify({"error": f"Embedding failed: {str(e)}"}), 500
+
+        candidates = max(top_k, RAG_FUSION_CANDIDATES)
+        rankings = [index.search(qembed, k=candidates, min_score=min_score)]
+        keyword_matches = keyword_ranking(user_id, question, candidates)
+        if keyword_matches is not None:
+            rankings.append(keyword_matches)
+        # Extra candidates let the packing stage replace near-duplicates
+        matches = fuse_rankings(rankings, top_k * RAG_PACK_CANDIDATE_FACTOR)
+
+    items = fetch_contents(container, user_id, matches)
+
+    if not items:
+        answer = "No documents matched the question closely enough to answer it."
+        if stream:
+            return sse_response(iter([
+                ("token", {"text": answer}),
+                ("done", {"message": answer, "sources": [], "usage": None}),
+            ]))
+        return jsonify({"answer": answer, "sources": []})
+
+    # Fit the most relevant distinct passages into the context budget
+    items, packing = pack_context(question, items, top_k, context_tokens)
+    context = format_context(items)
+    # Only ids, names, scores and snippets go back; full text is paged in from /api/sources
+    sources = source_summaries(items)
 
     # Ask GPT with context
+    messages = rag_messages(question, context)
+
+    if stream:
+        def remember(answer):
+            answer_cache.put(user_id, cache_key, {"answer": answer, "sources": sources, "context": packing})
+            remember_turn(answer)
+
+        return sse_response(stream_message(
+            stream_chat_completion(client, model=os.getenv("AZURE_OPENAI_DEPLOYMENT"), messages=messages),
+            sources=sources,
+            on_complete=remember,
+            session_id=session_id,
+            extra={"context": packing},
+        ))
+
     try:
         answer = client.chat.completions.create(
             model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
-            messages=[
-                {"role": "system", "content": "You are a RAG assistant. Always cite sources by their filename when referencing information."},
-                {"role": "user", "content": f"Question: {question}\n\nContext:\n{context}\n\nAnswer using ONLY the context above. When citing sources, use the [Source: filename] format shown in the context."}
-            ]
+            messages=messages
         ).choices[0].message.content
 
-        return jsonify({"answer": answer, "sources": items})
+        response = {"answer": answer, "sources": sources, "context": packing}
+        answer_cache.put(user_id, cache_key, response)
+        remember_turn(answer)
+        return jsonify({**response, "sessionId": session_id})
     except Exception as e:
         return jsonify({"error": f"Chat completion failed: {str(e)}"}), 500
 
 
+@app.route("/api/sources", methods=["GET"])
+@token_required
+def get_sources():
+    """
+    Full content of answer sources, one page at a time
+
+    Query: ids (comma-separated, as reported in an answer's 'sources'), page (from 1), pageSize.
+    Responses carry an ETag, so viewing the same sources again is answered with 304.
+    """
+    container = get_cosmos_container()
+    if not container:
+        return jsonify({"error": "Cosmos DB container not initialized."}), 500
+
+    ids = list(dict.fromkeys(i.strip() for i in (request.args.get("ids") or "").split(",") if i.strip()))
+    if not ids:
+        return jsonify({"error": "'ids' is required"}), 400
+    if len(ids) > SOURCES_MAX_IDS:
+        return jsonify({"error": f"At most {SOURCES_MAX_IDS} ids per request"}), 400
+
+    try:
+        page = int(request.args.get("page", 1))
+        page_size = int(request.args.get("pageSize", SOURCES_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "page and pageSize must be numbers"}), 400
+    if page < 1 or not 1 <= page_size <= SOURCES_MAX_PAGE_SIZE:
+        return jsonify({"error": f"page must be at least 1 and pageSize between 1 and {SOURCES_MAX_PAGE_SIZE}"}), 400
+
+    user_id = request.user.get("oid") or request.user.get("sub") or "default-user"
+
+    start = (page - 1) * page_size
+    try:
+        sources, missing = fetch_sources(container, user_id, ids[start:start + page_size])
+    except Exception as e:
+        return jsonify({"error": f"Cosmos DB query failed: {str(e)}"}), 500
+
+    return cached_json(request, {
+        "sources": sources,
+        "missing": missing,
+        "page": page,
+        "pageSize": page_size,
+        "total": len(ids),
+        "nextPage": page + 1 if start + page_size < len(ids) else None,
+    })
+
+
+def warm_up():
+    """Build the clients and import the parsers ahead of the first requests that need them"""
+    started = time.perf_counter()
+    steps = [
+        ("OpenAI client", get_openai_client),
+        ("Cosmos DB", get_cosmos_container),
+        ("chat sessions", conversations),
+        ("ANN index", ann_index),
+        ("Postgres agent", postgres_agent.ensure_initialized),
+    ] + [(name, lambda name=name: importlib.import_module(name)) for name in WARMUP_MODULES]
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            print(f"[Warm-up] {name} failed: {e}")
+    print(f"[Warm-up] Done in {time.perf_counter() - started:.2f}s")
+
+
+if STARTUP_WARMUP:
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "5000"))
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,137 @@
+"""
+Server-Sent Events helpers
+Forwards model tokens to the browser as they arrive, followed by one final event with sources and usage
+"""
+import os
+import json
+
+from flask import Response, stream_with_context
+
+
+# Ask for token usage on streamed answers ("stream_options"); Azure OpenAI API versions before
+# 2024-09-01-preview reject it with a 400, after which streams are requested without it
+STREAM_INCLUDE_USAGE = os.getenv("STREAM_INCLUDE_USAGE", "true").lower() not in ("false", "0", "off")
+_stream_usage_supported = STREAM_INCLUDE_USAGE
+
+
+def wants_stream(request, data):
+    """
+    Whether the caller asked for a streamed response
+
+    Either {"stream": true} in the JSON body or an Accept header of text/event-stream.
+    Everyone else keeps getting the plain JSON response.
+    """
+    if data.get("stream") is True:
+        return True
+    return "text/event-stream" in (request.headers.get("Accept") or "")
+
+
+def sse_event(event, data):
+    """Format one SSE event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """
+    Wrap a generator of (event, data) tuples in a streaming response
+
+    An exception raised while streaming becomes a final 'error' event, since the
+    status code has already been sent by then.
+    """
+    def generate():
+        try:
+            for event, data in events:
+                yield sse_event(event, data)
+        except Exception as e:
+            print(f"[SSE] Stream failed: {e}")
+            yield sse_event("error", {"error": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # don't let a proxy buffer the tokens
+        },
+    )
+
+
+def usage_dict(usage):
+    """Token usage object from the OpenAI SDK as a plain dict (or None)"""
+    if usage is None:
+        return None
+    if hasattr(usage, "model_dump"):
+        return usage.model_dump(exclude_none=True)
+    return dict(usage)
+
+
+def _usage_rejected(error):
+    """True for the 400 an API version without stream_options support answers"""
+    global _stream_usage_supported
+
+    if getattr(error, "status_code", None) == 400 and "stream_options" in str(error):
+        print("[Streaming] The API version does not accept stream_options; streaming without usage")
+        _stream_usage_supported = False
+        return True
+    return False
+
+
+def _create_stream(client, kwargs):
+    if _stream_usage_supported:
+        try:
+            return client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+        except Exception as e:
+            if not _usage_rejected(e):
+                raise
+    return client.chat.completions.create(stream=True, **kwargs)
+
+
+async def _create_stream_async(client, kwargs):
+    if _stream_usage_supported:
+        try:
+            return await client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+        except Exception as e:
+            if not _usage_rejected(e):
+                raise
+    return await client.chat.completions.create(stream=True, **kwargs)
+
+
+def stream_chat_completion(client, **kwargs):
+    """
+    Stream a chat completion
+
+    Usage is requested with stream_options unless STREAM_INCLUDE_USAGE is off; when the API
+    version rejects that, the call is retried once without it and usage is reported as None.
+
+    Args:
+        client: OpenAI or AzureOpenAI client
+        **kwargs: Arguments for chat.completions.create (model, messages, ...)
+
+    Yields:
+        tuple: ("token", text) for each content delta, then ("usage", dict or None)
+    """
+    stream = _create_stream(client, kwargs)
+    usage = None
+    for chunk in stream:
+        # The last chunk carries usage and no choices
+        if getattr(chunk, "usage", None):
+            usage = usage_dict(chunk.usage)
+        for choice in chunk.choices or []:
+            text = choice.delta.content if choice.delta else None
+            if text:
+                yield "token", text
+    yield "usage", usage
+
+
+async def stream_chat_completion_async(client, **kwargs):
+    """stream_chat_completion for an AsyncOpenAI client (used by the ASGI server)"""
+    stream = await _create_stream_async(client, kwargs)
+    usage = None
+    async for chunk in stream:
+        if getattr(chunk, "usage", None):
+            usage = usage_dict(chunk.usage)
+        for choice in chunk.choices or []:
+            text = choice.delta.content if choice.delta else None
+            if text:
+                yield "token", text
+    yield "usage", usage
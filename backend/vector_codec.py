@@ -0,0 +1,109 @@
+"""
+Compact embedding encodings
+Stores embeddings as base64-packed float32/float16/int8 instead of a JSON list of floats,
+and decodes them straight into NumPy arrays for retrieval
+"""
+import os
+import base64
+import struct
+from array import array
+
+import numpy as np
+
+
+# "json" (a plain list, the original format), "float32", "float16" or "int8"
+EMBEDDING_ENCODING = os.getenv("EMBEDDING_ENCODING", "json").lower()
+ENCODINGS = ("json", "float32", "float16", "int8")
+
+# Little-endian element types of the packed encodings
+_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2"), "int8": np.dtype("i1")}
+# int8 payloads start with the float32 scale that maps the int8 values back to floats
+_INT8_HEADER = struct.Struct("<f")
+
+
+def _pack(vector, encoding):
+    if encoding == "float32":
+        return struct.pack(f"<{len(vector)}f", *vector)
+    if encoding == "float16":
+        return struct.pack(f"<{len(vector)}e", *vector)
+    if encoding == "int8":
+        # Symmetric per-vector scale: the largest magnitude maps to 127
+        scale = max((abs(x) for x in vector), default=0.0) / 127 or 1.0
+        return _INT8_HEADER.pack(scale) + array("b", [round(x / scale) for x in vector]).tobytes()
+    raise ValueError(f"Unknown embedding encoding '{encoding}'. Use one of: {', '.join(ENCODINGS)}")
+
+
+def encode_embedding(document, vector, encoding=None):
+    """
+    Store an embedding on a document in the configured encoding
+
+    Sets 'embedding' (a list for "json", otherwise a base64 string) and, for packed encodings,
+    'embeddingEncoding'.
+
+    Args:
+        document (dict): The document to update
+        vector (list): The embedding
+        encoding (str, optional): Overrides EMBEDDING_ENCODING
+
+    Raises:
+        ValueError: If the encoding is unknown
+    """
+    encoding = encoding or EMBEDDING_ENCODING
+    if encoding == "json":
+        document["embedding"] = [float(x) for x in vector]
+        document.pop("embeddingEncoding", None)
+        return
+    document["embedding"] = base64.b64encode(_pack(vector, encoding)).decode("ascii")
+    document["embeddingEncoding"] = encoding
+
+
+def decode_embedding(value, encoding=None):
+    """
+    Decode a stored embedding
+
+    Packed float32/float16 values are returned as read-only views over the decoded bytes
+    (no per-element parsing or copying); int8 values are scaled into a new float32 array.
+
+    Args:
+        value (list or str): The document's 'embedding'
+        encoding (str, optional): The document's 'embeddingEncoding' (None for a JSON list)
+
+    Returns:
+        np.ndarray: The embedding
+
+    Raises:
+        ValueError: If the encoding is unknown
+    """
+    if not encoding or encoding == "json":
+        return np.asarray(value, dtype=np.float32)
+    if encoding not in _DTYPES:
+        raise ValueError(f"Unknown embedding encoding '{encoding}'")
+
+    raw = base64.b64decode(value)
+    if encoding == "int8":
+        (scale,) = _INT8_HEADER.unpack_from(raw)
+        return np.frombuffer(raw, dtype=_DTYPES["int8"], offset=_INT8_HEADER.size).astype(np.float32) * scale
+    return np.frombuffer(raw, dtype=_DTYPES[encoding])
+
+
+def stack_embeddings(items):
+    """
+    Decode the embeddings of many items into one float32 matrix
+
+    Items may mix encodings (e.g. halfway through a migration).
+
+    Args:
+        items (list): Items carrying 'embedding' and optionally 'embeddingEncoding'
+
+    Returns:
+        np.ndarray: (len(items), dimensions) float32 matrix
+    """
+    if not items:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    first = decode_embedding(items[0]["embedding"], items[0].get("embeddingEncoding"))
+    matrix = np.empty((len(items), first.shape[0]), dtype=np.float32)
+    matrix[0] = first
+    for row, item in enumerate(items[1:], start=1):
+        matrix[row] = decode_embedding(item["embedding"], item.get("embeddingEncoding"))
+    return matrix
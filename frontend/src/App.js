@@ -1,7 +1,7 @@
 import React, { useState, useRef, useEffect } from 'react';
 import './App.css';
 import ChatMessage from './components/ChatMessage';
-import { sendMessageToAI, uploadExcelFile, ragQuery, uploadPolicyDocuments, getUploadedFiles } from './services/api';
+import { sendMessageToAI, uploadExcelFile, ragQuery, uploadPolicyDocuments, getUploadedFiles, getChatHistory, newSessionId } from './services/api';
 import { MsalProvider, useMsal } from "@azure/msal-react";
 import { msalInstance } from "./msalConfig";
 import AuthenticationComponent, { useBypassAuth } from './components/AuthenticationComponent';
@@ -23,6 +23,16 @@ function AppContent() {
   const [sidebarCollapsed, setSidebarCollapsed] = useState(false);
   const [isLoading, setIsLoading] = useState(false);
   const [modelSource, setModelSource] = useState('azure'); // 'azure' or 'postgres'
+  // The server keeps the conversation for this session, so only new messages are sent
+  const [sessionId, setSessionId] = useState(() => {
+    const saved = localStorage.getItem('chatSessionId');
+    if (saved) {
+      return saved;
+    }
+    const created = newSessionId();
+    localStorage.setItem('chatSessionId', created);
+    return created;
+  });
   const messagesEndRef = useRef(null);
   const settingsRef = useRef(null);
 
@@ -48,6 +58,26 @@ function AppContent() {
     fetchFiles();
   }, []);
 
+  useEffect(() => {
+    // Restore the conversation of the current session after a reload
+    const fetchHistory = async () => {
+      try {
+        const history = await getChatHistory(sessionId);
+        if (history && history.messages.length > 0) {
+          setMessages(history.messages.map((msg, i) => ({
+            id: i,
+            role: msg.role,
+            content: msg.content,
+            timestamp: msg.timestamp
+          })));
+        }
+      } catch (error) {
+        // Start with an empty chat; new messages still go to the session
+      }
+    };
+    fetchHistory();
+  }, [sessionId]);
+
   useEffect(() => {
     function handleClickOutside(e) {
       if (showSettings && settingsRef.current && !settingsRef.current.contains(e.target) && !e.target.closest('.settings-button')) {
@@ -125,22 +155,48 @@ function AppContent() {
     setInputMessage('');
     setIsLoading(true);
 
+    // The assistant reply is shown as it streams in and replaced by the final text
+    const assistantId = Date.now() + 1;
+    const showAssistantMessage = (update) => {
+      setMessages(prev => {
+        const existing = prev.find(msg => msg.id === assistantId);
+        const base = existing || {
+          id: assistantId,
+          role: 'assistant',
+          content: '',
+          timestamp: new Date().toISOString()
+        };
+        const next = { ...base, ...update(base) };
+        return existing
+          ? prev.map(msg => (msg.id === assistantId ? next : msg))
+          : [...prev, next];
+      });
+    };
+    const onToken = (text) => {
+      showAssistantMessage(msg => ({ content: msg.content + text }));
+    };
+    const resetStream = () => {
+      setMessages(prev => prev.filter(msg => msg.id !== assistantId));
+    };
+
     try {
       let assistantContent;
 
       if (modelSource === 'postgres') {
         // Route to Postgres AI; if not configured, fall back to Azure path
         try {
-          const response = await sendMessageToAI(inputMessage, messages, 'postgres');
+          const response = await sendMessageToAI(inputMessage, messages, 'postgres', onToken, sessionId);
           assistantContent = response.message;
         } catch (err) {
           const msg = err?.message || '';
           if (msg.includes('Postgres AI not configured')) {
-            const ragResult = await ragQuery(inputMessage);
+            resetStream();
+            const ragResult = await ragQuery(inputMessage, onToken, sessionId);
             if (ragResult && ragResult.answer) {
               assistantContent = ragResult.answer;
             } else {
-              const response = await sendMessageToAI(inputMessage, messages, 'azure');
+              resetStream();
+              const response = await sendMessageToAI(inputMessage, messages, 'azure', onToken, sessionId);
               assistantContent = response.message;
             }
           } else {
@@ -149,36 +205,25 @@ function AppContent() {
         }
       } else {
         // Azure path: try RAG first, then fallback chat
-        const ragResult = await ragQuery(inputMessage);
+        const ragResult = await ragQuery(inputMessage, onToken, sessionId);
 
         if (ragResult && ragResult.answer) {
           assistantContent = ragResult.answer;
         } else {
-          const response = await sendMessageToAI(inputMessage, messages, 'azure');
+          resetStream();
+          const response = await sendMessageToAI(inputMessage, messages, 'azure', onToken, sessionId);
           assistantContent = response.message;
         }
       }
-      
-      const assistantMessage = {
-        id: Date.now() + 1,
-        role: 'assistant',
-        content: assistantContent,
-        timestamp: new Date().toISOString()
-      };
-
-      setMessages(prev => [...prev, assistantMessage]);
+
+      showAssistantMessage(() => ({ content: assistantContent }));
     } catch (error) {
       console.error('Error sending message:', error);
-      
-      const errorMessage = {
-        id: Date.now() + 1,
-        role: 'assistant',
+
+      showAssistantMessage(() => ({
         content: 'Sorry, I encountered an error. Please try again.',
-        timestamp: new Date().toISOString(),
         isError: true
-      };
-
-      setMessages(prev => [...prev, errorMessage]);
+      }));
     } finally {
       setIsLoading(false);
     }
@@ -186,6 +231,9 @@ function AppContent() {
 
   const handleClearChat = () => {
     setMessages([]);
+    const created = newSessionId();
+    localStorage.setItem('chatSessionId', created);
+    setSessionId(created);
   };
 
   const handleClientFileChange = (e) => {
@@ -11,16 +11,25 @@ const api = axios.create({
   },
 });
 
+// Acquire an access token for the signed-in account (null when signed out)
+const getAccessToken = async () => {
+  const accounts = msalInstance.getAllAccounts();
+  if (accounts.length === 0) {
+    return null;
+  }
+  const response = await msalInstance.acquireTokenSilent({
+    scopes: ["openid", "profile", "email"],
+    account: accounts[0],
+  });
+  return response.accessToken;
+};
+
 // Add token to every request
 api.interceptors.request.use(async (config) => {
   try {
-    const accounts = msalInstance.getAllAccounts();
-    if (accounts.length > 0) {
-      const response = await msalInstance.acquireTokenSilent({
-        scopes: ["openid", "profile", "email"],
-        account: accounts[0],
-      });
-      config.headers.Authorization = `Bearer ${response.accessToken}`;
+    const token = await getAccessToken();
+    if (token) {
+      config.headers.Authorization = `Bearer ${token}`;
     }
   } catch (error) {
     console.error('Error acquiring token:', error);
@@ -31,6 +40,95 @@ api.interceptors.request.use(async (config) => {
   return Promise.reject(error);
 });
 
+/**
+ * POST a request with streaming enabled and read the Server-Sent Events
+ *
+ * Calls onToken with each text fragment and resolves with the final 'done' event.
+ * Servers (or proxies) that answer with plain JSON are handled too: that JSON is returned as-is.
+ * Errors are thrown in the same shape axios uses ({ response: { status, data } }) so
+ * callers can share their error handling.
+ */
+const postStream = async (path, body, onToken) => {
+  const headers = {
+    'Content-Type': 'application/json',
+    Accept: 'text/event-stream',
+  };
+  try {
+    const token = await getAccessToken();
+    if (token) {
+      headers.Authorization = `Bearer ${token}`;
+    }
+  } catch (error) {
+    console.error('Error acquiring token:', error);
+  }
+
+  let response;
+  try {
+    response = await fetch(`${API_BASE_URL}${path}`, {
+      method: 'POST',
+      headers,
+      body: JSON.stringify({ ...body, stream: true }),
+    });
+  } catch (error) {
+    throw Object.assign(new Error(error.message), { request: true });
+  }
+
+  const contentType = response.headers.get('Content-Type') || '';
+  if (!response.ok || !contentType.includes('text/event-stream') || !response.body) {
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+      throw Object.assign(new Error(data.error), { response: { status: response.status, data } });
+    }
+    return data;
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result = null;
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) {
+      break;
+    }
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      raw.split('\n').forEach((line) => {
+        if (line.startsWith('event:')) {
+          event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+          data += line.slice(5).trim();
+        }
+      });
+      const payload = data ? JSON.parse(data) : {};
+
+      if (event === 'token') {
+        if (onToken) {
+          onToken(payload.text);
+        }
+      } else if (event === 'done') {
+        result = payload;
+      } else if (event === 'error') {
+        throw Object.assign(new Error(payload.error), { response: { status: 500, data: payload } });
+      }
+    }
+  }
+
+  if (!result) {
+    throw Object.assign(new Error('Stream ended early'), { request: true });
+  }
+  return result;
+};
+
 /**
  * Send a message to the AI backend
  * 
@@ -38,18 +136,31 @@ api.interceptors.request.use(async (config) => {
  * 
  * @param {string} message - The user's message
  * @param {Array} conversationHistory - Previous messages in the conversation
- * @returns {Promise<Object>} - Response from the AI
+ * @param {string} model - 'azure' or 'postgres'
+ * @param {Function} onToken - Optional callback receiving the reply as it streams in;
+ *                             without it the reply arrives as one JSON response
+ * @param {string} sessionId - Optional server-side session; when given the server keeps
+ *                             the history and conversationHistory is not sent
+ * @returns {Promise<Object>} - Response from the AI ({ message, usage?, sessionId? })
  */
-export const sendMessageToAI = async (message, conversationHistory = [], model = 'azure') => {
-  try {
-    const response = await api.post('/api/chat', {
+export const sendMessageToAI = async (message, conversationHistory = [], model = 'azure', onToken, sessionId) => {
+  const body = sessionId
+    ? { message, model, sessionId }
+    : {
       message,
       model,
       conversationHistory: conversationHistory.map(msg => ({
         role: msg.role,
         content: msg.content
       }))
-    });
+    };
+
+  try {
+    if (onToken && typeof fetch === 'function' && typeof TextDecoder === 'function') {
+      return await postStream('/api/chat', body, onToken);
+    }
+
+    const response = await api.post('/api/chat', body);
 
     return response.data;
   } catch (error) {
@@ -75,21 +186,38 @@ export const sendMessageToAI = async (message, conversationHistory = [], model =
  * Additional API functions you might need:
  */
 
-// Get chat history from server
+// Create an id for a new server-side chat session
+export const newSessionId = () => (
+  window.crypto?.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(36).slice(2)}`
+);
+
+// Get chat history from server (null when the session doesn't exist yet)
 export const getChatHistory = async (sessionId) => {
   try {
     const response = await api.get(`/api/chat/history/${sessionId}`);
     return response.data;
   } catch (error) {
+    if (error.response && error.response.status === 404) {
+      return null;
+    }
     console.error('Error fetching chat history:', error);
     throw error;
   }
 };
 
-// Save chat session
-export const saveChatSession = async (messages) => {
+// Save chat session (replaces the messages stored for sessionId, or creates a new session)
+export const saveChatSession = async (messages, sessionId) => {
   try {
-    const response = await api.post('/api/chat/save', { messages });
+    const response = await api.post('/api/chat/save', {
+      sessionId,
+      messages: messages.map(msg => ({
+        role: msg.role,
+        content: msg.content,
+        timestamp: msg.timestamp
+      }))
+    });
     return response.data;
   } catch (error) {
     console.error('Error saving chat session:', error);
@@ -98,11 +226,43 @@ export const saveChatSession = async (messages) => {
 };
 
 
+/**
+ * Get the status of a background upload job
+ * @param {string} jobId - Id returned by an upload endpoint
+ */
+export const getJobStatus = async (jobId) => {
+  const response = await api.get(`/api/jobs/${jobId}`);
+  return response.data;
+};
+
+/**
+ * Poll a background upload job until it finishes
+ * @param {string} jobId - Id returned by an upload endpoint
+ * @param {Function} onProgress - Optional callback receiving each status update
+ * @returns {Promise<Object>} - The job's final result
+ */
+export const waitForJob = async (jobId, onProgress, intervalMs = 1000) => {
+  for (;;) {
+    const job = await getJobStatus(jobId);
+    if (onProgress) {
+      onProgress(job);
+    }
+    if (job.status === 'completed') {
+      return job.result;
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Upload failed');
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+};
+
 /**
  * Upload Excel/CSV file to backend
  * @param {File} file   The uploaded file object from frontend input
+ * @param {Function} onProgress  Optional callback receiving job status updates
  */
-export const uploadExcelFile = async (file) => {
+export const uploadExcelFile = async (file, onProgress) => {
   try {
     const formData = new FormData();
     formData.append("file", file);      // REQUIRED — backend expects this key
@@ -116,6 +276,10 @@ export const uploadExcelFile = async (file) => {
       }
     );
 
+    // The server processes the file in the background
+    if (response.data.jobId) {
+      return await waitForJob(response.data.jobId, onProgress);
+    }
     return response.data;
   } catch (error) {
     console.error("Upload failed:", error);
@@ -123,15 +287,22 @@ export const uploadExcelFile = async (file) => {
     if (error.response) {
       throw new Error(error.response.data.error);
     }
-    throw new Error("Unable to upload file.");
+    throw new Error(error.message || "Unable to upload file.");
   }
 };
 
 // RAG Query function
-export const ragQuery = async (question) => {
+export const ragQuery = async (question, onToken, sessionId) => {
   try {
+    if (onToken && typeof fetch === 'function' && typeof TextDecoder === 'function') {
+      const result = await postStream('/api/rag-query', { question, sessionId }, onToken);
+      // The stream's final event names the answer 'message'
+      return { answer: result.message ?? result.answer, ...result };
+    }
+
     const response = await api.post('/api/rag-query', {
-      question
+      question,
+      sessionId
     });
     return response.data;
   } catch (error) {
@@ -146,6 +317,20 @@ export const ragQuery = async (question) => {
   }
 };
 
+/**
+ * Get the full content of answer sources (answers only carry ids, names and snippets)
+ * @param {string[]} ids - Source ids from a RAG answer's 'sources'
+ * @param {number} page - Page number, from 1
+ * @param {number} pageSize - Sources per page
+ * @returns {Promise<Object>} - { sources, missing, page, pageSize, total, nextPage }
+ */
+export const getSources = async (ids, page = 1, pageSize = 10) => {
+  const response = await api.get('/api/sources', {
+    params: { ids: ids.join(','), page, pageSize },
+  });
+  return response.data;
+};
+
 /**
  * Get uploaded files for a user
  */
@@ -162,8 +347,9 @@ export const getUploadedFiles = async () => {
 /**
  * Upload policy documents (PDF, DOCX, DOC, TXT) to backend
  * @param {File[]} files - Array of policy document files
+ * @param {Function} onProgress - Optional callback receiving job status updates
  */
-export const uploadPolicyDocuments = async (files) => {
+export const uploadPolicyDocuments = async (files, onProgress) => {
   try {
     const formData = new FormData();
     
@@ -180,6 +366,10 @@ export const uploadPolicyDocuments = async (files) => {
       }
     );
 
+    // The server processes the files in the background
+    if (response.data.jobId) {
+      return await waitForJob(response.data.jobId, onProgress);
+    }
     return response.data;
   } catch (error) {
     console.error("Policy document upload failed:", error);
@@ -187,7 +377,7 @@ export const uploadPolicyDocuments = async (files) => {
     if (error.response) {
       throw new Error(error.response.data.error || "Upload failed");
     }
-    throw new Error("Unable to upload policy documents.");
+    throw new Error(error.message || "Unable to upload policy documents.");
   }
 };
 
@@ -3,11 +3,21 @@
 import json
 import logging
 import os
+from typing import List
 import azure.functions as func
 from azure.cosmos import CosmosClient
 
 from openai import AzureOpenAI
 
+from ..shared_code.chunking import chunk_text, CHUNK_SIZE
+from ..shared_code.cosmos_bulk import bulk_upsert, bulk_delete
+from ..shared_code.embedding_cache import get_embedding_cache
+from ..shared_code.embeddings import embed_texts
+from ..shared_code.vector_codec import encode_embedding
+
+# embed_texts reads the deployment from the environment; keep this function's historical default
+os.environ.setdefault("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT", "text-embedding-ada-002")
+
 openai_client = AzureOpenAI(
     api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
     azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
@@ -21,44 +31,87 @@ CONTAINER_NAME = os.environ["COSMOS_CONTAINER_NAME"]
 # For your container this should be "/userId"
 PK_PATH = os.getenv("COSMOS_PARTITION_KEY_PATH", "/userId")
 
+# One Cosmos client per worker process, reused by every invocation
+_container = None
+
+def _get_container():
+    global _container
+    if _container is None:
+        client = CosmosClient(COSMOS_ENDPOINT, COSMOS_KEY)
+        _container = client.get_database_client(DB_NAME).get_container_client(CONTAINER_NAME)
+    return _container
+
 def _pk_field_name(path: str) -> str:
     # Converts "/userId" -> "userId"
     return path.lstrip("/")
 
-def main(myQueueItem: str) -> None:
-    logging.info("=== Queue item received ===")
-    logging.info("Raw message: %s", myQueueItem)
-    logging.info("Message type: %s", type(myQueueItem))
-    logging.info("Message length: %d", len(myQueueItem) if isinstance(myQueueItem, str) else 0)
-    logging.info("Cosmos: %s / %s | PK path: %s", DB_NAME, CONTAINER_NAME, PK_PATH)
+def _delete_chunks(container, parent_id: str, pk_value, keep=()) -> int:
+    # Chunk items written for a long document carry parentId = the document id;
+    # the ids in keep were just rewritten and stay
+    chunk_ids = [item["id"] for item in container.query_items(
+        query="SELECT c.id FROM c WHERE c.parentId = @parentId",
+        parameters=[{"name": "@parentId", "value": parent_id}],
+        partition_key=pk_value,
+    ) if item["id"] not in keep]
+    if not chunk_ids:
+        return 0
+    return len(bulk_delete(container, pk_value, chunk_ids).written)
 
-    # Parse message
-    try:
-        msg = json.loads(myQueueItem)
-        logging.info("Successfully parsed JSON message")
-    except (json.JSONDecodeError, TypeError) as e:
-        logging.exception("Queue message is not valid JSON: %s", myQueueItem)
-        raise
+def _has_chunks(document: dict) -> bool:
+    # Policy documents may have chunk items from an earlier, longer version (chunk items
+    # themselves, sent already chunked by the backend, carry parentId)
+    return (document.get("documentType") == "policyDocument" and PK_PATH != "/id"
+            and "parentId" not in document)
+
+def _build_chunks(document: dict, pk_field: str) -> list:
+    # Long content is embedded chunk by chunk; each chunk is its own item linked to the parent
+    # (embeddings are added by _embed_items together with the rest of the batch)
+    chunks = chunk_text(document["content"])
+    chunk_docs = []
+    for chunk_index, chunk in enumerate(chunks):
+        chunk_doc = {
+            "id": f"{document['id']}-chunk-{chunk_index:04d}",
+            pk_field: document.get(pk_field),
+            "documentType": document.get("documentType"),
+            "title": document.get("title"),
+            "content": chunk["content"],
+            "fileName": document.get("fileName") or document["id"],
+            "parentId": document["id"],
+            "chunkIndex": chunk_index,
+            "chunkCount": len(chunks),
+            "pageStart": chunk["pageStart"],
+            "pageEnd": chunk["pageEnd"],
+            "version": document.get("version"),
+        }
+        if "uploadedAt" in document:
+            chunk_doc["uploadedAt"] = document["uploadedAt"]
+        chunk_docs.append(chunk_doc)
+    return chunk_docs
 
+def _parse_items(msg: dict) -> List[dict]:
+    # A batch message carries "items"; a single-document message is the item itself
+    if "items" in msg:
+        return [{"action": msg.get("action", "upsert"), "version": msg.get("version", "latest"), **item}
+                for item in msg["items"]]
+    return [msg]
+
+def _build_document(item: dict, pk_field: str) -> dict:
     # Extract core fields
-    action = msg.get("action", "upsert")
-    version = msg.get("version", "latest")
-    data = msg.get("data") or {}
-    doc_id = msg.get("id") or data.get("id")
+    data = item.get("data") or {}
+    doc_id = item.get("id") or data.get("id")
     if not doc_id:
         raise ValueError("Message must include 'id' or data.id")
 
     # Build document to write
     document = {**data}
     document["id"] = doc_id
-    document["version"] = version
+    document["version"] = item.get("version", "latest")
 
     # Ensure required partition key field is present (e.g., userId)
-    pk_field = _pk_field_name(PK_PATH)  # "userId" in your case
     if pk_field not in document:
         # Allow providing PK at top-level, e.g., msg["userId"]
-        if pk_field in msg:
-            document[pk_field] = msg[pk_field]
+        if pk_field in item:
+            document[pk_field] = item[pk_field]
         else:
             # If PK is not /id, we must have it explicitly
             if PK_PATH != "/id":
@@ -66,47 +119,131 @@ def main(myQueueItem: str) -> None:
                     f"Missing required partition key field '{pk_field}' for container with PK '{PK_PATH}'. "
                     f"Include it in 'data' or as a top-level field."
                 )
+    return document
+
+def _embed_items(items: List[dict]) -> None:
+    # One embed_texts call for the whole batch: cached texts are skipped, the rest go in few requests
+    targets = [item for item in items if (item.get("content") or "").strip()]
+    if not targets:
+        return
+    vectors, errors = embed_texts(openai_client, [item["content"] for item in targets])
+    for position, (item, vector) in enumerate(zip(targets, vectors)):
+        if vector is not None:
+            encode_embedding(item, vector)
+        else:
+            # The item is still saved, just without embedding
+            logging.error("Failed to create embedding for %s: %s", item["id"], errors.get(position))
+
+def _delete(container, document: dict, pk_field: str) -> None:
+    # Use the correct partition key value for delete
+    pk_value = document.get(pk_field, document.get("id"))
+    result = bulk_delete(container, pk_value, [document["id"]])
+    if result.failed:
+        raise RuntimeError(f"Failed to delete document {document['id']}: {result.failed[document['id']]}")
+    logging.info("Deleted document: %s (PK %s=%s)", document["id"], pk_field, pk_value)
+    if PK_PATH != "/id":
+        deleted = _delete_chunks(container, document["id"], pk_value)
+        if deleted:
+            logging.info("Deleted %d chunks of document %s", deleted, document["id"])
+
+def _process(container, items: List[dict]) -> dict:
+    """
+    Apply every item of a message, isolating failures per item
+
+    Returns:
+        dict: Position of each failed item -> error message
+    """
+    pk_field = _pk_field_name(PK_PATH)  # "userId" in your case
+    failures = {}
+    upserts = []  # (position, document, items to write)
 
-    # Connect to Cosmos and write
-    client = CosmosClient(COSMOS_ENDPOINT, COSMOS_KEY)
-    container = client.get_database_client(DB_NAME).get_container_client(CONTAINER_NAME)
-
-    if action == "delete":
-        # Use the correct partition key value for delete
-        pk_value = document.get(pk_field, document.get("id"))
-        container.delete_item(item=document["id"], partition_key=pk_value)
-        logging.info("Deleted document: %s (PK %s=%s)", document["id"], pk_field, pk_value)
-    else:
-        # First upsert the document without embedding
-        container.upsert_item(document)
-        logging.info("Upserted document: %s (PK %s=%s)", document["id"], pk_field, document.get(pk_field))
-        
-        # Try to create embedding from content (non-blocking)
-        if "content" in document:
+    for position, item in enumerate(items):
+        try:
+            document = _build_document(item, pk_field)
+            if item.get("action", "upsert") == "delete":
+                _delete(container, document, pk_field)
+                continue
+
+            to_write = [document]
+            content = document.get("content")
+            if content is None:
+                logging.warning("Document %s has no content field for embedding", document["id"])
+            elif not content.strip():
+                logging.warning("Document %s has empty content", document["id"])
+            elif _has_chunks(document) and len(content) > CHUNK_SIZE:
+                # Too long to embed whole: the chunks carry the embeddings instead (policy documents
+                # only, as on the direct upload path; CSV rows are always embedded whole)
+                to_write.extend(_build_chunks(document, pk_field))
+                logging.info("Built %d chunks for document %s", len(to_write) - 1, document["id"])
+            upserts.append((position, document, to_write))
+        except Exception as e:
+            logging.exception("Item %d failed", position)
+            failures[position] = str(e)
+
+    if not upserts:
+        return failures
+
+    # Embed first so every item is written once, embedding included
+    to_embed = []
+    for _, document, to_write in upserts:
+        to_embed.extend(to_write[1:] if len(to_write) > 1 else to_write)
+    _embed_items(to_embed)
+
+    # One bounded-concurrency bulk write for the whole message
+    owner = {doc["id"]: position for position, _, to_write in upserts for doc in to_write}
+    result = bulk_upsert(container, [doc for _, _, to_write in upserts for doc in to_write], pk_field=pk_field)
+
+    for doc_id, error in result.failed.items():
+        failures.setdefault(owner[doc_id], f"Failed to write item {doc_id}: {error}")
+
+    for position, document, to_write in upserts:
+        if position in failures:
+            continue
+        logging.info("Upserted document: %s (PK %s=%s) with %d item(s)",
+                     document["id"], pk_field, document.get(pk_field), len(to_write))
+        if _has_chunks(document):
+            # Only once the new version is stored: drop the chunks it no longer has (all of them
+            # when it is now short enough to be embedded whole)
             try:
-                # Truncate content to 8000 chars to avoid embedding API limits
-                content_for_embedding = document["content"][:8000]
-                
-                if not content_for_embedding.strip():
-                    logging.warning("Document %s has empty content after truncation", document["id"])
-                else:
-                    logging.info("Creating embedding for document: %s (content length: %d)", document["id"], len(content_for_embedding))
-                    
-                    emb = openai_client.embeddings.create(
-                        model=os.environ.get("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT", "text-embedding-ada-002"),
-                        input=content_for_embedding
-                    )
-
-                    # Add embedding vector to Cosmos document
-                    document["embedding"] = emb.data[0].embedding
-                    
-                    # Update document with embedding
-                    container.upsert_item(document)
-                    logging.info("Successfully updated document with embedding: %s", document["id"])
+                deleted = _delete_chunks(container, document["id"], document.get(pk_field),
+                                         keep={doc["id"] for doc in to_write})
+                if deleted:
+                    logging.info("Deleted %d stale chunks of document %s", deleted, document["id"])
             except Exception as e:
-                logging.error("Failed to create embedding for document %s: %s", document["id"], str(e))
-                # Document is already saved without embedding, so we don't fail here
-                logging.info("Document %s saved to Cosmos DB without embedding due to error", document["id"])
-        else:
-            logging.warning("Document %s has no content field for embedding", document["id"])
+                logging.exception("Stale chunk cleanup failed for %s", document["id"])
+                failures[position] = f"Failed to delete stale chunks of {document['id']}: {e}"
+    logging.info("Bulk write: %s", result.summary())
+    return failures
+
+def main(myQueueItem: str, retries: func.Out[List[str]]) -> None:
+    logging.info("=== Queue item received ===")
+    logging.info("Message length: %d", len(myQueueItem) if isinstance(myQueueItem, str) else 0)
+    logging.info("Cosmos: %s / %s | PK path: %s", DB_NAME, CONTAINER_NAME, PK_PATH)
+
+    # Parse message
+    try:
+        msg = json.loads(myQueueItem)
+        logging.info("Successfully parsed JSON message")
+    except (json.JSONDecodeError, TypeError) as e:
+        logging.exception("Queue message is not valid JSON: %s", myQueueItem)
+        raise
+
+    items = _parse_items(msg)
+    failures = _process(_get_container(), items)
+
+    if failures:
+        if "items" not in msg:
+            # Single-document message: fail the invocation so the host retries it
+            # (and moves it to the poison queue after maxDequeueCount attempts)
+            raise RuntimeError(next(iter(failures.values())))
+
+        # Batch message: the rest of the batch is done; retry each failed item as its own
+        # message so a poison item ends up alone in the poison queue
+        logging.warning("Re-queueing %d of %d item(s) individually", len(failures), len(items))
+        retries.set([json.dumps(items[position], default=str) for position in failures])
+
+    logging.info("Processed %d item(s), %d failed", len(items), len(failures))
 
+    cache = get_embedding_cache()
+    if cache:
+        logging.info("Embedding cache: %s", cache.stats())
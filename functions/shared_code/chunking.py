@@ -0,0 +1,114 @@
+"""
+Text chunking for policy documents
+Splits long documents into overlapping chunks that break on page and paragraph boundaries
+Kept in sync with backend/chunking.py
+"""
+import os
+import re
+
+
+# Page separator written by the PDF extractor
+PAGE_BREAK = "\f"
+
+# Chunk sizes are in characters
+CHUNK_SIZE = int(os.getenv("POLICY_CHUNK_SIZE", "2000"))
+CHUNK_OVERLAP = int(os.getenv("POLICY_CHUNK_OVERLAP", "200"))
+
+_PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+
+def _split_oversized(text, chunk_size):
+    """Break a paragraph that is longer than a chunk into lines, then sentences, then hard cuts"""
+    if len(text) <= chunk_size:
+        return [text]
+
+    for pattern in ("\n", _SENTENCE_SPLIT):
+        parts = text.split(pattern) if isinstance(pattern, str) else pattern.split(text)
+        parts = [p.strip() for p in parts if p.strip()]
+        if len(parts) > 1:
+            pieces = []
+            for part in parts:
+                pieces.extend(_split_oversized(part, chunk_size))
+            return pieces
+
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+
+def _segments(text, chunk_size):
+    """Yield (page_number, segment) pairs, where no segment straddles a page or exceeds a chunk"""
+    for page_number, page in enumerate(text.split(PAGE_BREAK), start=1):
+        for paragraph in _PARAGRAPH_SPLIT.split(page):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            for piece in _split_oversized(paragraph, chunk_size):
+                yield page_number, piece
+
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Split text into overlapping chunks
+
+    Paragraphs (blank-line separated) and pages (form-feed separated) are kept
+    whole where possible; a chunk only splits inside a paragraph when the
+    paragraph alone is bigger than chunk_size. Each new chunk repeats the
+    trailing paragraphs of the previous one, up to `overlap` characters.
+
+    Args:
+        text (str): Full document text
+        chunk_size (int): Target maximum chunk length in characters
+        overlap (int): Maximum characters carried over between chunks
+
+    Returns:
+        list: Dicts with 'content', 'pageStart' and 'pageEnd'
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    overlap = max(0, min(overlap, chunk_size // 2))
+
+    chunks = []
+    current = []  # (page_number, segment) pairs in the chunk being built
+    current_len = 0
+
+    def flush():
+        chunks.append({
+            "content": "\n\n".join(seg for _, seg in current),
+            "pageStart": current[0][0],
+            "pageEnd": current[-1][0],
+        })
+
+    for page_number, segment in _segments(text, chunk_size):
+        added_len = len(segment) + (2 if current else 0)
+        if current and current_len + added_len > chunk_size:
+            flush()
+
+            # Carry trailing segments into the next chunk as overlap
+            carried = []
+            carried_len = 0
+            for prev in reversed(current):
+                if carried_len + len(prev[1]) > overlap:
+                    break
+                carried.insert(0, prev)
+                carried_len += len(prev[1]) + 2
+            if not carried and overlap:
+                # Last paragraph is too long to repeat whole; repeat its tail from a word boundary
+                page, last = current[-1]
+                tail = last[-overlap:]
+                tail = tail.split(" ", 1)[-1] if " " in tail else tail
+                carried = [(page, tail)]
+                carried_len = len(tail) + 2
+            while carried and carried_len + len(segment) > chunk_size:
+                carried_len -= len(carried.pop(0)[1]) + 2
+
+            current = carried
+            current_len = max(0, carried_len - 2)
+            added_len = len(segment) + (2 if current else 0)
+
+        current.append((page_number, segment))
+        current_len += added_len
+
+    if current:
+        flush()
+
+    return chunks
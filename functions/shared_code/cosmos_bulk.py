@@ -0,0 +1,200 @@
+"""
+Bulk Cosmos DB writes
+Groups same-partition operations into transactional batches and runs them with bounded concurrency
+Kept in sync with backend/cosmos_bulk.py
+"""
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosBatchOperationError
+
+
+COSMOS_BULK_CONCURRENCY = int(os.getenv("COSMOS_BULK_CONCURRENCY", "8"))
+COSMOS_BULK_MAX_RETRIES = int(os.getenv("COSMOS_BULK_MAX_RETRIES", "5"))
+
+# Service limits for one transactional batch
+MAX_BATCH_OPERATIONS = 100
+MAX_BATCH_BYTES = 1_800_000  # a little under the 2 MB request limit
+
+_THROTTLED = 429
+_NOT_FOUND = 404
+
+
+class BulkWriteResult:
+    """Outcome and throughput of one bulk write"""
+
+    def __init__(self):
+        self.written = []
+        self.failed = {}  # id -> error message
+        self.request_charge = 0.0
+        self.elapsed = 0.0
+
+    def merge(self, written, failed, request_charge):
+        self.written.extend(written)
+        self.failed.update(failed)
+        self.request_charge += request_charge
+
+    @property
+    def docs_per_second(self):
+        return len(self.written) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def ru_per_doc(self):
+        return self.request_charge / len(self.written) if self.written else 0.0
+
+    def summary(self):
+        """JSON-friendly stats for API responses and logs"""
+        return {
+            "docsWritten": len(self.written),
+            "docsFailed": len(self.failed),
+            "seconds": round(self.elapsed, 3),
+            "docsPerSecond": round(self.docs_per_second, 1),
+            "requestCharge": round(self.request_charge, 2),
+            "ruPerDoc": round(self.ru_per_doc, 2),
+        }
+
+
+def _retry_after(err, attempt):
+    """Seconds to wait before retrying a throttled request, preferring the service's hint"""
+    headers = getattr(err, "headers", None) or {}
+    retry_ms = headers.get("x-ms-retry-after-ms")
+    if retry_ms:
+        try:
+            return float(retry_ms) / 1000.0
+        except ValueError:
+            pass
+    return min(2 ** attempt * 0.1, 5.0)
+
+
+def _split(pk, operations):
+    """Split one partition's operations into batches within the service limits"""
+    batch = []
+    batch_bytes = 0
+    for op_id, op in operations:
+        size = len(json.dumps(op[1][0], default=str)) if op[0] == "upsert" else 64
+        if batch and (len(batch) >= MAX_BATCH_OPERATIONS or batch_bytes + size > MAX_BATCH_BYTES):
+            yield pk, batch
+            batch = []
+            batch_bytes = 0
+        batch.append((op_id, op))
+        batch_bytes += size
+    if batch:
+        yield pk, batch
+
+
+def _run_single(container, pk, op, charge, max_retries):
+    """Run one operation on its own, retrying on 429; returns an error message or None"""
+    def hook(headers, _):
+        charge[0] += float(headers.get("x-ms-request-charge", 0) or 0)
+
+    for attempt in range(max_retries + 1):
+        try:
+            if op[0] == "upsert":
+                container.upsert_item(op[1][0], response_hook=hook)
+            else:
+                container.delete_item(item=op[1][0], partition_key=pk, response_hook=hook)
+            return None
+        except CosmosHttpResponseError as e:
+            if e.status_code == _NOT_FOUND and op[0] == "delete":
+                return None
+            if e.status_code == _THROTTLED and attempt < max_retries:
+                time.sleep(_retry_after(e, attempt))
+                continue
+            return str(e)
+        except Exception as e:
+            return str(e)
+    return "Throttled: retries exhausted"
+
+
+def _run_batch(container, pk, batch, max_retries):
+    """Run one transactional batch; returns (written ids, {failed id: error}, request charge)"""
+    charge = [0.0]
+
+    def hook(headers, _):
+        charge[0] += float(headers.get("x-ms-request-charge", 0) or 0)
+
+    ids = [op_id for op_id, _ in batch]
+    operations = [op for _, op in batch]
+
+    for attempt in range(max_retries + 1):
+        try:
+            container.execute_item_batch(batch_operations=operations, partition_key=pk, response_hook=hook)
+            return ids, {}, charge[0]
+        except (CosmosBatchOperationError, CosmosHttpResponseError) as e:
+            if getattr(e, "status_code", None) == _THROTTLED and attempt < max_retries:
+                time.sleep(_retry_after(e, attempt))
+                continue
+            print(f"[Cosmos Bulk] Batch of {len(batch)} failed ({getattr(e, 'status_code', None)}), "
+                  f"falling back to single writes")
+            break
+        except Exception as e:
+            print(f"[Cosmos Bulk] Batch of {len(batch)} failed ({e}), falling back to single writes")
+            break
+
+    # The batch was rolled back as a whole; isolate the failing operations
+    written = []
+    failed = {}
+    for op_id, op in batch:
+        error = _run_single(container, pk, op, charge, max_retries)
+        if error:
+            failed[op_id] = error
+        else:
+            written.append(op_id)
+    return written, failed, charge[0]
+
+
+def bulk_execute(container, operations, max_concurrency=COSMOS_BULK_CONCURRENCY, max_retries=COSMOS_BULK_MAX_RETRIES):
+    """
+    Run upserts and deletes grouped by partition key
+
+    Args:
+        container: Cosmos DB container client
+        operations (list): (partition key, op id, ("upsert", (document,)) or ("delete", (item id,))) tuples
+        max_concurrency (int): Maximum batches in flight at once
+        max_retries (int): Retries per batch or operation after a 429
+
+    Returns:
+        BulkWriteResult: Written and failed op ids plus throughput stats
+    """
+    result = BulkWriteResult()
+    if not operations:
+        return result
+
+    by_partition = {}
+    for pk, op_id, op in operations:
+        by_partition.setdefault(pk, []).append((op_id, op))
+
+    batches = [b for pk, ops in by_partition.items() for b in _split(pk, ops)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(batches)))) as pool:
+        futures = [pool.submit(_run_batch, container, pk, batch, max_retries) for pk, batch in batches]
+        for future in futures:
+            result.merge(*future.result())
+    result.elapsed = time.perf_counter() - started
+
+    print(f"[Cosmos Bulk] {len(result.written)} ops in {len(batches)} batches, {len(result.failed)} failed, "
+          f"{result.docs_per_second:.1f} docs/s, {result.ru_per_doc:.2f} RU/doc")
+    return result
+
+
+def bulk_upsert(container, documents, pk_field="userId", **kwargs):
+    """Upsert documents (each written once, embedding included) in partition batches"""
+    # A batch may not touch the same item twice; the last document for an id wins, as with sequential upserts
+    latest = {(doc[pk_field], doc["id"]): doc for doc in documents}
+    return bulk_execute(
+        container,
+        [(pk, item_id, ("upsert", (doc,))) for (pk, item_id), doc in latest.items()],
+        **kwargs
+    )
+
+
+def bulk_delete(container, pk_value, item_ids, **kwargs):
+    """Delete items of one partition in batches; missing items count as deleted"""
+    return bulk_execute(
+        container,
+        [(pk_value, item_id, ("delete", (item_id,))) for item_id in item_ids],
+        **kwargs
+    )
@@ -0,0 +1,228 @@
+"""
+Embedding cache
+In-memory LRU in front of a local SQLite file, keyed by (deployment name, normalized-text hash)
+Kept in sync with backend/embedding_cache.py
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "on").lower() not in ("off", "false", "0")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or os.path.join(tempfile.gettempdir(), "embedding-cache.sqlite3")
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+EMBEDDING_CACHE_MB = int(os.getenv("EMBEDDING_CACHE_MB", "512"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Collapse whitespace so formatting-only differences share an entry"""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def text_key(text):
+    """SHA-256 of the normalized text"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _pack(vector):
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob):
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache with hit/miss counters"""
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, memory_items=EMBEDDING_CACHE_MEMORY_ITEMS,
+                 max_bytes=EMBEDDING_CACHE_MB * 1024 * 1024):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                deployment TEXT NOT NULL,
+                key TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (deployment, key)
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._disk_bytes = self._measure()
+
+    def _measure(self):
+        return self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def _remember(self, mem_key, blob):
+        # Memory holds packed float32 bytes: ~6 KB per 1536-d vector instead of ~50 KB as a list
+        self._memory[mem_key] = blob
+        self._memory.move_to_end(mem_key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, deployment, texts):
+        """
+        Look texts up in memory, then on disk
+
+        Returns:
+            list: A vector or None for each text
+        """
+        keys = [text_key(text) for text in texts]
+        results = [None] * len(texts)
+        missing = []
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                blob = self._memory.get((deployment, key))
+                if blob is not None:
+                    self._memory.move_to_end((deployment, key))
+                    results[i] = _unpack(blob)
+                    self.memory_hits += 1
+                else:
+                    missing.append(i)
+
+            if missing:
+                found = {}
+                try:
+                    found = self._read_disk(deployment, list({keys[i] for i in missing}))
+                except sqlite3.Error as e:
+                    print(f"[Embedding Cache] Disk lookup failed: {e}")
+
+                for i in missing:
+                    blob = found.get(keys[i])
+                    if blob is None:
+                        self.misses += 1
+                        continue
+                    self._remember((deployment, keys[i]), blob)
+                    results[i] = _unpack(blob)
+                    self.disk_hits += 1
+
+        return results
+
+    def _read_disk(self, deployment, wanted):
+        found = {}
+        for start in range(0, len(wanted), 500):
+            part = wanted[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE deployment = ? "
+                f"AND key IN ({','.join('?' * len(part))})",
+                [deployment, *part]
+            ).fetchall()
+            found.update(rows)
+        if found:
+            self._db.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE deployment = ? AND key = ?",
+                [(time.time(), deployment, key) for key in found]
+            )
+            self._db.commit()
+        return found
+
+    def put_many(self, deployment, texts, vectors):
+        """Store vectors for texts in both tiers, then evict the least recently used rows past the size limit"""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if vector is None:
+                    continue
+                key = text_key(text)
+                blob = _pack(vector)
+                self._remember((deployment, key), blob)
+                rows.append((deployment, key, blob, now))
+            if not rows:
+                return
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (deployment, key, vector, last_used) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self._db.commit()
+                self._disk_bytes += sum(len(row[2]) for row in rows)
+                if self._disk_bytes > self.max_bytes:
+                    self._evict()
+            except sqlite3.Error as e:
+                print(f"[Embedding Cache] Disk write failed: {e}")
+
+    def _evict(self):
+        # The running total is approximate (replaced rows, other processes); measure before evicting
+        size = self._disk_bytes = self._measure()
+        if size <= self.max_bytes:
+            return
+        # Trim to 90% of the limit so eviction doesn't run on every insert
+        excess = size - int(self.max_bytes * 0.9)
+        victims = []
+        for key_deployment, key, length in self._db.execute(
+            "SELECT deployment, key, LENGTH(vector) FROM embeddings ORDER BY last_used"
+        ):
+            victims.append((key_deployment, key))
+            excess -= length
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM embeddings WHERE deployment = ? AND key = ?", victims)
+        self._db.commit()
+        self._disk_bytes = self._measure()
+        for victim in victims:
+            self._memory.pop(victim, None)
+
+    def stats(self):
+        """Hit/miss counters since startup"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memoryHits": self.memory_hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "hitRate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "memoryItems": len(self._memory),
+            }
+
+
+# Global instance
+_embedding_cache_instance = None
+_embedding_cache_failed = False
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Get or create the global embedding cache
+
+    Returns:
+        EmbeddingCache: The shared cache, or None when disabled or the file can't be opened
+    """
+    global _embedding_cache_instance, _embedding_cache_failed
+
+    if not EMBEDDING_CACHE_ENABLED or _embedding_cache_failed:
+        return None
+
+    with _embedding_cache_lock:
+        if _embedding_cache_instance is None:
+            try:
+                _embedding_cache_instance = EmbeddingCache()
+            except sqlite3.Error as e:
+                print(f"[Embedding Cache] Disabled, cannot open {EMBEDDING_CACHE_PATH}: {e}")
+                _embedding_cache_failed = True
+                return None
+
+    return _embedding_cache_instance
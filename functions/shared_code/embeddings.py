@@ -0,0 +1,117 @@
+"""
+Batched embedding requests
+Groups texts into batches bounded by input count and estimated tokens and embeds each batch in one call
+Kept in sync with backend/embeddings.py
+"""
+import os
+
+from .embedding_cache import get_embedding_cache
+
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "64000"))
+
+
+def estimate_tokens(text):
+    """Rough token count for English text (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def iter_batches(texts, max_items=EMBEDDING_BATCH_SIZE, max_tokens=EMBEDDING_BATCH_TOKENS):
+    """
+    Group text positions into batches
+
+    A single text larger than max_tokens still gets a batch of its own.
+
+    Args:
+        texts (list): Texts to embed
+        max_items (int): Maximum inputs per request
+        max_tokens (int): Maximum estimated tokens per request
+
+    Yields:
+        list: Positions into `texts` for each batch
+    """
+    batch = []
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _create(client, texts):
+    """One embeddings request; returns vectors in input order"""
+    response = client.embeddings.create(
+        model=os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT"),
+        input=texts
+    )
+    vectors = [None] * len(texts)
+    for item in response.data:
+        vectors[item.index] = item.embedding
+    return vectors
+
+
+def embed_texts(client, texts, max_items=EMBEDDING_BATCH_SIZE, max_tokens=EMBEDDING_BATCH_TOKENS):
+    """
+    Embed many texts with as few requests as possible
+
+    Texts already in the embedding cache are not sent at all. When a batch request
+    fails, its texts are retried one by one so a single bad input only fails itself.
+
+    Args:
+        client: OpenAI or AzureOpenAI client
+        texts (list): Non-empty texts to embed
+        max_items (int): Maximum inputs per request
+        max_tokens (int): Maximum estimated tokens per request
+
+    Returns:
+        tuple: (vectors, errors) where vectors[i] is the embedding of texts[i] or None,
+               and errors maps a failed position to its error message
+    """
+    deployment = os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT")
+    cache = get_embedding_cache()
+    vectors = cache.get_many(deployment, texts) if cache else [None] * len(texts)
+    errors = {}
+
+    pending = [i for i, vector in enumerate(vectors) if vector is None]
+    for batch in iter_batches([texts[i] for i in pending], max_items, max_tokens):
+        batch = [pending[j] for j in batch]
+        try:
+            for i, vector in zip(batch, _create(client, [texts[i] for i in batch])):
+                vectors[i] = vector
+            continue
+        except Exception as batch_err:
+            if len(batch) == 1:
+                errors[batch[0]] = str(batch_err)
+                continue
+            print(f"[Embeddings] Batch of {len(batch)} failed, retrying individually: {batch_err}")
+
+        for i in batch:
+            try:
+                vectors[i] = _create(client, [texts[i]])[0]
+            except Exception as item_err:
+                errors[i] = str(item_err)
+
+    if cache and pending:
+        cache.put_many(deployment, [texts[i] for i in pending], [vectors[i] for i in pending])
+
+    return vectors, errors
+
+
+def embed_text(client, text):
+    """
+    Embed a single text through the cache
+
+    Raises:
+        RuntimeError: If the embedding request failed
+    """
+    vectors, errors = embed_texts(client, [text])
+    if errors:
+        raise RuntimeError(errors[0])
+    return vectors[0]
@@ -0,0 +1,53 @@
+"""
+Compact embedding encodings
+Stores embeddings as base64-packed float32/float16/int8 instead of a JSON list of floats
+Kept in sync with the encoding half of backend/vector_codec.py (decoding only happens in the backend)
+"""
+import os
+import base64
+import struct
+from array import array
+
+
+# "json" (a plain list, the original format), "float32", "float16" or "int8"
+EMBEDDING_ENCODING = os.getenv("EMBEDDING_ENCODING", "json").lower()
+ENCODINGS = ("json", "float32", "float16", "int8")
+
+# int8 payloads start with the float32 scale that maps the int8 values back to floats
+_INT8_HEADER = struct.Struct("<f")
+
+
+def _pack(vector, encoding):
+    if encoding == "float32":
+        return struct.pack(f"<{len(vector)}f", *vector)
+    if encoding == "float16":
+        return struct.pack(f"<{len(vector)}e", *vector)
+    if encoding == "int8":
+        # Symmetric per-vector scale: the largest magnitude maps to 127
+        scale = max((abs(x) for x in vector), default=0.0) / 127 or 1.0
+        return _INT8_HEADER.pack(scale) + array("b", [round(x / scale) for x in vector]).tobytes()
+    raise ValueError(f"Unknown embedding encoding '{encoding}'. Use one of: {', '.join(ENCODINGS)}")
+
+
+def encode_embedding(document, vector, encoding=None):
+    """
+    Store an embedding on a document in the configured encoding
+
+    Sets 'embedding' (a list for "json", otherwise a base64 string) and, for packed encodings,
+    'embeddingEncoding'.
+
+    Args:
+        document (dict): The document to update
+        vector (list): The embedding
+        encoding (str, optional): Overrides EMBEDDING_ENCODING
+
+    Raises:
+        ValueError: If the encoding is unknown
+    """
+    encoding = encoding or EMBEDDING_ENCODING
+    if encoding == "json":
+        document["embedding"] = [float(x) for x in vector]
+        document.pop("embeddingEncoding", None)
+        return
+    document["embedding"] = base64.b64encode(_pack(vector, encoding)).decode("ascii")
+    document["embeddingEncoding"] = encoding